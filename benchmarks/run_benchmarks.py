@@ -0,0 +1,355 @@
+#  python benchmarks/run_benchmarks.py [--quick] [--output results.json] [--compare old.json]
+#
+# Measures the server hot paths against the offline fake LLM backend and saves the
+# numbers as JSON (benchmarks/results/<timestamp>_<commit>.json by default) so runs
+# from different commits can be compared with --compare.
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Any, List
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# Everything below runs offline against scratch directories; this has to happen before
+# chatapi/main are imported because they read the environment at import time.
+SCRATCH_DIR = Path(tempfile.mkdtemp(prefix="ace_bench_"))
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_RETRY_BASE_BACKOFF", "0.01")
+os.environ.setdefault("SESSION_SECRET_KEY", "benchmark-secret")
+os.environ["RENDER_DISK_MOUNT_PATH"] = str(SCRATCH_DIR)
+sys.path.insert(0, str(REPO_DIR))
+
+
+@contextlib.contextmanager
+def quiet():
+    """The app logs every step with print(); keep that out of the benchmark output."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+with quiet():
+    import questionclass as q_cl
+    import quizclass as qc
+    import tooled_llm
+
+
+def measure(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "mean_s": statistics.fmean(samples),
+        "median_s": statistics.median(samples),
+        "p95_s": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min_s": samples[0],
+        "ops_per_s": repeat / sum(samples) if sum(samples) else float("inf"),
+    }
+
+
+# ---------- Fixtures ----------
+
+def make_quiz(n_questions: int, n_sections: int, seed: int = 0) -> qc.Quiz:
+    """Synthetic bank with the generator's target mix: 50% MCQ, 30% TF, 20% short answer."""
+    rng = random.Random(seed)
+    sections = [qc.Quiz.Section(f"Section {i}") for i in range(n_sections)]
+    for i in range(n_questions):
+        kind = i % 10
+        if kind < 5:
+            q = q_cl.MultipleChoice(f"Question {i}: which option is correct?", [f"right {i}"],
+                                    [f"wrong {i} a", f"wrong {i} b", f"wrong {i} c"], f"Explanation {i}.")
+        elif kind < 8:
+            q = q_cl.TrueFalseQuestion(f"Statement {i} is true.", ["True"], ["False"], f"Explanation {i}.")
+        else:
+            q = q_cl.ShortAnswer(f"Short question {i}?", [f"answer {i}"], f"Explanation {i}.", "Be accurate.")
+        q.weight = rng.uniform(0.2, 3.0)
+        sections[i % n_sections].questions.append(q)
+    return qc.Quiz(sections, source_material="Synthetic source material. " * 200, title=f"Bench {n_questions}")
+
+
+def make_pdf(path: Path, n_pages: int, lines_per_page: int = 40):
+    """Writes a plain text PDF (Helvetica, one content stream per page) without extra dependencies."""
+    objects: List[bytes] = []
+    font_id, pages_id = 1, 2
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    objects.append(b"")  # pages object, filled in once the kids are known
+    kids = []
+    for page in range(n_pages):
+        text_ops = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in range(lines_per_page):
+            text_ops.append(f"(Page {page + 1} line {line + 1}: the quick brown fox jumps over the lazy dog.) '")
+        text_ops.append("ET")
+        stream = "\n".join(text_ops).encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content_id, font_id))
+        kids.append(len(objects))
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    catalog_id = len(objects)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_at)
+    path.write_bytes(bytes(out))
+
+
+def tool_llm_response(n_actions: int) -> str:
+    actions = [{"action": "build_mcq", "args": ["0", f"Question {i}?", "(Right)", "(Wrong a), (Wrong b)", "Because."]}
+               for i in range(n_actions)]
+    return "I will add the questions now and then wait for confirmation. " * 20 + json.dumps(actions, indent=2)
+
+
+def session_id_from(client) -> str:
+    # Starlette's session cookie is base64(json) + "." + timestamp + "." + signature
+    payload = client.cookies.get("session").split(".")[0]
+    payload += "=" * (-len(payload) % 4)
+    return json.loads(base64.b64decode(payload))["session_id"]
+
+
+# ---------- Benchmarks ----------
+
+def bench_pick_question(sizes: List[int]) -> Dict[str, Any]:
+    results = {}
+    for size in sizes:
+        with quiet():
+            quiz = make_quiz(size, n_sections=3 if size < 100 else 10)
+            repeat = 2000 if size <= 1000 else 50
+            results[f"n={size}"] = measure(lambda: quiz.pick_question(), repeat=repeat)
+            results[f"n={size},first"] = measure(lambda: quiz.pick_question(is_first_question=True), repeat=repeat)
+    return results
+
+
+def bench_dict_round_trip(sizes: List[int]) -> Dict[str, Any]:
+    results = {}
+    for size in sizes:
+        with quiet():
+            quiz = make_quiz(size, n_sections=10)
+            repeat = 200 if size <= 1000 else 5
+            results[f"to_dict,n={size}"] = measure(lambda: quiz.to_dict(), repeat=repeat)
+            data = quiz.to_dict()
+            results[f"from_dict,n={size}"] = measure(lambda: qc.Quiz.from_dict(data), repeat=repeat)
+            text = json.dumps(data)
+            results[f"json_load+from_dict,n={size}"] = measure(lambda: qc.Quiz.from_dict(json.loads(text)), repeat=repeat)
+    return results
+
+
+def bench_openpdf(page_counts: List[int]) -> Dict[str, Any]:
+    results = {}
+    for pages in page_counts:
+        pdf_path = SCRATCH_DIR / f"bench_{pages}.pdf"
+        make_pdf(pdf_path, pages)
+        with quiet():
+            results[f"pages={pages}"] = measure(lambda: qc.openpdf(str(pdf_path)), repeat=3 if pages > 100 else 10)
+    return results
+
+
+def bench_seperate_llm_response() -> Dict[str, Any]:
+    results = {}
+    with quiet():
+        llm = tooled_llm.ToolLLM(directions="benchmark")
+        for n_actions in (1, 30, 300):
+            text = tool_llm_response(n_actions)
+            results[f"actions={n_actions}"] = measure(lambda: llm.seperate_llm_response(text), repeat=500)
+    return results
+
+
+def bench_home_listing(own_files: int, other_files: int) -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+    with quiet():
+        import main
+        client = TestClient(main.app)
+        client.get("/")
+        session_id = session_id_from(client)
+        quiz_json = json.dumps(make_quiz(20, 2).to_dict())
+        for i in range(own_files):
+            (main.DATA_DIR / f"{session_id}_custom_{i:06d}.json").write_text(quiz_json)
+        for i in range(other_files):
+            (main.DATA_DIR / f"other{i:06d}_custom_x.json").write_text("{}")
+        result = measure(lambda: client.get("/"), repeat=10)
+        for path in main.DATA_DIR.glob("*_custom_*.json"):
+            path.unlink()
+    result["own_files"] = own_files
+    result["other_files"] = other_files
+    return result
+
+
+def bench_request_cycles(cycles: int, concurrency: int, bank_size: int) -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+    import httpx
+
+    with quiet():
+        import main
+        quiz_json = json.dumps(make_quiz(bank_size, 5).to_dict())
+
+    async def one_user(user_index: int, latencies: List[float]):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.get("/")
+            session_id = session_id_from(client)
+            quiz_id = f"{session_id}_custom_bench{user_index}"
+            (main.DATA_DIR / f"{quiz_id}.json").write_text(quiz_json)
+            response = await client.post(f"/api/start-quiz/{quiz_id}")
+            response.raise_for_status()
+            for _ in range(cycles):
+                start = time.perf_counter()
+                question = (await client.get("/api/question")).json()
+                answer = "A" if question.get("options") else "some answer"
+                (await client.post("/api/submit", json={"answer": answer})).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+    async def run_all() -> List[float]:
+        latencies: List[float] = []
+        await asyncio.gather(*(one_user(i, latencies) for i in range(concurrency)))
+        return latencies
+
+    with quiet():
+        # Entering the TestClient runs the app's startup hooks (background workers)
+        with TestClient(main.app):
+            wall_start = time.perf_counter()
+            latencies = asyncio.run(run_all())
+            wall = time.perf_counter() - wall_start
+        for path in main.DATA_DIR.glob("*_custom_bench*.json"):
+            path.unlink()
+
+    latencies.sort()
+    return {
+        "users": concurrency,
+        "cycles_per_user": cycles,
+        "bank_size": bank_size,
+        "fake_llm_latency_s": float(os.environ.get("LLM_FAKE_LATENCY", "0")),
+        "wall_s": wall,
+        "cycles_per_s": len(latencies) / wall if wall else float("inf"),
+        "mean_s": statistics.fmean(latencies),
+        "median_s": statistics.median(latencies),
+        "p95_s": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+# ---------- Runner ----------
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}/"))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(old_path: str, new_results: Dict[str, Any]):
+    with open(old_path, 'r') as f:
+        old = flatten(json.load(f)["results"])
+    new = flatten(new_results)
+    print(f"\n{'metric':70} {'old':>12} {'new':>12} {'new/old':>8}")
+    for name, new_value in new.items():
+        if not (name.endswith("mean_s") or name.endswith("median_s")) or name not in old:
+            continue
+        old_value = old[name]
+        ratio = new_value / old_value if old_value else float("inf")
+        print(f"{name:70} {old_value:12.6f} {new_value:12.6f} {ratio:8.2f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="AceAnything hot-path benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast sanity run")
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    pick_sizes = [10, 1000] if args.quick else [10, 1000, 100000]
+    dict_sizes = [10, 1000] if args.quick else [10, 1000, 10000]
+    pdf_pages = [20] if args.quick else [50, 500]
+    home_files = (200, 500) if args.quick else (2000, 5000)
+    cycle_users = 2 if args.quick else 8
+    cycles = 10 if args.quick else 50
+
+    benchmarks = {
+        "pick_question": lambda: bench_pick_question(pick_sizes),
+        "quiz_dict_round_trip": lambda: bench_dict_round_trip(dict_sizes),
+        "openpdf": lambda: bench_openpdf(pdf_pages),
+        "seperate_llm_response": bench_seperate_llm_response,
+        "home_listing": lambda: bench_home_listing(*home_files),
+        "question_submit_cycle": lambda: bench_request_cycles(cycles, cycle_users, bank_size=200),
+    }
+
+    results: Dict[str, Any] = {}
+    try:
+        for name, bench in benchmarks.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"running {name}...", flush=True)
+            start = time.perf_counter()
+            results[name] = bench()
+            print(f"  done in {time.perf_counter() - start:.1f}s", flush=True)
+    finally:
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "llm_backend": os.environ.get("LLM_BACKEND"),
+        },
+        "results": results,
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"results written to {output}")
+
+    for name, value in flatten(results).items():
+        if name.endswith("mean_s") or name.endswith("cycles_per_s"):
+            print(f"{name:70} {value:.6f}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main_cli()
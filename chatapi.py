@@ -1,17 +1,67 @@
-from google import genai
-from typing import List
+from typing import List, Dict, Optional, Callable, Awaitable
 from dotenv import load_dotenv
 import os
 
-from google.genai.types import Content
+from google.genai.types import Content, Part
 from google.genai import errors as genai_errors   # <-- important
+import asyncio
+import threading
 import time
+
+import llm_backend
 print("chatapi.py")
 
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_CLIENT_API_KEY")
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Every FlashChat (and so ToolLLM, TutorLLM, the ShortAnswer graders and the quiz builder)
+# gets its chats from this backend. LLM_BACKEND=fake swaps in the offline stand-in.
+backend: llm_backend.LLMBackend = llm_backend.backend_from_env()
+client = getattr(backend, "client", None)
+# Seconds before the first retry in safe_prompt/asafe_prompt; doubles every attempt.
+RETRY_BASE_BACKOFF = float(os.getenv("LLM_RETRY_BASE_BACKOFF", "10"))
+
+# History budgets count tokens roughly, at ~4 characters per token
+CHARS_PER_TOKEN = 4
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+SUMMARY_INSTRUCTIONS = """
+Summarize the conversation below for the assistant that is continuing it.
+Keep what it will need later: what the user asked, mistakes they made, topics already covered,
+and anything promised or left open. Use at most 200 words. Reply with the summary only.
+""".strip()
+
+
+llm_backend.register_fake_response(
+    "history_summary", lambda message: "The student has been working through quiz questions with the tutor's help.")
+
+
+# Awaits the background summary requests of async prompts; the app routes them through its tutor lane
+compaction_runner: Optional[Callable[..., Awaitable[str]]] = None
+
+
+def set_compaction_runner(runner: Optional[Callable[..., Awaitable[str]]]):
+    """runner(coro_fn, *args, **kwargs) awaits coro_fn(*args, **kwargs); None awaits it directly."""
+    global compaction_runner
+    compaction_runner = runner
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _content_text(item: Content) -> str:
+    return "".join(part.text or "" for part in (item.parts or []))
+
+
+def set_backend(new_backend: llm_backend.LLMBackend):
+    """Swap the backend used by FlashChats created from now on (benchmarks, load tests)."""
+    global backend, client
+    backend = new_backend
+    client = getattr(new_backend, "client", None)
+
+
+def get_backend() -> llm_backend.LLMBackend:
+    return backend
 
 # gemini-2.5-flash-preview-04-17
 # gemini-2.0-flash
@@ -19,33 +69,245 @@ client = genai.Client(api_key=GEMINI_API_KEY)
 
 
 class FlashChat:
-    def __init__(self, directions: str = "You are a helpful assistant.", model: str = "gemini-2.0-flash"):
-        self.chat = client.chats.create(model=model)
+    def __init__(self, directions: str = "You are a helpful assistant.", model: str = "gemini-2.0-flash",
+                 saved_history: Optional[List[Dict]] = None, history_token_budget: Optional[int] = None,
+                 keep_recent_turns: int = 2, request_kind: Optional[str] = None):
+        """
+        saved_history        – output of export_history(), to continue a conversation in another process
+        history_token_budget – once the turns after the directions exceed this many (estimated) tokens,
+                               the oldest are replaced by a summary, written in the background after the
+                               reply is returned; None keeps the whole history
+        keep_recent_turns    – exchanges always kept verbatim when compacting
+        request_kind         – what the requests are for (see llm_backend.register_fake_response)
+        """
+        self.model = model
+        self.backend = backend
         self.directions = directions
-        self.setup: bool = False
+        self.history_token_budget = history_token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.compactions: int = 0
+        self._compaction_lock = threading.Lock()
+        self._compacting: bool = False  # a summary request is in flight
+        self._prompting: bool = False  # a turn is in flight, so a finished summary waits for it
+        self._pending_summary = None  # (prefix, old turns, summary) waiting for the turn in flight to end
+        self._compaction_task: Optional[asyncio.Task] = None
+        self.request_kind = request_kind
+        history = self._import_history(saved_history) if saved_history else None
+        self.chat = self.backend.create_chat(model, history=history, request_kind=request_kind)
+        self.achat = None  # async twin of self.chat, created on first aprompt
+        self.async_active: bool = False  # which of chat/achat holds the latest history
+        self.setup: bool = bool(history)
+
+    def _sync_chat(self):
+        if self.async_active:
+            self.chat = self.backend.create_chat(self.model, history=self.achat.get_history(), request_kind=self.request_kind)
+            self.async_active = False
+        elif self.chat is None:
+            self.chat = self.backend.create_chat(self.model, request_kind=self.request_kind)
+        return self.chat
+
+    def _async_chat(self):
+        if not self.async_active:
+            history = self.chat.get_history() if self.chat is not None else None
+            self.achat = self.backend.create_async_chat(self.model, history=history, request_kind=self.request_kind)
+            self.async_active = True
+        return self.achat
+
+    def export_history(self) -> List[Dict]:
+        """
+        JSON-safe history. The directions message is stored as None rather than repeated,
+        since it can be large (the tutor's includes the source material).
+        """
+        exported = []
+        for item in self.raw_history():
+            text = _content_text(item)
+            if not exported and item.role == 'user' and text == self.directions:
+                text = None
+            exported.append({"role": item.role, "text": text})
+        return exported
+
+    def _import_history(self, saved_history: List[Dict]) -> List[Content]:
+        return [Content(role=item["role"], parts=[Part(text=self.directions if item["text"] is None else item["text"])])
+                for item in saved_history]
+
+    def close(self):
+        """
+        Drop the chat handles and their history. Used when a session is evicted;
+        if the FlashChat is prompted again it starts over from the directions.
+        """
+        self.chat = None
+        self.achat = None
+        self.async_active = False
+        self.setup = False
+        with self._compaction_lock:
+            self._pending_summary = None
 
     def prompt(self, message: str = "") -> str:
-        if not self.setup:
-            self.chat.send_message(self.directions)
-            self.setup = True
-        return self.safe_prompt(message)
+        self._start_turn()
+        try:
+            if not self.setup:
+                self._sync_chat().send_message(self.directions)
+                self.setup = True
+            response = self.safe_prompt(message)
+        finally:
+            self._end_turn()
+        plan = self._claim_compaction()
+        if plan is not None:
+            threading.Thread(target=self._compact, args=plan, daemon=True, name="flashchat-compaction").start()
+        return response
+
+    async def aprompt(self, message: str = "") -> str:
+        """
+        Async version of prompt. Runs on the event loop via the backend's shared async pool.
+        Cancelling the awaiting task (e.g. on client disconnect) abandons the request;
+        the chat history is only updated once a response arrives.
+        """
+        self._start_turn()
+        try:
+            if not self.setup:
+                await self._async_chat().send_message(self.directions)
+                self.setup = True
+            response = await self.asafe_prompt(message)
+        finally:
+            self._end_turn()
+        plan = self._claim_compaction()
+        if plan is not None:
+            # Not awaited: the reply goes back now and the summary replaces the old turns when it arrives
+            self._compaction_task = asyncio.get_running_loop().create_task(self._acompact(*plan))
+        return response
+
+    def _start_turn(self):
+        with self._compaction_lock:
+            self._prompting = True
+
+    def _end_turn(self):
+        with self._compaction_lock:
+            self._prompting = False
+            pending, self._pending_summary = self._pending_summary, None
+            if pending is not None:
+                self._apply_summary(*pending)
 
-    def safe_prompt(self, message: str, max_tries: int = 5, base_backoff: float = 10.0):
+    def _claim_compaction(self):
+        """The compaction plan when the history is over budget and no summary is already being written."""
+        with self._compaction_lock:
+            if self._compacting:
+                return None
+            plan = self._compaction_plan()
+            self._compacting = plan is not None
+            return plan
+
+    def _compact(self, prefix: List[Content], old: List[Content]):
+        try:
+            summary = single_prompt(self._summary_request(old), model=self.model, request_kind="history_summary")
+        except Exception as e:
+            summary = None
+            print(f"FlashChat: history compaction failed, keeping the full history: {type(e).__name__}: {e}")
+        self._summary_ready(prefix, old, summary)
+
+    async def _acompact(self, prefix: List[Content], old: List[Content]):
+        try:
+            runner = compaction_runner
+            request = self._summary_request(old)
+            if runner is None:
+                summary = await asingle_prompt(request, model=self.model, request_kind="history_summary")
+            else:
+                summary = await runner(asingle_prompt, request, model=self.model, request_kind="history_summary")
+        except Exception as e:
+            summary = None
+            print(f"FlashChat: history compaction failed, keeping the full history: {type(e).__name__}: {e}")
+        self._summary_ready(prefix, old, summary)
+
+    def _summary_ready(self, prefix: List[Content], old: List[Content], summary: Optional[str]):
+        """Applies the summary now, or at the edge of the turn in flight so no reply is lost."""
+        with self._compaction_lock:
+            self._compacting = False
+            if summary is None:
+                return
+            if self._prompting:
+                self._pending_summary = (prefix, old, summary)
+            else:
+                self._apply_summary(prefix, old, summary)
+
+    def history_tokens(self) -> int:
+        """Estimated tokens of the history after the directions."""
+        history = self.raw_history()
+        return sum(estimate_tokens(_content_text(item)) for item in history[self._prefix_length(history):])
+
+    def _prefix_length(self, history: List[Content]) -> int:
+        # The directions and their acknowledgement are never compacted
+        return 2 if history and _content_text(history[0]) == self.directions else 0
+
+    def _compaction_plan(self):
+        """
+        (prefix, old turns) when the history is over budget: the old turns are everything but the
+        newest turns that fit in half the budget (at least keep_recent_turns exchanges).
+        """
+        if not self.history_token_budget:
+            return None
+        history = self.raw_history()
+        prefix_length = self._prefix_length(history)
+        turns = history[prefix_length:]
+        costs = [estimate_tokens(_content_text(item)) for item in turns]
+        if sum(costs) <= self.history_token_budget:
+            return None
+
+        keep, kept_cost = 0, 0
+        while keep < len(turns):
+            cost = costs[-1 - keep]
+            if keep >= 2 * self.keep_recent_turns and kept_cost + cost > self.history_token_budget // 2:
+                break
+            keep += 1
+            kept_cost += cost
+        split = len(turns) - keep
+        while split < len(turns) and turns[split].role != 'user':  # keep user/model turns paired
+            split += 1
+        old = turns[:split]
+        if not old or (len(old) <= 2 and _content_text(old[0]).startswith(SUMMARY_HEADER)):
+            return None  # nothing new to fold into the summary
+        return history[:prefix_length], old
+
+    def _summary_request(self, old: List[Content]) -> str:
+        transcript = "\n".join(f"{item.role}: {_content_text(item)}" for item in old)
+        return f"{SUMMARY_INSTRUCTIONS}\n\n### CONVERSATION ###\n{transcript}"
+
+    def _apply_summary(self, prefix: List[Content], old: List[Content], summary: str):
+        # Turns added while the summary was being written are kept; history only grows at the end
+        current = self.raw_history()
+        split = len(prefix) + len(old)
+        if len(current) < split or _content_text(current[split - 1]) != _content_text(old[-1]):
+            return  # the chat was closed or restarted meanwhile
+        recent = current[split:]
+        history = prefix + [Content(role='user', parts=[Part(text=f"{SUMMARY_HEADER}\n{summary.strip()}")]),
+                            Content(role='model', parts=[Part(text="Understood.")])] + recent
+        before = self.history_tokens()
+        if self.async_active:
+            self.achat = self.backend.create_async_chat(self.model, history=history, request_kind=self.request_kind)
+            self.async_active = True
+        else:
+            self.chat = self.backend.create_chat(self.model, history=history, request_kind=self.request_kind)
+            self.async_active = False
+        self.compactions += 1
+        print(f"FlashChat: compacted {len(old)} history messages into a summary "
+              f"(~{before} -> ~{self.history_tokens()} tokens)")
+
+    def safe_prompt(self, message: str, max_tries: int = 5, base_backoff: float = None):
         """
         Send a prompt to Gemini, retrying on 503 UNAVAILABLE.
 
         chat       – your google.genai Chat object
         message    – user / system message string
         max_tries  – total attempts before giving up
-        base_backoff – seconds; real wait = base_backoff * 2**attempt
+        base_backoff – seconds; real wait = base_backoff * 2**attempt (default RETRY_BASE_BACKOFF)
         """
+        if base_backoff is None:
+            base_backoff = RETRY_BASE_BACKOFF
         print(f"FlashChat.safe_prompt called with message: {message[:100]}... (length: {len(message)})")
 
         for attempt in range(max_tries):
             print(f"Attempt {attempt + 1}/{max_tries} to send message to Gemini")
             try:
                 print("Calling Gemini API...")
-                response = self.chat.send_message(message)
+                response = self._sync_chat().send_message(message)
                 print(f"Gemini API response received, text length: {len(response.text)}")
                 print(f"Response text (first 100 chars): {response.text[:100]}...")
                 return response.text
@@ -62,9 +324,36 @@ class FlashChat:
         print("All attempts failed, returning empty string")
         return ""
 
+    async def asafe_prompt(self, message: str, max_tries: int = 5, base_backoff: float = None):
+        """
+        Async version of safe_prompt, backing off with asyncio.sleep so the event loop
+        keeps serving other conversations while this one waits to retry.
+        """
+        print(f"FlashChat.asafe_prompt called with message: {message[:100]}... (length: {len(message)})")
+        if base_backoff is None:
+            base_backoff = RETRY_BASE_BACKOFF
+
+        for attempt in range(max_tries):
+            try:
+                response = await self._async_chat().send_message(message)
+                print(f"Gemini API response received (async), text length: {len(response.text)}")
+                return response.text
+            except Exception as e:
+                print(f"Exception caught in asafe_prompt: {type(e).__name__}: {str(e)}")
+                wait = base_backoff * (2 ** attempt)  # exponential backoff
+                if attempt == max_tries - 1:
+                    print(f"Max retries reached, raising exception: {e}")
+                    raise
+
+                print(f"Gemini error. retry {attempt + 1}/{max_tries} in {wait}s…")
+                await asyncio.sleep(wait)
+
+        print("All attempts failed, returning empty string")
+        return ""
+
     def chat_history(self, user_label: str = "user> ", model_label: str = "model> ", user_end_label: str = "", model_end_label: str = "") -> str:
         history: str = ""
-        for item in self.chat.get_history():
+        for item in self.raw_history():
             message_label = user_label if item.role == 'user' else model_label
             end_label = user_end_label if item.role == 'user' else model_end_label
 
@@ -75,8 +364,24 @@ class FlashChat:
         return history
 
     def raw_history(self) -> list[Content]:
-        return self.chat.get_history()
+        chat = self.achat if self.async_active else self.chat
+        return chat.get_history() if chat is not None else []
+
+
+def single_prompt(message: str, model: str = "gemini-2.0-flash", request_kind: Optional[str] = None) -> str:
+    """
+    One stateless request (with safe_prompt's retries); nothing is remembered between calls.
+    request_kind names the feature sending it, so the fake backend can give that feature's canned answer.
+    """
+    chat = FlashChat("", model=model, request_kind=request_kind)
+    chat.setup = True  # no directions turn
+    return chat.safe_prompt(message)
+
 
+async def asingle_prompt(message: str, model: str = "gemini-2.0-flash", request_kind: Optional[str] = None) -> str:
+    chat = FlashChat("", model=model, request_kind=request_kind)
+    chat.setup = True
+    return await chat.asafe_prompt(message)
 
 
 def open_chat_with(fchat: FlashChat):
@@ -0,0 +1,122 @@
+from typing import Dict, List, Optional, Set, Tuple
+import random
+import re
+import threading
+import zlib
+
+print("dedup.py")
+
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def shingles(text: str, k: int = 5) -> Set[int]:
+    """crc32 hashes of the character k-grams of the normalized text (stable across processes)."""
+    norm = normalize_text(text)
+    if len(norm) <= k:
+        return {zlib.crc32(norm.encode("utf-8"))} if norm else set()
+    return {zlib.crc32(norm[i:i + k].encode("utf-8")) for i in range(len(norm) - k + 1)}
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """MinHash signatures over shingle sets; num_perm hash functions from a fixed seed."""
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, shingle_set: Set[int]) -> Tuple[int, ...]:
+        if not shingle_set:
+            return tuple([_MERSENNE_PRIME] * self.num_perm)
+        return tuple(min((a * s + b) % _MERSENNE_PRIME for s in shingle_set) for a, b in self._params)
+
+
+class DuplicateIndex:
+    """
+    Finds near-duplicate texts (e.g. quiz questions) without any network calls.
+
+    Texts are shingled into character 5-grams and MinHashed; LSH banding over the
+    signatures yields candidates, which are confirmed with the exact Jaccard similarity
+    of the shingle sets. Texts whose numbers differ ("7 x 8" vs "7 x 9") never count as
+    duplicates. Safe to share between threads.
+    """
+    def __init__(self, threshold: float = 0.7, num_perm: int = 64, bands: int = 16, shingle_size: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.hasher = MinHasher(num_perm)
+        self.checked = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(bands)]
+        self._entries: List[Tuple[str, Set[int], Tuple[str, ...]]] = []  # (text, shingles, numbers)
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[band * self.rows:(band + 1) * self.rows] for band in range(self.bands)]
+
+    def _find(self, shingle_set: Set[int], numbers: Tuple[str, ...], band_keys) -> Optional[Tuple[str, float]]:
+        candidates: Set[int] = set()
+        for band, key in enumerate(band_keys):
+            candidates.update(self._buckets[band].get(key, ()))
+        best = None
+        for idx in candidates:
+            text, other_shingles, other_numbers = self._entries[idx]
+            if other_numbers != numbers:
+                continue
+            similarity = jaccard(shingle_set, other_shingles)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (text, similarity)
+        return best
+
+    def find_duplicate(self, text: str) -> Optional[Tuple[str, float]]:
+        """(existing text, similarity) of the closest near-duplicate already indexed, or None."""
+        shingle_set = shingles(text, self.shingle_size)
+        band_keys = self._band_keys(self.hasher.signature(shingle_set))
+        with self._lock:
+            return self._find(shingle_set, tuple(_NUMBER_RE.findall(text)), band_keys)
+
+    def add(self, text: str):
+        shingle_set = shingles(text, self.shingle_size)
+        band_keys = self._band_keys(self.hasher.signature(shingle_set))
+        with self._lock:
+            self._insert(text, shingle_set, tuple(_NUMBER_RE.findall(text)), band_keys)
+
+    def _insert(self, text: str, shingle_set: Set[int], numbers: Tuple[str, ...], band_keys):
+        idx = len(self._entries)
+        self._entries.append((text, shingle_set, numbers))
+        for band, key in enumerate(band_keys):
+            self._buckets[band].setdefault(key, []).append(idx)
+
+    def check_and_add(self, text: str) -> Optional[Tuple[str, float]]:
+        """Index text unless it near-duplicates an indexed text; returns that duplicate if so."""
+        shingle_set = shingles(text, self.shingle_size)
+        numbers = tuple(_NUMBER_RE.findall(text))
+        band_keys = self._band_keys(self.hasher.signature(shingle_set))
+        with self._lock:
+            self.checked += 1
+            duplicate = self._find(shingle_set, numbers, band_keys)
+            if duplicate is not None:
+                self.rejected += 1
+                return duplicate
+            self._insert(text, shingle_set, numbers, band_keys)
+            return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,332 @@
+from typing import Dict, Any, Callable, Optional, List, Set
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+print("job_store.py")
+
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATES = (SUCCEEDED, FAILED)
+
+
+class JobAbort(Exception):
+    """Raised by a job handler when retrying can't help (e.g. unreadable input): the job fails at once."""
+
+
+class JobStore:
+    """
+    Durable job queue in a SQLite file. Jobs survive restarts and crashes, and several
+    worker processes can share one file: a claim is a single atomic UPDATE, and running
+    jobs carry a heartbeat so another process can tell a live job from an abandoned one.
+
+    Jobs are returned as dicts with the table's columns; "payload" is decoded JSON.
+
+    Jobs sharing a dedup_key never run at the same time: while one is running the others
+    stay queued, so a handler can reuse the first job's result instead of redoing the work.
+    """
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = str(path)
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id       TEXT PRIMARY KEY,
+                kind         TEXT NOT NULL,
+                state        TEXT NOT NULL,
+                payload      TEXT NOT NULL,
+                attempts     INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                next_run_at  REAL NOT NULL,
+                last_error   TEXT,
+                worker_id    TEXT,
+                heartbeat_at REAL,
+                created_at   REAL NOT NULL,
+                updated_at   REAL NOT NULL,
+                progress     TEXT,
+                dedup_key    TEXT
+            )""")
+        # Job files created by older versions lack the later columns
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column in ("progress", "dedup_key"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state_next_run ON jobs (state, next_run_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedup_key ON jobs (dedup_key, state)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_job(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["progress"] = json.loads(job["progress"]) if job.get("progress") else {}
+        return job
+
+    def enqueue(self, job_id: str, kind: str, payload: Dict[str, Any], max_attempts: int = 3,
+                progress: Dict[str, Any] = None, dedup_key: Optional[str] = None):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT INTO jobs (job_id, kind, state, payload, max_attempts, next_run_at, created_at, updated_at,
+                                  progress, dedup_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (job_id, kind, QUEUED, json.dumps(payload), max_attempts, now, now, now,
+                      json.dumps(progress) if progress else None, dedup_key))
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest due queued job (whose dedup_key isn't running) to running for worker_id."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            row = conn.execute("""
+                UPDATE jobs SET state = ?, worker_id = ?, heartbeat_at = ?, attempts = attempts + 1, updated_at = ?
+                WHERE job_id = (SELECT job_id FROM jobs AS queued WHERE state = ? AND next_run_at <= ?
+                                  AND (dedup_key IS NULL OR NOT EXISTS (
+                                       SELECT 1 FROM jobs AS running
+                                       WHERE running.dedup_key = queued.dedup_key AND running.state = ?))
+                                ORDER BY next_run_at, created_at LIMIT 1)
+                  AND state = ?
+                RETURNING *
+                """, (RUNNING, worker_id, now, now, QUEUED, now, RUNNING, QUEUED)).fetchone()
+        return self._to_job(row)
+
+    def heartbeat(self, job_ids: List[str], worker_id: str):
+        if not job_ids:
+            return
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND worker_id = ? AND state = ?",
+                             [(now, job_id, worker_id, RUNNING) for job_id in job_ids])
+
+    def update_progress(self, job_id: str, progress: Dict[str, Any]):
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE jobs SET progress = ?, updated_at = ? WHERE job_id = ?",
+                         (json.dumps(progress), time.time(), job_id))
+
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        """Mark the job succeeded; False if worker_id no longer holds it (it was re-queued meanwhile)."""
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("""
+                UPDATE jobs SET state = ?, last_error = NULL, updated_at = ?
+                WHERE job_id = ? AND worker_id = ? AND state = ?
+                """, (SUCCEEDED, time.time(), job_id, worker_id, RUNNING))
+            return cursor.rowcount > 0
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry_base_backoff: float,
+             retry: bool = True) -> Optional[str]:
+        """
+        Record a failed attempt. The job is re-queued with exponential backoff while it has
+        attempts left (and retry is set), otherwise marked failed. Returns the job's new state,
+        or None if worker_id no longer holds the job (it was re-queued meanwhile).
+        """
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE job_id = ? AND worker_id = ? AND state = ?",
+                               (job_id, worker_id, RUNNING)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if retry and row["attempts"] < row["max_attempts"]:
+                state = QUEUED
+                next_run_at = now + retry_base_backoff * (2 ** (row["attempts"] - 1))
+            else:
+                state, next_run_at = FAILED, now
+            cursor = conn.execute("""
+                UPDATE jobs SET state = ?, last_error = ?, next_run_at = ?, updated_at = ?
+                WHERE job_id = ? AND worker_id = ? AND state = ?
+                """, (state, error[:2000], next_run_at, now, job_id, worker_id, RUNNING))
+        return state if cursor.rowcount else None
+
+    def requeue_stale(self, stale_after: float) -> int:
+        """Put running jobs whose worker stopped heartbeating (crash, restart) back in the queue."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("""
+                UPDATE jobs SET state = ?, worker_id = NULL, next_run_at = ?, updated_at = ?
+                WHERE state = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+                """, (QUEUED, now, now, RUNNING, now - stale_after))
+            return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._to_job(self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+    def running_with_key(self, dedup_key: str) -> Optional[Dict[str, Any]]:
+        """The running job doing the work for dedup_key, if any."""
+        return self._to_job(self._conn().execute("SELECT * FROM jobs WHERE dedup_key = ? AND state = ? LIMIT 1",
+                                                 (dedup_key, RUNNING)).fetchone())
+
+    def count(self, states: tuple = (QUEUED, RUNNING)) -> int:
+        placeholders = ",".join("?" * len(states))
+        return self._conn().execute(f"SELECT COUNT(*) FROM jobs WHERE state IN ({placeholders})", states).fetchone()[0]
+
+    def active_payload_values(self, key: str) -> Set[str]:
+        """payload[key] of every queued or running job, e.g. the uploads they still need."""
+        rows = self._conn().execute("SELECT payload FROM jobs WHERE state IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        return {str(json.loads(row["payload"]).get(key)) for row in rows}
+
+    def purge_finished(self, older_than: float) -> int:
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                                  (SUCCEEDED, FAILED, time.time() - older_than))
+            return cursor.rowcount
+
+
+class JobProgress:
+    """
+    progress_callback for long jobs: report(stage, **details) merges details into the job's
+    progress dict and writes it to the store. Writes within the same stage are throttled
+    to one per min_interval seconds; a stage change is always written.
+    """
+    def __init__(self, store: JobStore, job_id: str, progress: Dict[str, Any] = None, min_interval: float = 0.25):
+        self.store = store
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self.progress: Dict[str, Any] = dict(progress or {})
+        self._last_write = 0.0
+
+    def __call__(self, stage: str, **details):
+        changed_stage = self.progress.get("stage") != stage
+        self.progress.update(details)
+        self.progress["stage"] = stage
+        now = time.monotonic()
+        if changed_stage or now - self._last_write >= self.min_interval:
+            self._last_write = now
+            try:
+                self.store.update_progress(self.job_id, dict(self.progress))
+            except Exception as e:  # progress is informational; never fail the job over it
+                print(f"JobProgress: could not record progress for {self.job_id}: {e}")
+
+
+class JobPump:
+    """
+    Feeds jobs from a JobStore into a worker_pool lane, never claiming more than the lane has
+    threads for, so unstarted jobs stay durable in the store rather than in memory.
+
+    handlers     – {kind: fn(job)}; raising marks the attempt failed
+    on_terminal  – fn(job, state) once a job succeeded or ran out of attempts (cleanup)
+    stale_after  – running jobs without a heartbeat for this long are re-queued (their worker died)
+    """
+    def __init__(self, store: JobStore, pool, lane_name: str,
+                 handlers: Dict[str, Callable[[Dict[str, Any]], None]],
+                 on_terminal: Callable[[Dict[str, Any], str], None] = None,
+                 poll_interval: float = 1.0,
+                 retry_base_backoff: float = 30.0,
+                 heartbeat_interval: float = 15.0,
+                 stale_after: float = 60.0):
+        self.store = store
+        self.pool = pool
+        self.lane_name = lane_name
+        self.handlers = handlers
+        self.on_terminal = on_terminal
+        self.poll_interval = poll_interval
+        self.retry_base_backoff = retry_base_backoff
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="job-pump", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def wake(self):
+        """Check for work now instead of at the next poll (call after enqueue)."""
+        self._wake.set()
+
+    def _loop(self):
+        last_heartbeat = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_heartbeat >= self.heartbeat_interval:
+                    with self._lock:
+                        in_flight = list(self._in_flight)
+                    self.store.heartbeat(in_flight, self.worker_id)
+                    requeued = self.store.requeue_stale(self.stale_after)
+                    if requeued:
+                        print(f"JobPump: re-queued {requeued} job(s) abandoned by a stopped worker.")
+                    last_heartbeat = time.monotonic()
+
+                capacity = self.pool.lane(self.lane_name).workers
+                while not self._stop.is_set():
+                    with self._lock:
+                        if len(self._in_flight) >= capacity:
+                            break
+                    job = self.store.claim(self.worker_id)
+                    if job is None:
+                        break
+                    with self._lock:
+                        self._in_flight.add(job["job_id"])
+                    self.pool.submit(self.lane_name, self._run, job)
+            except Exception as e:
+                print(f"JobPump: error while polling jobs: {type(e).__name__} - {e}")
+
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _run(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+        state = None
+        try:
+            handler = self.handlers.get(job["kind"])
+            if handler is None:
+                raise ValueError(f"No handler for job kind '{job['kind']}'")
+            handler(job)
+            state = SUCCEEDED if self.store.complete(job_id, self.worker_id) else None
+        except Exception as e:
+            state = self.store.fail(job_id, self.worker_id, f"{type(e).__name__}: {e}", self.retry_base_backoff,
+                                    retry=not isinstance(e, JobAbort))
+            print(f"JobPump: job {job_id} attempt {job['attempts']}/{job['max_attempts']} failed "
+                  f"({type(e).__name__}: {e}); now {state}.")
+        finally:
+            with self._lock:
+                self._in_flight.discard(job_id)
+            self._wake.set()  # a slot is free
+
+        if state is None:
+            # Re-queued as stale while this attempt ran; the run that claimed it now owns its state and cleanup
+            print(f"JobPump: job {job_id} was re-queued while this worker ran it; leaving it to its new run.")
+            return
+        if state in TERMINAL_STATES and self.on_terminal is not None:
+            try:
+                self.on_terminal(job, state)
+            except Exception as e:
+                print(f"JobPump: on_terminal failed for job {job_id}: {type(e).__name__} - {e}")
@@ -0,0 +1,353 @@
+from typing import List, Callable, Optional, Dict, Any
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from google import genai
+from google.genai import types
+from google.genai import errors as genai_errors
+
+print("llm_backend.py")
+
+
+class LLMBackend:
+    """
+    Where FlashChat gets its chat objects from.
+    A chat has send_message(str) -> response with .text, and get_history() -> list[Content].
+    Async chats are the same except send_message is a coroutine. request_kind names the
+    feature a chat is for (e.g. "grading"); only the fake backend looks at it.
+    """
+    name = "base"
+
+    def create_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        raise NotImplementedError
+
+    def create_async_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str], async_pool_size: int = 200):
+        import httpx
+        # One client for the whole process, so every FlashChat shares the same sync and async
+        # (client.aio) connection pools instead of opening sockets per conversation.
+        self.client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(async_client_args={
+                "limits": httpx.Limits(max_connections=async_pool_size,
+                                       max_keepalive_connections=async_pool_size)
+            })
+        )
+
+    def create_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        return self.client.chats.create(model=model, history=history)
+
+    def create_async_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        return self.client.aio.chats.create(model=model, history=history)
+
+
+# ---------- Offline stand-in ----------
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _content(role: str, text: str) -> types.Content:
+    return types.Content(role=role, parts=[types.Part(text=text)])
+
+
+def _history_text(history: List[types.Content], index: int) -> str:
+    if len(history) <= index or not history[index].parts:
+        return ""
+    return history[index].parts[0].text or ""
+
+
+# request_kind -> responder(message) for FakeBackend. Features that send stateless requests
+# register their canned answer next to the code that builds the request, so the fake backend
+# doesn't need to recognise their prompts.
+FAKE_RESPONSES: Dict[str, Callable[[str], str]] = {}
+
+
+def register_fake_response(request_kind: str, responder: Callable[[str], str]):
+    FAKE_RESPONSES[request_kind] = responder
+
+
+def scripted_responder(history: List[types.Content], message: str, request_kind: Optional[str] = None) -> str:
+    """
+    Default FakeBackend responder. Requests with a registered request_kind get that canned
+    answer. Conversations (grader, tutor, quiz builder, title generator) are recognised from
+    the directions sent as the first message and answered in the format each one parses,
+    so every code path can run offline.
+    """
+    canned = FAKE_RESPONSES.get(request_kind) if request_kind else None
+    if canned is not None:
+        return canned(message)
+
+    directions = _history_text(history, 0) if history else message
+
+    if not history:
+        # The directions themselves. ToolLLM expects a thought + action list.
+        return "Understood, waiting for instructions. []" if "Available tools:" in message else "Understood."
+
+    if "You're AI Grader" in directions:
+        return scripted_grade(directions, message)
+
+    if "expert quiz-writer" in directions:
+        if "### SOURCE MATERIAL ###" not in message:
+            return "The quiz is complete. []"
+        size_match = re.search(r'until hitting about (\d+) total questions', directions)
+        target = int(size_match.group(1)) if size_match else 10
+        source = message.split("### SOURCE MATERIAL ###", 1)[1]
+        return "I will build the quiz in one turn. " + json.dumps(_scripted_quiz_actions(source, target))
+
+    if "You are the Tutor" in directions:
+        # Queued context notes come first, one per line; a prompt of only notes needs no reply
+        if all(line.startswith("Context:") for line in message.strip().splitlines()):
+            return "Noted for context. []"
+        reply = "Here is some help with that question.\nThe explanation covers the key idea; review it and try again."
+        return "I will answer the student. " + json.dumps([{"action": "send_message", "args": [reply]}])
+
+    if "quiz title" in directions.lower() or "generate a concise" in message:
+        return "Generated Practice Quiz"
+
+    if "Available tools:" in directions:
+        return "Nothing to do. []"
+    return "OK."
+
+
+def scripted_grade(grader_prompt: str, answer: str) -> str:
+    """A grader response: passing when the answer and one of the prompt's sample answers contain each other."""
+    samples_match = re.search(r'Sample Answer\(s\):(.*)', grader_prompt)
+    samples = re.findall(r'"([^"]*)"', samples_match.group(1)) if samples_match else []
+    answer = answer.strip().lower()
+    if answer and any(answer in s.lower() or s.lower() in answer for s in samples):
+        return "{ \"grade\": 0.95, \"reason\": \"The answer matches the sample answer.\" }"
+    return "{ \"grade\": 0.4, \"reason\": \"The answer does not match the sample answer.\" }"
+
+
+def _scripted_quiz_actions(source: str, target: int) -> List[Dict[str, Any]]:
+    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', re.sub(r'--\s*Page\s*\d+\s*--', ' ', source)) if len(s.split()) >= 6]
+    if not sentences:
+        sentences = [f"Placeholder statement number {i} about the source material." for i in range(target)]
+
+    actions: List[Dict[str, Any]] = [{"action": "build_section", "args": ["Section A"]},
+                                     {"action": "build_section", "args": ["Section B"]}]
+    for i in range(target):
+        sentence = sentences[i % len(sentences)].replace(",", "").replace("(", "").replace(")", "")
+        words = [w for w in re.findall(r"[A-Za-z]{4,}", sentence)]
+        answer = words[len(words) // 2] if words else f"answer{i}"
+        blanked = sentence.replace(answer, "_____", 1)
+        section = str(i % 2)
+        kind = i % 10
+        if kind < 5:
+            wrong = [w for w in dict.fromkeys(words) if w != answer][:3] or ["alpha", "beta", "gamma"]
+            actions.append({"action": "build_mcq", "args": [section, f"({i}) Fill in the blank: {blanked}", f"({answer})",
+                                                            ", ".join(f"({w})" for w in wrong), sentence]})
+        elif kind < 8:
+            actions.append({"action": "build_tfq", "args": [section, f"({i}) {sentence}", "(True)", "(False)", sentence]})
+        else:
+            actions.append({"action": "build_frq", "args": [section, f"({i}) Fill in the blank: {blanked}", f"({answer})", sentence]})
+    return actions
+
+
+class _FakeChatBase:
+    def __init__(self, backend: "FakeBackend", model: str, history: Optional[List[types.Content]],
+                 request_kind: Optional[str] = None):
+        self.backend = backend
+        self.model = model
+        self.history: List[types.Content] = list(history or [])
+        self.request_kind = request_kind
+
+    def get_history(self) -> List[types.Content]:
+        return list(self.history)
+
+    def _respond(self, message: str) -> FakeResponse:
+        text = self.backend.responder(self.history, message, self.request_kind)
+        self.history.append(_content("user", message))
+        self.history.append(_content("model", text))
+        self.backend.calls += 1
+        return FakeResponse(text)
+
+
+class FakeChat(_FakeChatBase):
+    def send_message(self, message: str) -> FakeResponse:
+        delay, fail = self.backend.next_outcome()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise self.backend.unavailable_error()
+        return self._respond(message)
+
+
+class AsyncFakeChat(_FakeChatBase):
+    async def send_message(self, message: str) -> FakeResponse:
+        delay, fail = self.backend.next_outcome()
+        if delay:
+            await asyncio.sleep(delay)
+        if fail:
+            raise self.backend.unavailable_error()
+        return self._respond(message)
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic offline backend for load tests and benchmarks.
+
+    responder       – (history, message, request_kind) -> response text; defaults to scripted_responder
+    latency         – base seconds per call
+    latency_jitter  – extra uniform [0, jitter) seconds per call
+    latency_samples – recorded production latencies; when given, each call draws one of these
+    error_rate      – probability a call raises a 503 UNAVAILABLE ServerError
+    seed            – makes the latency/error sequence reproducible
+    """
+    name = "fake"
+
+    def __init__(self,
+                 responder: Callable[[List[types.Content], str, Optional[str]], str] = None,
+                 latency: float = 0.0,
+                 latency_jitter: float = 0.0,
+                 latency_samples: Optional[List[float]] = None,
+                 error_rate: float = 0.0,
+                 seed: int = 0):
+        self.responder = responder or scripted_responder
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.latency_samples = latency_samples
+        self.error_rate = error_rate
+        self.calls: int = 0
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @classmethod
+    def from_recording(cls, path: str, **kwargs) -> "FakeBackend":
+        """
+        Build a backend that replays a RecordingBackend JSONL file. Messages seen in the
+        recording get the recorded response, everything else falls through to
+        scripted_responder, and call latencies are drawn from the recorded ones.
+        """
+        recorded: Dict[str, str] = {}
+        latencies: List[float] = []
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                recorded[entry["message"]] = entry["response"]
+                latencies.append(float(entry.get("latency", 0.0)))
+
+        def recorded_responder(history: List[types.Content], message: str, request_kind: Optional[str] = None) -> str:
+            if message in recorded:
+                return recorded[message]
+            return scripted_responder(history, message, request_kind)
+
+        kwargs.setdefault("latency_samples", latencies or None)
+        return cls(responder=recorded_responder, **kwargs)
+
+    def next_outcome(self) -> (float, bool):
+        with self._rng_lock:
+            if self.latency_samples:
+                delay = self._rng.choice(self.latency_samples)
+            else:
+                delay = self.latency + (self._rng.random() * self.latency_jitter if self.latency_jitter else 0.0)
+            fail = self.error_rate > 0 and self._rng.random() < self.error_rate
+        return delay, fail
+
+    @staticmethod
+    def unavailable_error() -> Exception:
+        return genai_errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE",
+                                                        "message": "The model is overloaded. Please try again later."}})
+
+    def create_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        return FakeChat(self, model, history, request_kind)
+
+    def create_async_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        return AsyncFakeChat(self, model, history, request_kind)
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Wraps another backend and appends every exchange to a JSONL file
+    ({"directions", "message", "response", "latency"} per line) so a production
+    session can later be replayed with FakeBackend.from_recording.
+    """
+    name = "recording"
+
+    def __init__(self, inner: LLMBackend, path: str):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, history: List[types.Content], message: str, text: str, latency: float):
+        line = json.dumps({"directions": _history_text(history, 0)[:200], "message": message,
+                           "response": text, "latency": latency})
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+
+    def create_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        chat = self.inner.create_chat(model, history, request_kind)
+        backend = self
+
+        class _RecordedChat:
+            def send_message(self, message: str):
+                start = time.perf_counter()
+                previous = chat.get_history()
+                response = chat.send_message(message)
+                backend._record(previous, message, response.text, time.perf_counter() - start)
+                return response
+
+            def get_history(self):
+                return chat.get_history()
+
+        return _RecordedChat()
+
+    def create_async_chat(self, model: str, history: Optional[List[types.Content]] = None, request_kind: Optional[str] = None):
+        chat = self.inner.create_async_chat(model, history, request_kind)
+        backend = self
+
+        class _RecordedAsyncChat:
+            async def send_message(self, message: str):
+                start = time.perf_counter()
+                previous = chat.get_history()
+                response = await chat.send_message(message)
+                backend._record(previous, message, response.text, time.perf_counter() - start)
+                return response
+
+            def get_history(self):
+                return chat.get_history()
+
+        return _RecordedAsyncChat()
+
+
+def backend_from_env() -> LLMBackend:
+    """
+    LLM_BACKEND=gemini (default) | fake
+    Fake backend knobs: LLM_FAKE_LATENCY, LLM_FAKE_LATENCY_JITTER, LLM_FAKE_ERROR_RATE,
+    LLM_FAKE_SEED, LLM_FAKE_RECORDING (replay file). LLM_RECORD_PATH wraps either backend
+    in a RecordingBackend.
+    """
+    kind = os.getenv("LLM_BACKEND", "gemini").lower()
+    if kind == "fake":
+        fake_kwargs = {
+            "latency": float(os.getenv("LLM_FAKE_LATENCY", "0")),
+            "latency_jitter": float(os.getenv("LLM_FAKE_LATENCY_JITTER", "0")),
+            "error_rate": float(os.getenv("LLM_FAKE_ERROR_RATE", "0")),
+            "seed": int(os.getenv("LLM_FAKE_SEED", "0")),
+        }
+        recording = os.getenv("LLM_FAKE_RECORDING")
+        backend = FakeBackend.from_recording(recording, **fake_kwargs) if recording else FakeBackend(**fake_kwargs)
+    else:
+        backend = GeminiBackend(os.getenv("GEMINI_CLIENT_API_KEY"),
+                                async_pool_size=int(os.getenv("GEMINI_ASYNC_POOL_SIZE", "200")))
+
+    record_path = os.getenv("LLM_RECORD_PATH")
+    if record_path:
+        backend = RecordingBackend(backend, record_path)
+    return backend
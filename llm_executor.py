@@ -0,0 +1,194 @@
+from typing import Dict, Callable, Any, Optional, Tuple, Awaitable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import threading
+import time
+
+print("llm_executor.py")
+
+
+class LaneFullError(Exception):
+    """Raised when a lane already has max_pending callers waiting for a free slot."""
+    def __init__(self, lane_name: str, pending: int):
+        super().__init__(f"LLM lane '{lane_name}' is full ({pending} requests already waiting)")
+        self.lane_name = lane_name
+        self.pending = pending
+
+
+class LaneStats:
+    """
+    Thread-safe counters for one lane.
+    waiting  – callers queued for a slot right now (queue depth)
+    running  – calls currently holding a slot
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting: int = 0
+        self.running: int = 0
+        self.max_waiting_seen: int = 0
+        self.submitted: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+        self.total_wait_time: float = 0.0
+        self.max_wait_time: float = 0.0
+        self.total_run_time: float = 0.0
+
+    def enqueued(self):
+        with self._lock:
+            self.submitted += 1
+            self.waiting += 1
+            self.max_waiting_seen = max(self.max_waiting_seen, self.waiting)
+
+    def abandoned(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def started(self, wait_time: float):
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def finished(self, run_time: float, ok: bool):
+        with self._lock:
+            self.running -= 1
+            self.total_run_time += run_time
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self.completed + self.failed + self.running
+            finished = self.completed + self.failed
+            return {
+                "waiting": self.waiting,
+                "running": self.running,
+                "max_waiting_seen": self.max_waiting_seen,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_seconds": self.total_wait_time / started if started else 0.0,
+                "max_wait_seconds": self.max_wait_time,
+                "avg_run_seconds": self.total_run_time / finished if finished else 0.0,
+            }
+
+
+class ExecutorLane:
+    """
+    A named slice of LLM capacity.
+    At most max_concurrency calls hold a slot at once, and at most max_pending
+    callers may wait for one (None = unbounded). Blocking calls run on the lane's
+    own thread pool so a slow lane never steals threads from another lane.
+    """
+    def __init__(self, name: str, max_concurrency: int, max_pending: Optional[int] = None):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_pending = max_pending
+        self.stats = LaneStats()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"llm-{name}")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to the loop they are first used on
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _acquire(self) -> asyncio.Semaphore:
+        semaphore = self._get_semaphore()
+        if self.max_pending is not None and semaphore.locked() and self.stats.waiting >= self.max_pending:
+            self.stats.reject()
+            raise LaneFullError(self.name, self.stats.waiting)
+
+        self.stats.enqueued()
+        wait_start = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self.stats.abandoned()
+            raise
+        self.stats.started(time.perf_counter() - wait_start)
+        return semaphore
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking callable on this lane's thread pool without blocking the event loop."""
+        semaphore = await self._acquire()
+        run_start = time.perf_counter()
+        ok = False
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+            ok = True
+            return result
+        finally:
+            semaphore.release()
+            self.stats.finished(time.perf_counter() - run_start, ok)
+
+    async def run_async(self, coro_fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await a coroutine function on the event loop under this lane's limits."""
+        semaphore = await self._acquire()
+        run_start = time.perf_counter()
+        ok = False
+        try:
+            result = await coro_fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            semaphore.release()
+            self.stats.finished(time.perf_counter() - run_start, ok)
+
+    def shutdown(self, wait: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+class LLMExecutor:
+    """
+    Dispatches LLM/TTS work from async endpoints into bounded, per-endpoint lanes.
+
+    Example
+    -------
+    executor = LLMExecutor({"grading": (8, 64), "tutor": (8, 64)})
+    grade, reason = await executor.run("grading", question.grade_answer, answer)
+    """
+    def __init__(self, lanes: Dict[str, Tuple[int, Optional[int]]]):
+        self.lanes: Dict[str, ExecutorLane] = {}
+        for name, (max_concurrency, max_pending) in lanes.items():
+            self.lanes[name] = ExecutorLane(name, max_concurrency, max_pending)
+
+    def lane(self, name: str) -> ExecutorLane:
+        lane = self.lanes.get(name)
+        if lane is None:
+            raise KeyError(f"Unknown LLM executor lane '{name}'")
+        return lane
+
+    async def run(self, lane_name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return await self.lane(lane_name).run(fn, *args, **kwargs)
+
+    async def run_async(self, lane_name: str, coro_fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        return await self.lane(lane_name).run_async(coro_fn, *args, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for name, lane in self.lanes.items():
+            snapshot = lane.stats.snapshot()
+            snapshot["max_concurrency"] = lane.max_concurrency
+            snapshot["max_pending"] = lane.max_pending
+            result[name] = snapshot
+        return result
+
+    def shutdown(self, wait: bool = False):
+        for lane in self.lanes.values():
+            lane.shutdown(wait=wait)
@@ -0,0 +1,189 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import re
+import threading
+import unicodedata
+
+print("local_grader.py")
+
+
+_NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+    "eight": "8", "nine": "9", "ten": "10", "eleven": "11", "twelve": "12", "thirteen": "13", "fourteen": "14",
+    "fifteen": "15", "sixteen": "16", "seventeen": "17", "eighteen": "18", "nineteen": "19", "twenty": "20",
+    "thirty": "30", "forty": "40", "fifty": "50", "sixty": "60", "seventy": "70", "eighty": "80", "ninety": "90",
+    "hundred": "100", "thousand": "1000",
+}
+_FILLER_WORDS = frozenset("a an the of to in on for is are was were it its".split())
+_NEGATIONS = frozenset("not no never none nor without dont doesnt didnt isnt arent wasnt werent cant cannot wont".split())
+# "Lincoln or Washington" hedges between answers; "Canada and Mexico" adds one
+_CONJUNCTIONS = frozenset("or and nor but either plus".split())
+_NO_ANSWER = frozenset(["", "idk", "i dont know", "dont know", "no idea", "not sure", "pass", "skip", "none"])
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_answer(text: str) -> str:
+    """Lowercase, strip accents and punctuation, and turn number words into digits."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii").lower()
+    text = re.sub(r"['’]", "", text)
+    text = re.sub(r"(\d),(\d{3})", r"\1\2", text)  # 1,000 -> 1000
+    text = re.sub(r"[^\w\s.]|(?<!\d)\.|\.(?!\d)", " ", text)
+    return " ".join(_NUMBER_WORDS.get(word, word) for word in text.split())
+
+
+def content_words(normalized: str) -> List[str]:
+    """The words of a normalized answer in order, without filler words."""
+    return [word for word in normalized.split() if word not in _FILLER_WORDS]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, or limit + 1 once it's known to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _aliases(correct_answers: List[str]) -> List[str]:
+    """Each sample answer normalized, plus its variant without parenthesized text ("Green curb (zone)" -> "green curb")."""
+    aliases = []
+    for answer in correct_answers:
+        for variant in (answer, re.sub(r"\([^)]*\)", " ", answer)):
+            normalized = normalize_answer(variant)
+            if normalized and normalized not in aliases:
+                aliases.append(normalized)
+    return aliases
+
+
+class LocalGrader:
+    """
+    Grades short answers that are clearly right without an LLM call: exact matches, the
+    sample's content words in the same order with or without filler words ("the speech" for
+    "Speech"), and a small typo in one long word. Reordered words ("Poland invaded Germany"),
+    extra content words, a conjunction, different or reordered numbers and a negation the
+    sample doesn't have are never matched, and empty or "I don't know" answers fail.
+    Anything else returns None for the LLM grader.
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {"checked": 0, "escalated": 0}
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._counts["checked"] += 1
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+
+    def _allowed_typos(self, length: int) -> int:
+        # Shorter words are too often a different real word one edit away ("Russia" / "Prussia")
+        return 0 if length < 8 else 1 if length < 12 else 2
+
+    def _is_typo(self, answer: str, alias: str) -> bool:
+        """True when the answer differs from the alias only by a small typo inside one long word."""
+        answer_words, alias_words = answer.split(), alias.split()
+        if len(answer_words) != len(alias_words):
+            return False
+        differing = [(a, b) for a, b in zip(answer_words, alias_words) if a != b]
+        if len(differing) != 1:
+            return False
+        typed, expected = differing[0]
+        # A different first letter usually means a different word or name, not a slip
+        if typed[0] != expected[0] or _NUMBER_RE.search(typed) or _NUMBER_RE.search(expected):
+            return False
+        allowed = self._allowed_typos(min(len(typed), len(expected)))
+        return bool(allowed) and edit_distance(typed, expected, allowed) <= allowed
+
+    def _match(self, answer: str, aliases: List[str]) -> Optional[Tuple[str, float, str]]:
+        """(kind, grade, matched alias) for the closest safe match, or None."""
+        if answer in aliases:
+            return "exact", 1.0, answer
+        # Word order carries meaning ("House to Senate", "Article 1 Section 8"), so it must match
+        answer_words = content_words(answer)
+        answer_numbers = _NUMBER_RE.findall(answer)
+        for alias in aliases:
+            alias_words = content_words(alias)
+            if _NUMBER_RE.findall(alias) != answer_numbers \
+                    or _NEGATIONS.intersection(answer_words) != _NEGATIONS.intersection(alias_words) \
+                    or _CONJUNCTIONS.intersection(answer_words) != _CONJUNCTIONS.intersection(alias_words):
+                continue
+            if answer_words == alias_words:
+                return "alias", 1.0, alias
+            if self._is_typo(" ".join(answer_words), " ".join(alias_words)):
+                return "typo", 0.9, alias
+        return None
+
+    def grade(self, answer: str, correct_answers: List[str]) -> Optional[Tuple[float, str]]:
+        """(grade, reason) when the answer can be graded confidently, else None."""
+        if not self.enabled:
+            return None
+        normalized = normalize_answer(answer)
+        aliases = _aliases(correct_answers)
+        if normalized in _NO_ANSWER and normalized not in aliases:  # "none" can be the right answer
+            self._count("no_answer")
+            return 0.0, "No answer was given. Review the explanation and try again."
+        match = self._match(normalized, aliases)
+        if match is None:
+            self._count("escalated")
+            return None
+        kind, grade, alias = match
+        self._count(kind)
+        original = next((sample for sample in correct_answers if alias in _aliases([sample])), alias)
+        if kind == "typo":
+            return grade, f'Correct, apart from spelling: the expected answer is "{original}".'
+        return grade, f'Correct: the answer matches the expected answer "{original}".'
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            counts = dict(self._counts)
+        checked = counts["checked"]
+        counts["hit_rate"] = (checked - counts["escalated"]) / checked if checked else 0.0
+        counts["enabled"] = self.enabled
+        return counts
+
+
+# LOCAL_GRADER_ENABLED=0 sends every short answer to the LLM grader
+default_grader = LocalGrader(enabled=os.getenv("LOCAL_GRADER_ENABLED", "1") != "0")
+
+
+# (answer, sample answers, expected local grade; None = left to the LLM grader)
+REGRESSION_CASES: List[Tuple[str, List[str], Optional[float]]] = [
+    ("Lincoln", ["Lincoln"], 1.0),
+    ("the Speech", ["Speech"], 1.0),
+    ("green curb", ["Green curb (zone)"], 1.0),
+    ("Constitusion", ["Constitution"], 0.9),
+    ("Russia", ["Prussia"], None),
+    ("Austria", ["Australia"], None),
+    ("Lincoln or Washington", ["Lincoln"], None),
+    ("Canada and Mexico", ["Canada"], None),
+    ("freedom of speech", ["Speech"], None),
+    ("not the Senate", ["The Senate"], None),
+    ("Poland invaded Germany", ["Germany invaded Poland"], None),
+    ("Senate to House", ["House to Senate"], None),
+    ("Article 8 Section 1", ["Article 1 Section 8"], None),
+    ("from the House to the Senate", ["House to Senate"], None),
+    ("the House to the Senate", ["House to Senate"], 1.0),
+    ("twelve", ["12"], 1.0),
+    ("28", ["27"], None),
+    ("none", ["None"], 1.0),
+    ("idk", ["Lincoln"], 0.0),
+]
+
+
+if __name__ == '__main__':
+    checker = LocalGrader()
+    failures = 0
+    for case_answer, samples, expected in REGRESSION_CASES:
+        result = checker.grade(case_answer, samples)
+        got = result[0] if result is not None else None
+        if got != expected:
+            failures += 1
+            print(f"FAIL {case_answer!r} for {samples}: expected {expected}, got {got}")
+    print(f"{len(REGRESSION_CASES) - failures}/{len(REGRESSION_CASES)} local grader cases passed")
+    raise SystemExit(1 if failures else 0)
@@ -3,26 +3,25 @@
 import os
 import uuid
 import json
-import copy
 import re # Add import re
 from pathlib import Path
-from typing import List, Dict, Optional, Any
-from threading import Thread # Changed from multiprocessing
-import queue # For thread-safe queue
+from typing import List, Dict, Optional, Any, Callable, Tuple
 import asyncio
 import time # Added for sleep in worker
 import base64
+import hashlib
 import tempfile
 from dotenv import load_dotenv
 import os
 
 from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
 # Removed BackgroundTasks as it's no longer used by initiate_quiz_generation
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware  # For simple session management
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.concurrency import run_in_threadpool
 # If you were to use itsdangerous for signed cookies directly:
 # from starlette.requests import Request as StarletteRequest
 # from itsdangerous import URLSafeSerializer, BadSignature
@@ -31,12 +30,15 @@ from starlette.middleware.base import BaseHTTPMiddleware
 import quizclass as qc
 import questionclass as q_cl  # Renamed to avoid conflict if any
 import chatapi # Ensure chatapi is imported
-
-# Import the quiz objects directly
-from premade_quizzes.premade_quizzes import quiz_traffic_laws as california_driving_quiz
-from premade_quizzes.premade_quizzes import quiz_ap_us_history # New
-from premade_quizzes.premade_quizzes import quiz_usa_citizens_test # New
-# from premade_quizzes.premade_quizzes import all_premade_quizzes # Alternative if you want to use the list
+import llm_executor
+import worker_pool
+import job_store
+import session_store
+import session_backend
+import pdf_cache
+import pdf_extract
+import local_grader
+from premade_quizzes import catalog as premade_catalog
 
 print("main.py")
 # Ensure chatapi and tooled_llm are available in the same directory or Python path
@@ -135,14 +137,124 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
 # Add the logging middleware
 app.add_middleware(RequestLoggingMiddleware)
 
+class SessionStateSyncMiddleware(BaseHTTPMiddleware):
+    """
+    With SESSION_BACKEND set, keeps this process's in-memory session in step with the shared
+    state backend so any uvicorn worker can serve it: rehydrates before the request if another
+    worker saved a newer version, and saves after the request if the session's state changed.
+    Added before SessionMiddleware so it runs inside it and can read request.session.
+    """
+    async def dispatch(self, request: Request, call_next):
+        if session_state_backend is None or request.url.path.startswith("/static"):
+            return await call_next(request)
+
+        session_id = request.session.get("session_id")
+        if session_id:
+            await run_in_threadpool(sync_session_from_backend, session_id)
+
+        response = await call_next(request)
+
+        session_id = request.session.get("session_id")  # may have been created by this request
+        if session_id:
+            await run_in_threadpool(save_session_to_backend, session_id)
+        return response
+
+app.add_middleware(SessionStateSyncMiddleware)
+
+
+# --- Upload limits ---
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+UPLOAD_COPY_CHUNK_BYTES = 1024 * 1024
+
+class UploadTooLargeError(Exception):
+    pass
+
+class UploadSizeLimitMiddleware(BaseHTTPMiddleware):
+    """Rejects oversized uploads from their Content-Length before the multipart body is read at all."""
+    async def dispatch(self, request: Request, call_next):
+        if request.method == "POST" and request.url.path == "/api/initiate-quiz-generation":
+            content_length = request.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + 64 * 1024: # Room for the form fields
+                return JSONResponse({"detail": f"PDF is too large (limit {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)."}, status_code=413)
+        return await call_next(request)
+
+app.add_middleware(UploadSizeLimitMiddleware)
+
+
+def save_upload(source_file, dest_path: Path, max_bytes: int) -> Tuple[str, int]:
+    """
+    Copies an uploaded file to dest_path in chunks, hashing as it goes, so the PDF is never
+    held in memory whole. Returns (sha256 hex digest, size). Raises UploadTooLargeError
+    (after removing the partial file) once max_bytes is exceeded.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    source_file.seek(0)
+    try:
+        with open(dest_path, "wb") as buffer:
+            while True:
+                chunk = source_file.read(UPLOAD_COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        dest_path.unlink(missing_ok=True)
+        raise
+    return digest.hexdigest(), size
+
 # Add session middleware (stores session data in a signed cookie)
 # Note: SessionMiddleware is basic. For production, consider more robust session management.
 app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET_KEY)
 
-# In-memory storage for active sessions
-# Keyed by session_id
-# In a production environment, you'd use a database or a distributed cache like Redis.
-active_sessions: Dict[str, Dict[str, Any]] = {} # Explicitly type hint for clarity
+def release_session_resources(session_id: str, session_data: Dict[str, Any], reason: str):
+    """SessionStore eviction hook: close the tutor and grader chats held by an evicted session."""
+    quizzes = list(session_data.get("user_quizzes", {}).values())
+    current_quiz = session_data.get("current_quiz_instance")
+    if current_quiz is not None and all(current_quiz is not quiz for quiz in quizzes):
+        quizzes.append(current_quiz)
+    for quiz in quizzes:
+        if hasattr(quiz, "release"):
+            quiz.release()
+    tutor = session_data.get("current_tutor_instance")
+    if tutor is not None and hasattr(tutor, "close"):
+        tutor.close()
+    session_data["current_tutor_instance"] = None
+    if isinstance(session_data.get("message_queue"), list):
+        session_data["message_queue"].clear()
+
+
+def _optional_env_number(name: str, default: Optional[str], cast=int):
+    value = os.getenv(name, default)
+    return cast(value) if value not in (None, "", "0") else None
+
+
+# In-memory storage for active sessions, keyed by session_id.
+# Bounded: idle sessions expire after SESSION_IDLE_TTL_SECONDS, the least recently used are
+# evicted beyond SESSION_MAX_COUNT or SESSION_MAX_TOTAL_MB (estimated), and evicted
+# sessions have their LLM chats closed. Set a variable to 0 to disable that limit.
+_session_max_total_mb = _optional_env_number("SESSION_MAX_TOTAL_MB", None, float)
+active_sessions = session_store.SessionStore(
+    max_sessions=_optional_env_number("SESSION_MAX_COUNT", "2000"),
+    idle_ttl=_optional_env_number("SESSION_IDLE_TTL_SECONDS", "7200", float),
+    max_total_bytes=int(_session_max_total_mb * 1024 * 1024) if _session_max_total_mb else None,
+    on_evict=release_session_resources,
+    sweep_interval=float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60")),
+)
+# Premade quizzes and the LLM backend are shared by every session; don't count them per session
+active_sessions.mark_shared(chatapi.get_backend(), deep=False)
+
+# Generated and premade quizzes get their wrong-option feedback ahead of time (0 = live tutor only)
+PRECOMPUTE_WRONG_FEEDBACK = os.getenv("PRECOMPUTE_WRONG_FEEDBACK", "1") != "0"
+
+# Premade quizzes load from their snapshots on first use instead of at import (marked shared then)
+premade_quiz_catalog = premade_catalog.PremadeQuizCatalog(
+    premade_catalog.default_snapshot_dir(),
+    on_load=lambda key, quiz: active_sessions.mark_shared(quiz),
+)
 
 # Available quizzes (This remains for default quiz info, not instances)
 # THIS QUIZZES DICTIONARY SEEMS REDUNDANT given DEFAULT_QUIZZES_INFO later on.
@@ -151,17 +263,14 @@ QUIZZES = {
     "california_driving": {
         "title": "DMV Test Prep: Road Rules & Signs",
         "description": "Practice for your driver's license test with questions about road rules, traffic signs, and safe driving.",
-        "quiz_object": california_driving_quiz
     },
     "ap_us_history": { # New
         "title": "AP US History Challenge",
         "description": "Test your knowledge of key events, figures, and concepts in American History from 1491 to the present.",
-        "quiz_object": quiz_ap_us_history
     },
     "us_citizenship_test": { # New
         "title": "US Citizenship Test Practice",
         "description": "Prepare for the U.S. Naturalization Test with questions on American government, history, and civics.",
-        "quiz_object": quiz_usa_citizens_test
     }
 }
 
@@ -172,20 +281,18 @@ QUIZZES = {
 
 def get_session_data(session_id: str) -> Dict[str, Any]:
     """Get or create session data for a given session_id."""
-    if session_id not in active_sessions:
-        active_sessions[session_id] = {
-            "user_quizzes": {},  # Stores Quiz objects (custom or copies of defaults)
-            "current_quiz_instance_key": None, # Key to find the quiz in user_quizzes
-            "current_quiz_instance": None,    # The actual Quiz object being played
-            "current_tutor_instance": None,
-            "tutor_initialized_by_worker": False, # New flag
-            "tutor_init_failed": False,         # New flag
-            "current_question_details": None, # Holds cat_idx, q_idx, type
-            "current_score": {"correct": 0, "total": 0},
-            "message_queue": [], # For tutor messages
-        }
+    session_data = active_sessions.get_or_create(session_id, lambda: {
+        "user_quizzes": {},  # Stores Quiz objects (custom or copies of defaults)
+        "current_quiz_instance_key": None, # Key to find the quiz in user_quizzes
+        "current_quiz_instance": None,    # The actual Quiz object being played
+        "current_tutor_instance": None,
+        "tutor_initialized_by_worker": False, # New flag
+        "tutor_init_failed": False,         # New flag
+        "current_question_details": None, # Holds cat_idx, q_idx, type
+        "current_score": {"correct": 0, "total": 0},
+        "message_queue": [], # For tutor messages
+    })
     # Ensure all keys are present for existing sessions if they were created before an update
-    session_data = active_sessions[session_id]
     defaults = {
         "user_quizzes": {},
         "current_quiz_instance_key": None,
@@ -257,11 +364,7 @@ def initialize_quiz_session_dependencies(request: Request, session_id: str, quiz
     session_message_queue.clear() # Clear any old messages
 
     # Queue the tutor initialization task
-    task_queue.put({
-        "task_type": "initialize_tutor",
-        "session_id": session_id,
-        "quiz_instance_key": quiz_instance_key
-    })
+    background_workers.submit("interactive", initialize_tutor_task, session_id, quiz_instance_key)
     print(f"Tutor initialization for quiz {quiz_instance_key} (session {session_id}) queued for worker.")
 
     session_data["current_score"] = {"correct": 0, "total": 0}
@@ -280,38 +383,254 @@ DEFAULT_QUIZZES_INFO = {
     "california_driving": { # Moved california_driving to be consistent in order with js
         "title": "DMV Test Prep: Road Rules & Signs",
         "description": "Practice for your driver's license test with questions about road rules, traffic signs, and safe driving.",
-        "quiz_object": california_driving_quiz,
         "icon": "car", # Assuming this was intended for california_driving
         "thumbnail": "default_quiz_3.jpg"
     },
     "ap_us_history": { # New
         "title": "AP US History Challenge",
         "description": "Test your knowledge of key events, figures, and concepts in American History from 1491 to the present.",
-        "quiz_object": quiz_ap_us_history,
         "icon": "history", # Example icon key
         "thumbnail": "default_quiz_apush.jpg" # Example thumbnail
     },
     "us_citizenship_test": { # New
         "title": "US Citizenship Test Practice",
         "description": "Prepare for the U.S. Naturalization Test with questions on American government, history, and civics.",
-        "quiz_object": quiz_usa_citizens_test,
         "icon": "government", # Example icon key
         "thumbnail": "default_quiz_citizenship.jpg" # Example thumbnail
     }
 }
 
+
+# --- Shared session state (multi-worker) ---
+# SESSION_BACKEND=sqlite stores each session's serializable progress so another worker
+# process can rebuild the Quiz and TutorLLM objects on demand. Unset keeps the old
+# single-process behaviour.
+session_state_backend: Optional[session_backend.SessionStateBackend] = session_backend.backend_from_env(DATA_DIR)
+
+
+# --- Grade cache ---
+# LLM grades of short answers, keyed by question and normalized answer, shared by every
+# session and worker process. GRADE_CACHE_MAX_ENTRIES=0 disables it.
+GRADE_CACHE_MAX_ENTRIES = int(os.getenv("GRADE_CACHE_MAX_ENTRIES", "100000"))
+if GRADE_CACHE_MAX_ENTRIES > 0:
+    q_cl.set_grade_cache(q_cl.GradeCache(
+        os.getenv("GRADE_CACHE_PATH", str(DATA_DIR / "grades.sqlite3")),
+        max_entries=GRADE_CACHE_MAX_ENTRIES,
+        ttl=float(os.getenv("GRADE_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+    ))
+
+
+# --- Shared generation results ---
+# A document (sha256 of the PDF) is generated into a quiz once per size preference and stored
+# in SHARED_QUIZ_DIR. Each user's {session_id}_custom_xxxx.json is then a small pointer file,
+# {"shared_quiz": key, "title": ..., "description": ..., "question_count": ...}, which the user
+# can rename or delete without touching anyone else's copy.
+SHARED_QUIZ_DIR = DATA_DIR / "shared_quizzes"
+ensure_directory_exists(SHARED_QUIZ_DIR, "SHARED_QUIZ_DIR")
+
+
+def shared_quiz_key(content_digest: str, quiz_size_preference: Optional[str]) -> str:
+    size = quiz_size_preference if quiz_size_preference in ("small", "medium", "large") else "auto"
+    return f"{content_digest}_{size}"
+
+
+def shared_quiz_path(shared_key: str) -> Path:
+    return SHARED_QUIZ_DIR / f"{shared_key}.json"
+
+
+def write_json_atomic(path: Path, data: Dict[str, Any]):
+    # Readers (and other worker processes) never see a half-written file
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def write_quiz_pointer(custom_quiz_filepath: Path, shared_key: str, requested_title: str = "") -> Dict[str, Any]:
+    with open(shared_quiz_path(shared_key), 'r') as f:
+        shared_quiz = json.load(f)
+    source_material_snippet = shared_quiz.get("source_material", "")[:100]
+    pointer = {
+        "shared_quiz": shared_key,
+        "title": requested_title or shared_quiz.get("title", "Custom Quiz"),
+        "description": f"Custom quiz from: {source_material_snippet}..." if source_material_snippet else "A custom generated quiz.",
+        "question_count": sum(len(section.get("questions", [])) for section in shared_quiz.get("sections", [])),
+    }
+    write_json_atomic(custom_quiz_filepath, pointer)
+    return pointer
+
+
+def read_custom_quiz_dict(quiz_file_path: Path) -> Dict[str, Any]:
+    """A custom quiz file's quiz dict; pointer files resolve to the shared quiz under the user's title."""
+    with open(quiz_file_path, 'r') as f:
+        quiz_data = json.load(f)
+    if "shared_quiz" in quiz_data:
+        with open(shared_quiz_path(quiz_data["shared_quiz"]), 'r') as f:
+            shared_quiz = json.load(f)
+        shared_quiz["title"] = quiz_data.get("title") or shared_quiz.get("title")
+        return shared_quiz
+    return quiz_data
+
+
+def load_quiz_instance(session_id: str, quiz_instance_key: str) -> Optional[qc.Quiz]:
+    """Rebuilds a session's quiz object from its key (default_{session}_{name} or {session}_custom_xxxx)."""
+    default_prefix = f"default_{session_id}_"
+    if quiz_instance_key.startswith(default_prefix):
+        quiz_key = quiz_instance_key[len(default_prefix):]
+        quiz_info = DEFAULT_QUIZZES_INFO.get(quiz_key)
+        if quiz_info is None:
+            return None
+        quiz_obj = premade_quiz_catalog.get(quiz_key).create_session_view()
+        quiz_obj.title = quiz_info["title"]
+        return quiz_obj
+
+    quiz_file_path = DATA_DIR / f"{quiz_instance_key}.json"
+    if quiz_instance_key.startswith(f"{session_id}_custom_") and quiz_file_path.exists():
+        return qc.Quiz.from_dict(read_custom_quiz_dict(quiz_file_path))
+    return None
+
+
+def export_session_state(session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The JSON-safe part of a session: quiz progress, score, current question and tutor history."""
+    tutor = session_data.get("current_tutor_instance")
+    return {
+        "user_quizzes": {key: quiz.export_progress() for key, quiz in session_data.get("user_quizzes", {}).items()
+                         if hasattr(quiz, "export_progress")},
+        "current_quiz_instance_key": session_data.get("current_quiz_instance_key"),
+        "current_question_details": session_data.get("current_question_details"),
+        "current_score": session_data.get("current_score"),
+        "message_queue": list(session_data.get("message_queue", [])),
+        "tutor": tutor.export_state() if tutor is not None and hasattr(tutor, "export_state") else None,
+    }
+
+
+def restore_session_state(session_id: str, session_data: Dict[str, Any], state: Dict[str, Any]):
+    for quiz_instance_key, progress in state.get("user_quizzes", {}).items():
+        try:
+            quiz_obj = load_quiz_instance(session_id, quiz_instance_key)
+        except Exception as e:
+            print(f"Error rehydrating quiz {quiz_instance_key} for session {session_id}: {e}")
+            quiz_obj = None
+        if quiz_obj is None:
+            continue
+        quiz_obj.apply_progress(progress)
+        session_data["user_quizzes"][quiz_instance_key] = quiz_obj
+
+    current_key = state.get("current_quiz_instance_key")
+    current_quiz = session_data["user_quizzes"].get(current_key)
+    session_data["current_quiz_instance_key"] = current_key if current_quiz else None
+    session_data["current_quiz_instance"] = current_quiz
+    session_data["current_question_details"] = state.get("current_question_details") if current_quiz else None
+    session_data["current_score"] = state.get("current_score") or {"correct": 0, "total": 0}
+    session_data["message_queue"][:] = state.get("message_queue", [])  # the tutor holds a reference to this list
+
+    if current_quiz is not None:
+        # Building a TutorLLM makes no LLM call, so do it here instead of queueing it for the worker
+        session_data["current_tutor_instance"] = current_quiz.get_tutor(
+            session_message_queue_ref=session_data["message_queue"], saved_state=state.get("tutor"))
+        session_data["tutor_initialized_by_worker"] = True
+
+
+def sync_session_from_backend(session_id: str):
+    stored_version = session_state_backend.get_version(session_id)
+    if stored_version is None:
+        return
+    if session_id in active_sessions and active_sessions[session_id].get("_state_version", 0) >= stored_version:
+        return
+
+    loaded = session_state_backend.load(session_id)
+    if loaded is None:
+        return
+    version, state_json = loaded
+    # Our copy (if any) is stale: drop it, closing its chats, and rebuild from the stored state
+    active_sessions.evict(session_id, reason="stale")
+    session_data = get_session_data(session_id)
+    restore_session_state(session_id, session_data, json.loads(state_json))
+    session_data["_state_version"] = version
+    session_data["_state_json"] = state_json
+    print(f"Rehydrated session {session_id} from {session_state_backend.name} backend (version {version}).")
+
+
+def save_session_to_backend(session_id: str):
+    if session_id not in active_sessions:
+        return
+    session_data = active_sessions[session_id]
+    state_json = json.dumps(export_session_state(session_data), sort_keys=True)
+    if state_json == session_data.get("_state_json"):
+        return
+    session_data["_state_version"] = session_state_backend.save(session_id, state_json)
+    session_data["_state_json"] = state_json
+
 # We need the data directory for custom uploaded quizzes
 # DATA_DIR = Path(__file__).parent / "data" # This line will be replaced/managed by the new setup above
 # if not DATA_DIR.exists():
 #     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-# --- Global Task Queue ---
-task_queue = queue.Queue()
-WORKER_SENTINEL = object() # Used to signal the worker thread to stop
+# --- Background Workers ---
+# Tutor setup is interactive (the user is waiting on the quiz page) and must never queue behind
+# multi-minute quiz generations, so each kind of task gets its own lane of threads.
+# Each lane is (worker threads, max queued tasks or None for unbounded).
+# Optional warm-up work that makes many LLM calls (premade quiz feedback) gets a lane of its own,
+# so it never holds a generation thread while user quiz jobs wait.
+BACKGROUND_WORKER_LANES = {
+    "interactive": (int(os.getenv("WORKER_INTERACTIVE_THREADS", "4")), None),
+    "generation": (int(os.getenv("WORKER_GENERATION_THREADS", "2")), None),
+    "precompute": (int(os.getenv("WORKER_PRECOMPUTE_THREADS", "1")), None),
+}
+background_workers = worker_pool.WorkerPool(BACKGROUND_WORKER_LANES)
+# Generation work waits in the durable job store (see generation_jobs), which this caps
+GENERATION_MAX_PENDING_JOBS = int(os.getenv("WORKER_GENERATION_MAX_PENDING", "100"))
+GENERATION_JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Long PDFs are split into ~GENERATION_CHUNK_WORDS-word chunks written in parallel (0 = one conversation per quiz)
+GENERATION_CHUNK_WORDS = int(os.getenv("GENERATION_CHUNK_WORDS", "1500"))
+GENERATION_CHUNK_WORKERS = int(os.getenv("GENERATION_CHUNK_WORKERS", "4"))
+
+# --- LLM Executor ---
+# Blocking Gemini/TTS calls made by request handlers are dispatched into these lanes so they
+# never run on the event loop. Each lane is (max concurrent calls, max waiting requests).
+# A full lane answers 503 instead of piling up more work behind a slow upstream.
+LLM_EXECUTOR_LANES = {
+    "grading": (int(os.getenv("LLM_GRADING_CONCURRENCY", "8")), int(os.getenv("LLM_GRADING_MAX_PENDING", "64"))),
+    "tutor": (int(os.getenv("LLM_TUTOR_CONCURRENCY", "8")), int(os.getenv("LLM_TUTOR_MAX_PENDING", "64"))),
+    "tts": (int(os.getenv("LLM_TTS_CONCURRENCY", "4")), int(os.getenv("LLM_TTS_MAX_PENDING", "32"))),
+}
+llm_dispatch = llm_executor.LLMExecutor(LLM_EXECUTOR_LANES)
+# Tutor history summaries are written after the reply is sent, in the tutor lane's slots
+chatapi.set_compaction_runner(lambda coro_fn, *args, **kwargs: llm_dispatch.run_async("tutor", coro_fn, *args, **kwargs))
+
+
+class ClientDisconnected(Exception):
+    """Raised when the browser goes away while we are waiting on an LLM call for it."""
+
+
+async def run_until_client_disconnects(request: Request, awaitable, poll_interval: float = 0.5):
+    """
+    Await an LLM coroutine, cancelling it if the client disconnects first so an abandoned
+    tutor/grader conversation stops consuming a lane slot and upstream quota.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print(f"Client disconnected from {request.url.path}, cancelling LLM call.")
+                task.cancel()
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
 
 # --- FastAPI Endpoints ---
 
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    # Nobody is listening any more; 499 only shows up in our own logs.
+    return JSONResponse({"error": "Client disconnected"}, status_code=499)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """
@@ -326,12 +645,8 @@ async def home(request: Request):
     #    The quiz_name_id for these will be their generic names (e.g., "world_war_2")
     #    The /api/start-quiz endpoint will handle creating session-specific copies.
     for key, data in DEFAULT_QUIZZES_INFO.items(): # Use DEFAULT_QUIZZES_INFO
-        question_count = 0
-        if data.get("quiz_object") and hasattr(data["quiz_object"], "get_total_question_count"):
-            question_count = data["quiz_object"].get_total_question_count()
-        elif data.get("quiz_object") and hasattr(data["quiz_object"], "section_bank"): # Fallback if method not there yet
-            for section in data["quiz_object"].section_bank:
-                question_count += len(section.questions)
+        # From the snapshot metadata; doesn't load the quiz itself
+        question_count = await run_in_threadpool(premade_quiz_catalog.question_count, key)
 
         display_quizzes[key] = {
             "title": data["title"],
@@ -365,7 +680,7 @@ async def home(request: Request):
                  source_material_snippet = quiz_data.get("source_material", "Uploaded content.")[:100]
                  description = f"Custom quiz from: {source_material_snippet}..." if source_material_snippet else "A custom generated quiz."
 
-            custom_question_count = 0
+            custom_question_count = quiz_data.get("question_count", 0) # Pointer files to shared quizzes carry the count
             if "sections" in quiz_data:
                 for section in quiz_data["sections"]:
                     custom_question_count += len(section.get("questions", []))
@@ -394,7 +709,7 @@ async def home(request: Request):
 async def start_quiz(request: Request, quiz_name_id_from_url: str):
     """
     Initialize a new quiz session.
-    For default quizzes, it creates a user-specific copy.
+    For default quizzes, it creates a copy-on-write session view of the shared quiz.
     For custom quizzes, it loads the user's specific quiz file.
     The quiz_name_id_from_url for custom quizzes is expected to be already
     prefixed with session_id (e.g., sessionid_custom_xxxx).
@@ -436,8 +751,7 @@ async def start_quiz(request: Request, quiz_name_id_from_url: str):
                 print(f"Error: Custom quiz file not found: {quiz_file_path}")
                 raise HTTPException(status_code=404, detail=f"Custom quiz '{quiz_instance_key}' not found.")
             try:
-                with open(quiz_file_path, 'r') as f:
-                    quiz_data_dict = json.load(f)
+                quiz_data_dict = read_custom_quiz_dict(quiz_file_path)
                 quiz_obj = qc.Quiz.from_dict(quiz_data_dict)
                 quiz_title = quiz_obj.title if hasattr(quiz_obj, 'title') and quiz_obj.title else "Custom Quiz (untitled)"
                 quiz_obj.title = quiz_title # Ensure it's set on the object
@@ -448,11 +762,13 @@ async def start_quiz(request: Request, quiz_name_id_from_url: str):
 
         elif is_default_quiz_format: # quiz_name_id_from_url is generic like "world_war_2"
             original_quiz_info = DEFAULT_QUIZZES_INFO[quiz_name_id_from_url]
-            quiz_obj = copy.deepcopy(original_quiz_info["quiz_object"])
+            # Shares questions and source text with the premade quiz; only per-session state is copied
+            premade_quiz = await run_in_threadpool(premade_quiz_catalog.get, quiz_name_id_from_url)
+            quiz_obj = premade_quiz.create_session_view()
             quiz_title = original_quiz_info["title"]
-            if hasattr(quiz_obj, 'title'): # quiz_object from premade should have title attribute
+            if hasattr(quiz_obj, 'title'): # premade quizzes should have a title attribute
                 quiz_obj.title = quiz_title 
-            print(f"Created new copy for default quiz '{quiz_title}' (key: {quiz_instance_key})")
+            print(f"Created session view for default quiz '{quiz_title}' (key: {quiz_instance_key})")
         else:
             # Neither a recognized custom quiz format for this session, nor a known default quiz
             raise HTTPException(status_code=404, detail=f"Quiz '{quiz_name_id_from_url}' not found or not accessible for this session.")
@@ -550,12 +866,17 @@ async def get_question(request: Request):
         if isinstance(question, q_cl.MultipleChoice): 
             _, options = question.build_parts()
         
-        return {
+        response = {
             "text": question.question,
             "type": question_type_str,
             "options": options,
+            "cat_idx": cat_idx, # cat_idx, q_idx and option_set identify the answer to /api/submit-batch
+            "q_idx": q_idx,
             "score": session_data["current_score"]
         }
+        if isinstance(question, q_cl.MultipleChoice):
+            response["option_set"] = question.option_set_token()
+        return response
     except ValueError as e: # Catch potential errors from pick_question if no questions/sections
         return JSONResponse({"error": str(e)}, status_code=500)
     except Exception as e:
@@ -599,8 +920,17 @@ async def submit_answer(request: Request, answer: dict):
     if user_answer_data is None: # Check if answer is provided
         return JSONResponse({"error": "No answer provided in submission"}, status_code=400)
     
-    # Grade the answer
-    score_value, feedback_str = question.grade_answer(user_answer_data)
+    # Grade the answer. ShortAnswer grading is an LLM round-trip, so it runs in the grading lane;
+    # MCQ/TF grading is a local lookup and stays inline.
+    try:
+        if isinstance(question, q_cl.ShortAnswer):
+            score_value, feedback_str = await run_until_client_disconnects(
+                request, llm_dispatch.run_async("grading", question.agrade_answer, user_answer_data))
+        else:
+            score_value, feedback_str = question.grade_answer(user_answer_data)
+    except llm_executor.LaneFullError as e:
+        print(f"Grading lane full for session {session_id}: {e}")
+        return JSONResponse({"error": "The grader is busy right now. Please try again in a moment."}, status_code=503)
     is_correct = score_value > 0.8
     
     # Update score in session
@@ -617,7 +947,20 @@ async def submit_answer(request: Request, answer: dict):
     else:
         session_data["message_queue"] = [] # Ensure it exists
 
-    if tutor:
+    # Wrong MCQ/TF options usually have feedback generated with the quiz; it's shown right away and
+    # the tutor only gets it as context for follow-up questions.
+    precomputed_feedback = question.feedback_for(str(user_answer_data)) \
+        if not is_correct and isinstance(question, q_cl.MultipleChoice) else None
+
+    if precomputed_feedback:
+        session_data["message_queue"].extend(precomputed_feedback)
+        if tutor:
+            question_text = " ".join(question.rebuild_question().split())
+            tutor.add_context_note(
+                f"Context: The student answered incorrectly and was shown this feedback. Question: {question_text} | "
+                f"Student's answer: {user_answer_data} | Feedback: {' '.join(' '.join(precomputed_feedback).split())}"
+            )
+    elif tutor:
         if not is_correct:
             # Construct the prompt for the tutor for incorrect answers
             prompt_text = f'''Question: {question.rebuild_question()}
@@ -625,27 +968,23 @@ Student answer: {user_answer_data}
 Correct answer: {question.correct_answer if hasattr(question, 'correct_answer') else 'N/A'}
 Explanation: {question.explanation if hasattr(question, 'explanation') else 'N/A'}'''
             try:
-                tutor.prompt(prompt_text) # This populates session_data["message_queue"]
+                await run_until_client_disconnects(
+                    request, llm_dispatch.run_async("tutor", tutor.aprompt, prompt_text)) # This populates session_data["message_queue"]
+            except llm_executor.LaneFullError as e:
+                print(f"Tutor lane full, skipping feedback for session {session_id}: {e}")
+                session_data["message_queue"].append("The tutor is busy right now. Ask a follow-up in a moment for more help.")
+            except ClientDisconnected:
+                raise
             except Exception as e:
                 print(f"Error during tutor prompt for incorrect answer: {e}")
                 session_data["message_queue"].append("Sorry, the tutor encountered an error trying to provide feedback.")
         else:
-            # Answer is correct.
-            # Inform the tutor about the correct submission for context.
-            context_prompt = (
-                f"Context: The student just answered the following question correctly.\n"
-                f"Question: {question.rebuild_question()}\n"
-                f"Student's (correct) answer: {user_answer_data}\n"
-                f"Explanation: {question.explanation if hasattr(question, 'explanation') else 'N/A'}\n"
-                f"This is for your context. No immediate response to the user is needed for this correct answer. Be prepared for potential follow-up questions from the user regarding this topic."
+            # Answer is correct. The tutor only needs this as context, so instead of an LLM call
+            # it's queued and sent along with the next incorrect answer or follow-up.
+            question_text = " ".join(question.rebuild_question().split())
+            tutor.add_context_note(
+                f"Context: The student answered correctly. Question: {question_text} | Student's answer: {user_answer_data}"
             )
-            try:
-                tutor.prompt(context_prompt)
-                # Clear messages after context prompt for correct answer.
-                if "message_queue" in session_data:
-                    session_data["message_queue"].clear()
-            except Exception as e:
-                print(f"Error informing tutor of correct answer (context setting): {e}")
 
     final_feedback = feedback_str if feedback_str else (question.explanation if hasattr(question, 'explanation') else "No additional feedback.")
     
@@ -658,6 +997,100 @@ Explanation: {question.explanation if hasattr(question, 'explanation') else 'N/A
         "tutor_messages": tutor_messages_for_response 
     }
 
+# Most answers accepted by one /api/submit-batch call
+SUBMIT_BATCH_MAX_ANSWERS = int(os.getenv("SUBMIT_BATCH_MAX_ANSWERS", "100"))
+
+
+@app.post("/api/submit-batch")
+async def submit_answers_batch(request: Request, payload: dict):
+    """
+    Grade a page of answers at once: {"answers": [{"cat_idx": 0, "q_idx": 2, "answer": "...", "option_set": "..."}, ...]}.
+    cat_idx, q_idx and (for MCQ/TF) option_set are the values /api/question returned with each question.
+    Short answers share batched grader requests; results come back in the same order, and an answer
+    that can't be graded gets an "error" instead. Weights and score change only once all are graded.
+    """
+    session_id = request.session["session_id"]
+    session_data = get_session_data(session_id)
+    quiz = session_data.get("current_quiz_instance")
+    if not quiz:
+        return JSONResponse({"error": "No active quiz found in session"}, status_code=400)
+
+    submissions = payload.get("answers")
+    if not isinstance(submissions, list) or not submissions:
+        return JSONResponse({"error": "'answers' must be a non-empty list"}, status_code=400)
+    if len(submissions) > SUBMIT_BATCH_MAX_ANSWERS:
+        return JSONResponse({"error": f"At most {SUBMIT_BATCH_MAX_ANSWERS} answers per batch"}, status_code=400)
+
+    questions = []
+    for index, submission in enumerate(submissions):
+        cat_idx = submission.get("cat_idx") if isinstance(submission, dict) else None
+        q_idx = submission.get("q_idx") if isinstance(submission, dict) else None
+        if not isinstance(cat_idx, int) or not isinstance(q_idx, int) or cat_idx < 0 or q_idx < 0 \
+                or submission.get("answer") is None:
+            return JSONResponse({"error": f"Answer {index}: cat_idx, q_idx and answer are required"}, status_code=400)
+        try:
+            questions.append(quiz.get_question(cat_idx, q_idx))
+        except (IndexError, TypeError, AttributeError):
+            return JSONResponse({"error": f"Answer {index}: no question at cat_idx {cat_idx}, q_idx {q_idx}"}, status_code=400)
+
+    # Grading only: nothing about the session changes until every answer has a result
+    results: List[Any] = [None] * len(submissions)
+    short_answers = []
+    for index, (question, submission) in enumerate(zip(questions, submissions)):
+        if isinstance(question, q_cl.ShortAnswer):
+            short_answers.append(index)
+        elif isinstance(question, q_cl.MultipleChoice):
+            if submission.get("option_set") != question.option_set_token():
+                # The letter refers to options this question no longer shows (or never showed)
+                results[index] = ValueError("This question's options have changed; fetch it again before answering.")
+            else:
+                results[index] = (question.check_choice(str(submission["answer"])), "")
+        else:
+            results[index] = ValueError("This question type can't be graded in a batch.")
+
+    if short_answers:
+        try:
+            graded = await run_until_client_disconnects(request, llm_dispatch.run_async(
+                "grading", q_cl.agrade_short_answers_batch,
+                [(questions[index], str(submissions[index]["answer"])) for index in short_answers]))
+        except llm_executor.LaneFullError as e:
+            print(f"Grading lane full for session {session_id}: {e}")
+            return JSONResponse({"error": "The grader is busy right now. Please try again in a moment."}, status_code=503)
+        except ClientDisconnected:
+            raise
+        except Exception as e:
+            print(f"Batch grading failed for session {session_id}: {type(e).__name__} - {e}")
+            graded = [e] * len(short_answers)
+        for index, result in zip(short_answers, graded):
+            results[index] = result
+
+    tutor = session_data.get("current_tutor_instance")
+    response_items = []
+    for question, submission, result in zip(questions, submissions, results):
+        item = {"cat_idx": submission["cat_idx"], "q_idx": submission["q_idx"]}
+        if isinstance(result, Exception):
+            item["error"] = str(result) if isinstance(result, ValueError) else "This answer couldn't be graded. Please try again."
+            response_items.append(item)
+            continue
+        score_value, feedback_str = question.apply_grade(*result)
+        is_correct = score_value > 0.8
+        session_data["current_score"]["total"] += 1
+        if is_correct:
+            session_data["current_score"]["correct"] += 1
+            if tutor:
+                question_text = " ".join(question.rebuild_question().split())
+                tutor.add_context_note(
+                    f"Context: The student answered correctly. Question: {question_text} | Student's answer: {submission['answer']}"
+                )
+        item.update({
+            "correct": is_correct,
+            "grade": score_value,
+            "feedback": feedback_str or getattr(question, "explanation", "") or "No additional feedback.",
+        })
+        response_items.append(item)
+
+    return {"results": response_items, "score": session_data["current_score"]}
+
 # Hypothetical import for LLM utility (would need to be a real module/function)
 # from .llm_utils import generate_title_with_llm 
 
@@ -667,11 +1100,16 @@ async def generate_and_save_quiz_task(
     custom_quiz_filepath: Path, 
     temp_pdf_path: Path,
     quiz_id_stem: str, # For logging
-    quiz_size_preference: Optional[str] = None
+    quiz_size_preference: Optional[str] = None,
+    progress_callback: Optional[Callable[..., None]] = None
 ):
     """Background task to generate AI quiz, potentially generate a title, and save it."""
     final_quiz_title = requested_quiz_title.strip() if requested_quiz_title else ""
 
+    def report_progress(stage: str, **details):
+        if progress_callback is not None:
+            progress_callback(stage, **details)
+
     def _generate_short_fallback_title(src_material_snippet: str, q_id_stem: str) -> str:
         # Remove common PDF page markers like "-- Page X --"
         cleaned_snippet = re.sub(r"--\s*Page\s*\d+\s*--", "", src_material_snippet, flags=re.IGNORECASE)
@@ -733,7 +1171,7 @@ Respond with ONLY the title.
 For example, if the text is about World War II history, a good response is: World War II Events
 A bad response would be: Title: "World War II Events" 
 """
-                title_llm = chatapi.FlashChat(instruction_prompt="You are an expert quiz title generator. Your sole purpose is to generate a short, relevant quiz title based on provided text and return ONLY the title.")
+                title_llm = chatapi.FlashChat(directions="You are an expert quiz title generator. Your sole purpose is to generate a short, relevant quiz title based on provided text and return ONLY the title.")
                 llm_response = title_llm.prompt(title_prompt)
 
                 if llm_response and isinstance(llm_response, str) and llm_response.strip():
@@ -773,7 +1211,7 @@ A bad response would be: Title: "World War II Events"
         else:
             # User provided a title, so no need to generate with LLM or use fallback.
             print(f"Background task for {quiz_id_stem}: User provided title: '{final_quiz_title}'. Skipping LLM generation.")
-
+        report_progress("title_generated", title=final_quiz_title)
 
         print(f"Background task started for {quiz_id_stem}: Generating quiz with final chosen title '{final_quiz_title}' for {custom_quiz_filepath}")
         
@@ -794,34 +1232,31 @@ A bad response would be: Title: "World War II Events"
             source_material=source_material, 
             quiz_title=final_quiz_title, 
             quiz_size=target_quiz_size, # Pass the determined size
-            print_debug=False
+            print_debug=False,
+            progress_callback=progress_callback,
+            chunk_words=GENERATION_CHUNK_WORDS or None,
+            max_workers=GENERATION_CHUNK_WORKERS
         )
         
         if not new_quiz or not new_quiz.section_bank or not any(s.questions for s in new_quiz.section_bank):
             print(f"Error in background task ({quiz_id_stem}): Failed to generate any questions for quiz '{final_quiz_title}'.")
-            # Consider writing an error status file, e.g.:
-            # custom_quiz_filepath.with_suffix('.error').write_text("Failed to generate questions.")
-            return
+            raise RuntimeError(f"No questions were generated for quiz '{final_quiz_title}'")
 
         # Explicitly set the title on the quiz object before saving, in case generate_ai_quiz doesn't assign it from param
         new_quiz.title = final_quiz_title 
 
-        with open(custom_quiz_filepath, "w") as f:
-            json.dump(new_quiz.to_dict(), f, indent=4)
+        if PRECOMPUTE_WRONG_FEEDBACK:
+            report_progress("precomputing_feedback", sections=len(new_quiz.section_bank), questions=new_quiz.get_total_question_count())
+            qc.precompute_wrong_feedback(new_quiz, max_workers=GENERATION_CHUNK_WORKERS)
+
+        report_progress("saving", sections=len(new_quiz.section_bank), questions=new_quiz.get_total_question_count())
+        write_json_atomic(custom_quiz_filepath, new_quiz.to_dict())
+        report_progress("saved")
         print(f"Background task completed for {quiz_id_stem}: Quiz '{final_quiz_title}' saved to {custom_quiz_filepath}")
 
     except Exception as e:
         print(f"Error in background quiz generation for {quiz_id_stem} ('{final_quiz_title}', {custom_quiz_filepath}): {type(e).__name__} - {e}")
-        # Optionally, save an error marker or status file, e.g.:
-        # custom_quiz_filepath.with_suffix('.error').write_text(f"{type(e).__name__}: {e}")
-    finally:
-        # Clean up the temporary PDF file
-        if temp_pdf_path.exists():
-            try:
-                temp_pdf_path.unlink(missing_ok=True) # missing_ok=True added for robustness
-                print(f"Background task for {quiz_id_stem}: Cleaned up temporary PDF {temp_pdf_path}")
-            except Exception as e_unlink:
-                print(f"Error cleaning up temp PDF {temp_pdf_path} in background task for {quiz_id_stem}: {e_unlink}")
+        raise # Lets the job queue retry; the temp PDF is removed once the job is finished for good
 
 # Synchronous wrapper for the async task
 def run_generate_and_save_quiz_task_sync(
@@ -830,7 +1265,8 @@ def run_generate_and_save_quiz_task_sync(
     custom_quiz_filepath: Path,
     temp_pdf_path: Path,
     quiz_id_stem: str,
-    quiz_size_preference: Optional[str] = None
+    quiz_size_preference: Optional[str] = None,
+    progress_callback: Optional[Callable[..., None]] = None
 ):
     asyncio.run(generate_and_save_quiz_task(
         source_material,
@@ -838,129 +1274,236 @@ def run_generate_and_save_quiz_task_sync(
         custom_quiz_filepath,
         temp_pdf_path,
         quiz_id_stem,
-        quiz_size_preference
+        quiz_size_preference,
+        progress_callback
     ))
 
-# --- Worker Thread Function ---
-def quiz_generation_worker(q: queue.Queue):
-    print("Quiz generation worker thread started.")
-    while True:
-        try:
-            task_data = q.get(block=True, timeout=0.5) # block with timeout to allow periodic checks if needed
-            if task_data is WORKER_SENTINEL:
-                print("Worker thread: Sentinel received. Exiting.")
-                q.task_done()
-                break
-
-            task_type = task_data.get("task_type")
-            quiz_id_stem_log = task_data.get('quiz_id_stem', 'N/A_QUIZ_ID') # For logging
-            session_id_log = task_data.get('session_id', 'N/A_SESSION_ID') # For logging
-
-            if task_type == "generate_quiz":
-                print(f"Worker thread: Got 'generate_quiz' task for quiz_id_stem: {quiz_id_stem_log}")
-                try:
-                    run_generate_and_save_quiz_task_sync(
-                        source_material=task_data["source_material"],
-                        requested_quiz_title=task_data["requested_quiz_title"],
-                        custom_quiz_filepath=task_data["custom_quiz_filepath"],
-                        temp_pdf_path=task_data["temp_pdf_path"],
-                        quiz_id_stem=task_data["quiz_id_stem"],
-                        quiz_size_preference=task_data["quiz_size_preference"]
-                    )
-                except Exception as e_task:
-                    print(f"Worker thread: Error processing 'generate_quiz' task for {quiz_id_stem_log}: {type(e_task).__name__} - {e_task}")
-            
-            elif task_type == "initialize_tutor":
-                session_id = task_data["session_id"]
-                quiz_instance_key = task_data["quiz_instance_key"]
-                print(f"Worker thread: Got 'initialize_tutor' task for session {session_id}, quiz {quiz_instance_key}")
-                try:
-                    session_data_for_tutor = active_sessions.get(session_id)
-                    if not session_data_for_tutor:
-                        print(f"Worker: Session {session_id} not found in active_sessions for tutor init.")
-                        active_sessions[session_id] = get_session_data(session_id) # Initialize if somehow missed
-                        active_sessions[session_id]["tutor_init_failed"] = True
-                        q.task_done()
-                        continue
-
-                    # Ensure user_quizzes exists
-                    if "user_quizzes" not in session_data_for_tutor:
-                         session_data_for_tutor["user_quizzes"] = {}
-                    
-                    user_quizzes = session_data_for_tutor.get("user_quizzes")
-                    quiz_to_init_tutor_for = user_quizzes.get(quiz_instance_key) # This should be the Quiz object
-                                        
-                    if not quiz_to_init_tutor_for:
-                        # Attempt to load it if it's the current_quiz_instance, maybe it wasn't in user_quizzes yet
-                        # This case might be rare if start-quiz logic is robust
-                        if session_data_for_tutor.get("current_quiz_instance_key") == quiz_instance_key and \
-                           session_data_for_tutor.get("current_quiz_instance"):
-                            quiz_to_init_tutor_for = session_data_for_tutor["current_quiz_instance"]
-                            print(f"Worker: Tutor init for {quiz_instance_key} (session {session_id}) - using current_quiz_instance as fallback.")
-                        else:
-                            print(f"Worker: Quiz {quiz_instance_key} not found in user_quizzes or current_quiz_instance for session {session_id} for tutor init.")
-                            session_data_for_tutor["tutor_init_failed"] = True
-                            q.task_done()
-                            continue
-                    
-                    if not hasattr(quiz_to_init_tutor_for, 'get_tutor') or not callable(getattr(quiz_to_init_tutor_for, 'get_tutor')):
-                        print(f"Worker: Quiz object for {quiz_instance_key} (session {session_id}) does not have a get_tutor method.")
-                        session_data_for_tutor["tutor_init_failed"] = True
-                        q.task_done()
-                        continue
-
-                    # Ensure message_queue is a list
-                    if "message_queue" not in session_data_for_tutor or not isinstance(session_data_for_tutor["message_queue"], list):
-                        session_data_for_tutor["message_queue"] = []
-                    
-                    print(f"Worker: Attempting to call get_tutor for quiz {quiz_instance_key} (session {session_id}).")
-                    initialized_tutor = quiz_to_init_tutor_for.get_tutor(
-                        session_message_queue_ref=session_data_for_tutor["message_queue"]
-                    )
-                    session_data_for_tutor["current_tutor_instance"] = initialized_tutor
-                    session_data_for_tutor["tutor_initialized_by_worker"] = True
-                    session_data_for_tutor["tutor_init_failed"] = False # Reset on success
-                    print(f"Worker thread: Tutor initialized successfully for session {session_id}, quiz {quiz_instance_key}. Type: {type(initialized_tutor)}")
-
-                except Exception as e_tutor_init:
-                    print(f"Worker thread: Error initializing tutor for session {session_id}, quiz {quiz_instance_key}: {type(e_tutor_init).__name__} - {e_tutor_init}")
-                    # Ensure session_data_for_tutor exists before trying to set a flag on it
-                    if session_id in active_sessions and active_sessions.get(session_id):
-                        active_sessions[session_id]["tutor_init_failed"] = True
-                    else: # If session_data itself couldn't be retrieved, this is a more fundamental issue
-                        print(f"Worker thread: CRITICAL - Could not access session data for {session_id} during tutor init exception handling.")
+# --- Background Task Handlers (run on background_workers lanes) ---
+def initialize_tutor_task(session_id: str, quiz_instance_key: str):
+    print(f"Worker: Got 'initialize_tutor' task for session {session_id}, quiz {quiz_instance_key}")
+    try:
+        session_data_for_tutor = active_sessions.get(session_id)
+        if not session_data_for_tutor:
+            print(f"Worker: Session {session_id} not found in active_sessions for tutor init.")
+            active_sessions[session_id] = get_session_data(session_id) # Initialize if somehow missed
+            active_sessions[session_id]["tutor_init_failed"] = True
+            return
+
+        # Ensure user_quizzes exists
+        if "user_quizzes" not in session_data_for_tutor:
+             session_data_for_tutor["user_quizzes"] = {}
+
+        user_quizzes = session_data_for_tutor.get("user_quizzes")
+        quiz_to_init_tutor_for = user_quizzes.get(quiz_instance_key) # This should be the Quiz object
+
+        if not quiz_to_init_tutor_for:
+            # Attempt to load it if it's the current_quiz_instance, maybe it wasn't in user_quizzes yet
+            # This case might be rare if start-quiz logic is robust
+            if session_data_for_tutor.get("current_quiz_instance_key") == quiz_instance_key and \
+               session_data_for_tutor.get("current_quiz_instance"):
+                quiz_to_init_tutor_for = session_data_for_tutor["current_quiz_instance"]
+                print(f"Worker: Tutor init for {quiz_instance_key} (session {session_id}) - using current_quiz_instance as fallback.")
             else:
-                print(f"Worker thread: Unknown task type '{task_type}' received for quiz {quiz_id_stem_log} / session {session_id_log}")
-            
-            q.task_done()
-        except queue.Empty:
-            continue # Loop again, effectively sleeping due to q.get timeout
-        except Exception as e:
-            print(f"Worker thread: Critical error in main loop: {type(e).__name__} - {e}")
-            time.sleep(1) # Avoid rapid spinning on unexpected errors
-    print("Quiz generation worker thread finished.")
+                print(f"Worker: Quiz {quiz_instance_key} not found in user_quizzes or current_quiz_instance for session {session_id} for tutor init.")
+                session_data_for_tutor["tutor_init_failed"] = True
+                return
 
+        if not hasattr(quiz_to_init_tutor_for, 'get_tutor') or not callable(getattr(quiz_to_init_tutor_for, 'get_tutor')):
+            print(f"Worker: Quiz object for {quiz_instance_key} (session {session_id}) does not have a get_tutor method.")
+            session_data_for_tutor["tutor_init_failed"] = True
+            return
+
+        # Ensure message_queue is a list
+        if "message_queue" not in session_data_for_tutor or not isinstance(session_data_for_tutor["message_queue"], list):
+            session_data_for_tutor["message_queue"] = []
 
-worker_thread = Thread(target=quiz_generation_worker, args=(task_queue,), daemon=True)
+        print(f"Worker: Attempting to call get_tutor for quiz {quiz_instance_key} (session {session_id}).")
+        initialized_tutor = quiz_to_init_tutor_for.get_tutor(
+            session_message_queue_ref=session_data_for_tutor["message_queue"]
+        )
+        session_data_for_tutor["current_tutor_instance"] = initialized_tutor
+        session_data_for_tutor["tutor_initialized_by_worker"] = True
+        session_data_for_tutor["tutor_init_failed"] = False # Reset on success
+        print(f"Worker: Tutor initialized successfully for session {session_id}, quiz {quiz_instance_key}. Type: {type(initialized_tutor)}")
+
+    except Exception as e_tutor_init:
+        print(f"Worker: Error initializing tutor for session {session_id}, quiz {quiz_instance_key}: {type(e_tutor_init).__name__} - {e_tutor_init}")
+        # Ensure session_data_for_tutor exists before trying to set a flag on it
+        if session_id in active_sessions and active_sessions.get(session_id):
+            active_sessions[session_id]["tutor_init_failed"] = True
+        else: # If session_data itself couldn't be retrieved, this is a more fundamental issue
+            print(f"Worker: CRITICAL - Could not access session data for {session_id} during tutor init exception handling.")
+
+
+def generate_quiz_job(job: Dict[str, Any]):
+    """
+    JobPump handler for 'generate_quiz' jobs. Raising marks the attempt failed (and retried).
+    Jobs for the same document and size share a dedup_key, so only one of them generates the
+    shared quiz; the rest run after it and just write the user's pointer file.
+    """
+    task_data = job["payload"]
+    print(f"Worker: Got 'generate_quiz' job {job['job_id']} (attempt {job['attempts']}/{job['max_attempts']})")
+    progress = job_store.JobProgress(generation_jobs, job["job_id"], job["progress"])
+    custom_quiz_filepath = Path(task_data["custom_quiz_filepath"])
+    shared_key = task_data.get("shared_key")
+    if shared_key is not None and shared_quiz_path(shared_key).exists():
+        print(f"Worker: Job {job['job_id']} reuses the shared quiz generated for an identical upload.")
+        pointer = write_quiz_pointer(custom_quiz_filepath, shared_key, task_data["requested_quiz_title"])
+        progress("ready", title=pointer["title"], questions=pointer["question_count"])
+        return
+
+    source_material = task_data.get("source_material") # Jobs queued before extraction moved here carry the text
+    if source_material is None:
+        pdf_path = task_data["temp_pdf_path"]
+        try:
+            _, source_material = pdf_text_cache.extract(pdf_path, extract_upload_text,
+                                                        pdf_extraction_key(task_data["content_digest"]),
+                                                        is_complete=lambda text: upload_extraction_complete(pdf_path, text))
+            complete = upload_extraction_complete(pdf_path, source_material) if source_material else True
+        except Exception as e_extract: # A PDF that can't be parsed won't parse on retry either
+            raise job_store.JobAbort(f"Could not read the PDF: {type(e_extract).__name__} - {e_extract}") from e_extract
+        if not source_material or not source_material.strip():
+            raise job_store.JobAbort("Could not extract text from PDF, or PDF is empty/unreadable.")
+        if not complete and shared_key is not None:
+            # A quiz of part of the document is this user's own; later uploads get a full extraction
+            print(f"Worker: Job {job['job_id']} ran out of extraction time; its quiz won't be shared.")
+            shared_key = None
+        progress("pdf_extracted", pages=len(re.findall(r"--\s*Page\s*\d+\s*--", source_material)))
+
+    generation_args = dict(
+        source_material=source_material,
+        temp_pdf_path=Path(task_data["temp_pdf_path"]),
+        quiz_id_stem=task_data["quiz_id_stem"],
+        quiz_size_preference=task_data["quiz_size_preference"],
+        progress_callback=progress
+    )
+
+    if shared_key is None: # Queued before generation results were shared, or from a partial extraction
+        run_generate_and_save_quiz_task_sync(requested_quiz_title=task_data["requested_quiz_title"],
+                                             custom_quiz_filepath=custom_quiz_filepath, **generation_args)
+        return
+
+    # The shared quiz gets a generated title; each user's own title lives in their pointer file
+    run_generate_and_save_quiz_task_sync(requested_quiz_title="",
+                                         custom_quiz_filepath=shared_quiz_path(shared_key), **generation_args)
+    pointer = write_quiz_pointer(custom_quiz_filepath, shared_key, task_data["requested_quiz_title"])
+    progress("ready", title=pointer["title"], questions=pointer["question_count"])
+
+
+def finish_generation_job(job: Dict[str, Any], state: str):
+    """Called once a generation job succeeded or used up its retries: drop its uploaded PDF."""
+    temp_pdf_path = Path(job["payload"]["temp_pdf_path"])
+    if temp_pdf_path.exists():
+        try:
+            temp_pdf_path.unlink(missing_ok=True)
+            print(f"Generation job {job['job_id']} {state}: Cleaned up temporary PDF {temp_pdf_path}")
+        except Exception as e_unlink:
+            print(f"Error cleaning up temp PDF {temp_pdf_path} for job {job['job_id']}: {e_unlink}")
+
+
+def cleanup_orphaned_uploads(min_age_seconds: float = 3600):
+    """Remove uploads that no queued or running job refers to (left behind by a crash)."""
+    still_needed = generation_jobs.active_payload_values("temp_pdf_path")
+    now = time.time()
+    removed = 0
+    for path in UPLOADS_DIR.iterdir():
+        if path.is_file() and str(path) not in still_needed and now - path.stat().st_mtime > min_age_seconds:
+            path.unlink(missing_ok=True)
+            removed += 1
+    if removed:
+        print(f"Removed {removed} orphaned upload(s) from {UPLOADS_DIR}")
+
+
+# --- Durable generation jobs ---
+# Generation jobs are stored in SQLite under DATA_DIR, so a restart or crash doesn't lose them:
+# running jobs whose worker stopped heartbeating are re-queued, failed attempts are retried
+# with exponential backoff, and the pump only hands the generation lane as many jobs as it
+# has threads for.
+pdf_text_cache = pdf_cache.default_cache()
+# Optional limits for extracting uploads: only the first PDF_MAX_PAGES pages, and whatever was
+# extracted after PDF_EXTRACT_TIME_BUDGET_SECONDS
+PDF_MAX_PAGES = _optional_env_number("PDF_MAX_PAGES", None, int)
+PDF_EXTRACT_TIME_BUDGET = _optional_env_number("PDF_EXTRACT_TIME_BUDGET_SECONDS", None, float)
+
+
+def extract_upload_text(pdf_path: str) -> str:
+    return qc.openpdf(pdf_path, max_pages=PDF_MAX_PAGES, time_budget=PDF_EXTRACT_TIME_BUDGET)
+
+
+def pdf_extraction_key(content_digest: str) -> str:
+    # A page cap changes the extracted text, so it is part of the cache key
+    return content_digest if PDF_MAX_PAGES is None else f"{content_digest}-p{PDF_MAX_PAGES}"
+
+
+def upload_extraction_complete(pdf_path: str, text: str) -> bool:
+    """False when PDF_EXTRACT_TIME_BUDGET_SECONDS stopped the extraction before its last page."""
+    if PDF_EXTRACT_TIME_BUDGET is None:
+        return True
+    return len(re.findall(r"--\s*Page\s*\d+\s*--", text)) >= pdf_extract.page_count(pdf_path, PDF_MAX_PAGES)
+
+generation_jobs = job_store.JobStore(os.getenv("JOB_STORE_PATH", str(DATA_DIR / "jobs.sqlite3")))
+generation_job_pump = job_store.JobPump(
+    generation_jobs, background_workers, "generation",
+    handlers={"generate_quiz": generate_quiz_job},
+    on_terminal=finish_generation_job,
+    retry_base_backoff=float(os.getenv("JOB_RETRY_BASE_BACKOFF", "30")),
+)
 
 @app.on_event("startup")
 async def startup_event():
-    print("Application startup: Starting quiz generation worker thread...")
-    if not worker_thread.is_alive():
-        worker_thread.start()
-        print("Quiz generation worker thread started.")
-    else:
-        print("Quiz generation worker thread already alive.")
+    print("Application startup: Starting background worker lanes...")
+    background_workers.start()
+    requeued = generation_jobs.requeue_stale(generation_job_pump.stale_after)
+    print(f"Generation jobs: {generation_jobs.count()} pending ({requeued} re-queued after an unclean stop).")
+    cleanup_orphaned_uploads()
+    generation_jobs.purge_finished(older_than=7 * 24 * 3600)
+    generation_job_pump.start()
+    active_sessions.start_sweeper()
+    # Refresh stale premade quiz snapshots off the request path
+    background_workers.submit("generation", premade_quiz_catalog.precompile)
+    if PRECOMPUTE_WRONG_FEEDBACK:
+        background_workers.submit("precompute", premade_quiz_catalog.precompute_wrong_feedback)
+    if session_state_backend is not None and active_sessions.idle_ttl:
+        purged = session_state_backend.purge_idle(active_sessions.idle_ttl)
+        print(f"Session state backend '{session_state_backend.name}': purged {purged} idle sessions.")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    print("Application shutdown: Signaling worker thread to stop...")
-    task_queue.put(WORKER_SENTINEL) # Signal the worker to exit
-    worker_thread.join(timeout=5) # Wait for the worker thread to finish
-    if worker_thread.is_alive():
-        print("Worker thread did not shut down gracefully.")
-    else:
-        print("Quiz generation worker thread shut down.")
+    print("Application shutdown: Signaling background workers to stop...")
+    generation_job_pump.stop()
+    background_workers.stop(timeout=5) # Worker threads are daemons; jobs cut off here are re-queued on next start
+    llm_dispatch.shutdown(wait=False)
+    active_sessions.stop_sweeper()
+    pdf_extract.shutdown_pool()
+    if q_cl.grade_cache is not None:
+        q_cl.grade_cache.flush_touches()
+
+
+@app.get("/api/llm-executor/stats", response_class=JSONResponse)
+async def llm_executor_stats():
+    """Per-lane queue depth, concurrency and wait-time metrics for the LLM executor."""
+    return JSONResponse(llm_dispatch.stats())
+
+
+@app.get("/api/workers/stats", response_class=JSONResponse)
+async def background_worker_stats():
+    """Per-lane queue depth, wait time and run time for the background worker pool."""
+    return JSONResponse(background_workers.stats())
+
+
+@app.get("/api/grading/stats", response_class=JSONResponse)
+async def grading_stats():
+    """How many short answers were settled without an LLM call: by the local grader and the grade cache."""
+    return JSONResponse({
+        "local_grader": local_grader.default_grader.stats(),
+        "grade_cache": await run_in_threadpool(q_cl.grade_cache.stats) if q_cl.grade_cache is not None else None,
+    })
+
+
+@app.get("/api/sessions/stats", response_class=JSONResponse)
+async def session_store_stats():
+    """Session count, estimated memory and eviction counters for the session store."""
+    return JSONResponse(active_sessions.stats())
 
 
 @app.post("/api/initiate-quiz-generation", response_class=JSONResponse)
@@ -997,30 +1540,50 @@ async def initiate_quiz_generation(
     display_title_immediate = title_for_generation_task if title_for_generation_task else f"Quiz from: {sane_filename[:30]}"
     if len(display_title_immediate) > 60: display_title_immediate = display_title_immediate[:57] + "..."
 
-    try:
-        with open(temp_pdf_path, "wb") as buffer:
-            buffer.write(await file.read())
-        print(f"PDF '{sane_filename}' saved to '{temp_pdf_path}' for quiz ID '{user_specific_quiz_id_stem}' (session: {session_id})")
-
-        source_material = qc.openpdf(str(temp_pdf_path))
-        if not source_material or not source_material.strip():
-            if temp_pdf_path.exists(): temp_pdf_path.unlink(missing_ok=True)
-            raise HTTPException(status_code=400, detail="Could not extract text from PDF, or PDF is empty/unreadable.")
+    if generation_jobs.count() >= GENERATION_MAX_PENDING_JOBS:
+        print(f"Generation queue full, rejecting quiz ID '{user_specific_quiz_id_stem}'")
+        raise HTTPException(status_code=503, detail="Too many quizzes are being generated right now. Please try again in a few minutes.")
 
-        # Prepare task data
+    try:
+        # Copied in chunks (hashing on the way) in the thread pool; the PDF is never held in memory whole
+        try:
+            content_digest, upload_size = await run_in_threadpool(save_upload, file.file, temp_pdf_path, MAX_UPLOAD_BYTES)
+        except UploadTooLargeError:
+            raise HTTPException(status_code=413, detail=f"PDF is too large (limit {MAX_UPLOAD_BYTES // (1024 * 1024)} MB).")
+        with open(temp_pdf_path, "rb") as f:
+            if not f.read(5).startswith(b"%PDF"):
+                raise HTTPException(status_code=400, detail="The uploaded file is not a valid PDF.")
+        print(f"PDF '{sane_filename}' ({upload_size} bytes) saved to '{temp_pdf_path}' for quiz ID '{user_specific_quiz_id_stem}' (session: {session_id})")
+
+        shared_key = shared_quiz_key(content_digest, quiz_size_preference)
+        if shared_quiz_path(shared_key).exists():
+            # Someone already generated a quiz from this exact document: just link it for this user
+            temp_pdf_path.unlink(missing_ok=True)
+            pointer = await run_in_threadpool(write_quiz_pointer, custom_quiz_filepath, shared_key, title_for_generation_task)
+            print(f"Quiz ID '{user_specific_quiz_id_stem}' reuses the shared quiz for an identical upload of '{sane_filename}'")
+            return JSONResponse({
+                "status": "ready",
+                "quiz_id": user_specific_quiz_id_stem,
+                "quiz_title": pointer["title"],
+                "message": "This document has already been turned into a quiz. It was added to your quizzes."
+            })
+
+        # Prepare task data (stored as JSON in the job store). Text extraction happens in the job.
         task_data = {
-            "task_type": "generate_quiz", # Specify task type
-            "source_material": source_material,
+            "content_digest": content_digest,
             "requested_quiz_title": title_for_generation_task,
-            "custom_quiz_filepath": custom_quiz_filepath,
-            "temp_pdf_path": temp_pdf_path,
+            "custom_quiz_filepath": str(custom_quiz_filepath),
+            "temp_pdf_path": str(temp_pdf_path),
             "quiz_id_stem": user_specific_quiz_id_stem,
             "quiz_size_preference": quiz_size_preference,
+            "shared_key": shared_key,
             "session_id": session_id # For logging/context if needed by quiz gen
         }
 
-        # Put the task onto the global queue
-        task_queue.put(task_data)
+        generation_jobs.enqueue(user_specific_quiz_id_stem, "generate_quiz", task_data, max_attempts=GENERATION_JOB_MAX_ATTEMPTS,
+                                progress={"stage": "uploaded"},
+                                dedup_key=shared_key) # Identical uploads queue behind one generation
+        generation_job_pump.wake()
         
         print(f"Quiz generation task for ID '{user_specific_quiz_id_stem}' (initial title: '{title_for_generation_task if title_for_generation_task else '[Auto-generate]'}', size_pref: {quiz_size_preference or 'auto'}) added to the queue.")
         
@@ -1039,6 +1602,83 @@ async def initiate_quiz_generation(
         print(f"Error during synchronous part of PDF processing for quiz ID '{user_specific_quiz_id_stem}': {type(e).__name__} - {e}")
         raise HTTPException(status_code=500, detail=f"Server error processing PDF ({sane_filename}). Please try again or use a different file.")
 
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_SECONDS", "0.5"))
+JOB_EVENTS_KEEPALIVE_SECONDS = 15.0
+
+def job_status_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The parts of a generation job the owning user may see."""
+    return {
+        "quiz_id": job["job_id"],
+        "state": job["state"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "error": job["last_error"] if job["state"] == job_store.FAILED else None,
+        "retrying": job["state"] == job_store.QUEUED and job["attempts"] > 0,
+        "done": job["state"] in job_store.TERMINAL_STATES,
+    }
+
+def generation_job_status(quiz_id: str) -> Optional[Dict[str, Any]]:
+    job = generation_jobs.get(quiz_id)
+    if job is None:
+        return None
+    view = job_status_view(job)
+    if job["state"] == job_store.QUEUED and job.get("dedup_key"):
+        # Waiting on an identical upload's generation: show that job's progress instead
+        leader = generation_jobs.running_with_key(job["dedup_key"])
+        if leader is not None:
+            view["progress"] = dict(leader["progress"], shared=True)
+    return view
+
+async def get_own_generation_job_status(request: Request, quiz_id: str) -> Dict[str, Any]:
+    session_id = get_session_id(request)
+    # Jobs are keyed by the quiz id, which carries the owner's session id
+    status = None
+    if quiz_id.startswith(f"{session_id}_custom_"):
+        status = await run_in_threadpool(generation_job_status, quiz_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Generation job not found.")
+    return status
+
+@app.get("/api/jobs/{quiz_id}", response_class=JSONResponse)
+async def get_generation_job_status(request: Request, quiz_id: str):
+    return JSONResponse(await get_own_generation_job_status(request, quiz_id))
+
+@app.get("/api/jobs/{quiz_id}/events")
+async def stream_generation_job_events(request: Request, quiz_id: str):
+    """
+    Server-Sent Events for one generation job: a "progress" event whenever the job's
+    state or progress changes, then a final "done" event once it succeeded or failed.
+    The job store is read server-side, so any worker process can serve the stream.
+    """
+    status = await get_own_generation_job_status(request, quiz_id)
+
+    async def event_stream():
+        view = status
+        last_sent = None
+        last_write = time.monotonic()
+        while True:
+            if view != last_sent:
+                event = "done" if view["done"] else "progress"
+                yield f"event: {event}\ndata: {json.dumps(view)}\n\n"
+                last_sent = view
+                last_write = time.monotonic()
+                if view["done"]:
+                    return
+            elif time.monotonic() - last_write >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_write = time.monotonic()
+
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+            if await request.is_disconnected():
+                return
+            view = await run_in_threadpool(generation_job_status, quiz_id)
+            if view is None:  # purged meanwhile
+                return
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/api/chat-with-tutor", response_class=JSONResponse)
 async def chat_with_tutor_api(request: Request, message_data: Dict[str, str]):
     """Handles follow-up chat messages with the tutor."""
@@ -1061,7 +1701,13 @@ async def chat_with_tutor_api(request: Request, message_data: Dict[str, str]):
     ai_messages_for_user.clear()  # Clear previous messages before new interaction
 
     try:
-        tutor.prompt(f"User follow-up: {user_message}")
+        await run_until_client_disconnects(
+            request, llm_dispatch.run_async("tutor", tutor.aprompt, f"User follow-up: {user_message}"))
+    except llm_executor.LaneFullError as e:
+        print(f"Tutor lane full for session {session_id}: {e}")
+        return JSONResponse({"ai_messages": ["The tutor is busy right now. Please try again in a moment."]}, status_code=503)
+    except ClientDisconnected:
+        raise
     except Exception as e:
         print(f"Error during tutor chat: {e}")
         ai_messages_for_user.append(f"Sorry, I encountered an issue: {e}")
@@ -1085,10 +1731,13 @@ async def text_to_speech_api(request: Request, text_data: Dict[str, str]):
 
     try:
         # Use the premium TTS function from google_tts.py
-        audio_content = google_tts.text_to_speech_premium(text_to_speak)
+        audio_content = await llm_dispatch.run("tts", google_tts.text_to_speech_premium, text_to_speak)
 
         # Return the audio content as a streaming response
         return StreamingResponse(io.BytesIO(audio_content), media_type="audio/mpeg")
+    except llm_executor.LaneFullError as e:
+        print(f"TTS Error: {e}")
+        raise HTTPException(status_code=503, detail="Text-to-speech is busy right now. Please try again in a moment.")
     except Exception as e:
         print(f"TTS Error: {e}")
         raise HTTPException(status_code=500, detail=f"TTS generation failed: {e}")
@@ -0,0 +1,144 @@
+from typing import Callable, Dict, Any, Optional, Tuple
+from pathlib import Path
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+print("pdf_cache.py")
+
+
+# Bump when openpdf's output format changes so stale extractions aren't served
+EXTRACTOR_VERSION = "openpdf-1"
+
+
+def content_digest(data: bytes) -> str:
+    """sha256 hex digest of a document's bytes (the cache key, also used to spot identical uploads)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PDFTextCache:
+    """
+    Extracted PDF text on disk, keyed by the sha256 of the PDF's bytes, so the same
+    document is only parsed once across uploads, restarts and worker processes.
+
+    Entries are plain UTF-8 files written atomically. Hits refresh the file's mtime, and
+    after each write the least recently used entries are deleted until the directory
+    is under max_bytes.
+    """
+    def __init__(self, directory, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _entry_path(self, digest: str) -> Path:
+        return self.directory / f"{EXTRACTOR_VERSION}-{digest}.txt"
+
+    def get(self, digest: str) -> Optional[str]:
+        path = self._entry_path(digest)
+        try:
+            text = path.read_text(encoding="utf-8")
+        except (FileNotFoundError, OSError, UnicodeDecodeError):
+            with self._lock:
+                self._misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self._hits += 1
+        return text
+
+    def put(self, digest: str, text: str):
+        path = self._entry_path(digest)
+        tmp_path = self.directory / f".{path.name}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"PDFTextCache: could not store {digest[:12]}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        self.evict_to_limit()
+
+    def evict_to_limit(self) -> int:
+        entries = []
+        for path in self.directory.glob("*.txt"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # removed by another process meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if removed:
+            with self._lock:
+                self._evictions += removed
+        return removed
+
+    def extract(self, pdf_path, extractor: Callable[[str], str], digest: Optional[str] = None,
+                is_complete: Optional[Callable[[str], bool]] = None) -> Tuple[str, str]:
+        """
+        (digest, text) for the PDF at pdf_path, running extractor(path) only on a cache miss.
+        Text that is_complete(text) rejects (e.g. cut short by a time budget) is returned but
+        not cached, so the next extraction of the document gets another chance.
+        """
+        if digest is None:
+            digest = file_digest(pdf_path)
+        text = self.get(digest)
+        if text is None:
+            start = time.perf_counter()
+            text = extractor(str(pdf_path))
+            print(f"PDFTextCache: extracted {Path(pdf_path).name} in {time.perf_counter() - start:.2f}s")
+            if not text or not text.strip():  # don't remember failed extractions
+                return digest, text
+            if is_complete is not None and not is_complete(text):
+                print(f"PDFTextCache: not caching the partial extraction of {Path(pdf_path).name}")
+                return digest, text
+            self.put(digest, text)
+        return digest, text
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "evictions": self._evictions,
+                    "max_bytes": self.max_bytes, "directory": str(self.directory)}
+
+
+_default_cache: Optional[PDFTextCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> PDFTextCache:
+    """
+    Process-wide cache, created on first use.
+    PDF_CACHE_DIR    – default {RENDER_DISK_MOUNT_PATH or app dir}/pdf_text_cache
+    PDF_CACHE_MAX_MB – default 256
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            base = os.environ.get("RENDER_DISK_MOUNT_PATH", str(Path(__file__).parent))
+            directory = os.getenv("PDF_CACHE_DIR", str(Path(base) / "pdf_text_cache"))
+            max_bytes = int(float(os.getenv("PDF_CACHE_MAX_MB", "256")) * 1024 * 1024)
+            _default_cache = PDFTextCache(directory, max_bytes)
+        return _default_cache
@@ -0,0 +1,118 @@
+from typing import Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError as FutureTimeoutError
+import multiprocessing
+import os
+import threading
+import time
+
+import pypdf
+
+print("pdf_extract.py")
+
+
+# Documents shorter than this many pages (2 tasks' worth) are extracted in-process
+PAGES_PER_TASK = 16
+
+
+def _page_text(page) -> str:
+    return (page.extract_text() or "").replace('\n', ' ')
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Runs in a pool process: text of pages [start, stop)."""
+    reader = pypdf.PdfReader(pdf_path)
+    try:
+        return [_page_text(reader.pages[i]) for i in range(start, stop)]
+    finally:
+        reader.close()
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    return max(1, int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1)))))
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs threads (web server, LLM clients) isn't safe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def iter_pdf_pages(pdf_path, max_pages: Optional[int] = None, time_budget: Optional[float] = None,
+                   workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (page_number, text) in page order, page numbers starting at 1.
+
+    Long documents are split into PAGES_PER_TASK-page ranges extracted in a shared process
+    pool (workers processes, default PDF_EXTRACT_WORKERS). max_pages caps the pages read;
+    once time_budget seconds have passed no further pages are yielded.
+    """
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+    pdf_path = str(pdf_path)
+    reader = pypdf.PdfReader(pdf_path)
+    page_count = len(reader.pages)
+    if max_pages is not None:
+        page_count = min(page_count, max_pages)
+    workers = workers or default_workers()
+
+    if workers <= 1 or page_count < 2 * PAGES_PER_TASK:
+        try:
+            for i in range(page_count):
+                if deadline is not None and time.monotonic() > deadline:
+                    return
+                yield i + 1, _page_text(reader.pages[i])
+        finally:
+            reader.close()
+        return
+    reader.close()
+
+    pool = _get_pool(workers)
+    futures: List[Tuple[int, Future]] = [(start, pool.submit(_extract_range, pdf_path, start, min(start + PAGES_PER_TASK, page_count)))
+                                         for start in range(0, page_count, PAGES_PER_TASK)]
+    try:
+        for start, future in futures:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                pages = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                return
+            for offset, text in enumerate(pages):
+                yield start + offset + 1, text
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+
+def page_count(pdf_path, max_pages: Optional[int] = None) -> int:
+    """Pages iter_pdf_pages yields for pdf_path when it isn't stopped by its time budget."""
+    reader = pypdf.PdfReader(str(pdf_path))
+    try:
+        count = len(reader.pages)
+    finally:
+        reader.close()
+    return count if max_pages is None else min(count, max_pages)
+
+
+def extract_pdf_text(pdf_path, max_pages: Optional[int] = None, time_budget: Optional[float] = None,
+                     workers: Optional[int] = None) -> Tuple[str, int]:
+    """(text in openpdf's '-- Page N --' format, pages extracted)."""
+    parts: List[str] = []
+    pages = 0
+    for page_number, text in iter_pdf_pages(pdf_path, max_pages, time_budget, workers):
+        parts.append(f"-- Page {page_number} --\n{text}\n")
+        pages = page_number
+    return "".join(parts), pages
@@ -0,0 +1,212 @@
+from typing import Any, Callable, Dict, Optional
+from pathlib import Path
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from quizclass import Quiz, precompute_wrong_feedback
+import pdf_cache
+
+print("catalog.py")
+
+# premade_quizzes.py builds every premade quiz (and parses its PDF) as soon as it's imported.
+# The catalog keeps a JSON snapshot per quiz instead (question bank + extracted source text)
+# and only imports premade_quizzes.py when a snapshot is missing or stale.
+# Precompile ahead of a deploy with: python -m premade_quizzes.catalog
+
+CURRENT_DIR = Path(__file__).resolve().parent
+APP_DIR = CURRENT_DIR.parent
+
+# Bump when the snapshot layout changes
+SNAPSHOT_FORMAT = 1
+
+# key -> the quiz's variable in premade_quizzes.py and the PDF its source text comes from
+PREMADE_QUIZZES: Dict[str, Dict[str, str]] = {
+    "california_driving": {"attribute": "quiz_traffic_laws", "pdf": "DL600CaliforniaHandbook.pdf"},
+    "ap_us_history": {"attribute": "quiz_ap_us_history", "pdf": "AP US History Quiz Prep_.pdf"},
+    "us_citizenship_test": {"attribute": "quiz_usa_citizens_test", "pdf": "US Citizenship Test Knowledge Report_.pdf"},
+}
+SOURCE_MODULE = "premade_quizzes.premade_quizzes"
+# A change to any of these (or to the quiz's PDF) invalidates the snapshot
+SOURCE_FILES = [CURRENT_DIR / "premade_quizzes.py", APP_DIR / "quizclass.py", APP_DIR / "questionclass.py"]
+
+
+def default_snapshot_dir() -> Path:
+    """PREMADE_SNAPSHOT_DIR, default {RENDER_DISK_MOUNT_PATH or app dir}/premade_snapshots"""
+    base = os.environ.get("RENDER_DISK_MOUNT_PATH", str(APP_DIR))
+    return Path(os.getenv("PREMADE_SNAPSHOT_DIR", str(Path(base) / "premade_snapshots")))
+
+
+class PremadeQuizCatalog:
+    """
+    Premade quizzes loaded on first use, so unused quizzes cost no memory or start-up time.
+
+    Each quiz is restored from {key}.json (Quiz.to_dict output) when {key}.meta.json records
+    the current source fingerprint: a hash of premade_quizzes.py, the question classes and
+    the quiz's PDF, so edits and new deploys rebuild it while restarts don't. Otherwise
+    premade_quizzes.py is imported and snapshots are written for every quiz it defines.
+    on_load(key, quiz) runs once per quiz, after it's first loaded.
+    precompute_wrong_feedback() adds the wrong-option feedback to each snapshot (and to the
+    quiz if it's already loaded); it's separate from precompile() because it makes LLM calls.
+    """
+    def __init__(self, snapshot_dir, quizzes: Dict[str, Dict[str, str]] = PREMADE_QUIZZES,
+                 on_load: Optional[Callable[[str, Quiz], Any]] = None):
+        self.snapshot_dir = Path(snapshot_dir)
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        self.quizzes = quizzes
+        self.on_load = on_load
+        self._loaded: Dict[str, Quiz] = {}
+        self._question_counts: Dict[str, int] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._key_locks = {key: threading.Lock() for key in quizzes}
+        self._build_lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.quizzes
+
+    def fingerprint(self, key: str) -> str:
+        if key not in self._fingerprints:
+            digest = hashlib.sha256(f"{SNAPSHOT_FORMAT}:{pdf_cache.EXTRACTOR_VERSION}".encode())
+            for path in SOURCE_FILES + [CURRENT_DIR / self.quizzes[key]["pdf"]]:
+                digest.update(path.name.encode())
+                digest.update(pdf_cache.file_digest(path).encode() if path.is_file() else b"missing")
+            self._fingerprints[key] = digest.hexdigest()
+        return self._fingerprints[key]
+
+    def _snapshot_paths(self, key: str):
+        return self.snapshot_dir / f"{key}.json", self.snapshot_dir / f"{key}.meta.json"
+
+    def _read_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        """The snapshot's metadata if the snapshot is current, else None."""
+        _, meta_path = self._snapshot_paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("fingerprint") != self.fingerprint(key):
+            return None
+        return meta
+
+    def _write_json(self, path: Path, data: Dict[str, Any]):
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _write_snapshot(self, key: str, quiz: Quiz, wrong_feedback: bool = False):
+        quiz_path, meta_path = self._snapshot_paths(key)
+        try:
+            self._write_json(quiz_path, quiz.to_dict())
+            # Written last: a meta file means its snapshot is complete
+            self._write_json(meta_path, {"fingerprint": self.fingerprint(key),
+                                         "question_count": quiz.get_total_question_count(),
+                                         "wrong_feedback": wrong_feedback})
+        except OSError as e:
+            print(f"PremadeQuizCatalog: could not write the '{key}' snapshot: {e}")
+
+    def _build(self, key: str) -> Quiz:
+        """Builds the quiz from premade_quizzes.py, snapshotting every quiz it defines."""
+        with self._build_lock:
+            start = time.perf_counter()
+            module = importlib.import_module(SOURCE_MODULE)
+            for other_key, info in self.quizzes.items():
+                other_quiz = getattr(module, info["attribute"], None)
+                if other_quiz is not None and self._read_meta(other_key) is None:
+                    self._write_snapshot(other_key, other_quiz)
+            print(f"PremadeQuizCatalog: built premade quiz snapshots in {time.perf_counter() - start:.2f}s")
+            return getattr(module, self.quizzes[key]["attribute"])
+
+    def _load_snapshot(self, key: str) -> Optional[Quiz]:
+        if self._read_meta(key) is None:
+            return None
+        quiz_path, _ = self._snapshot_paths(key)
+        try:
+            with open(quiz_path, "r") as f:
+                return Quiz.from_dict(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"PremadeQuizCatalog: unreadable '{key}' snapshot, rebuilding: {e}")
+            return None
+
+    def get(self, key: str) -> Quiz:
+        """The shared quiz object for key (KeyError if unknown); use create_session_view() per session."""
+        quiz = self._loaded.get(key)
+        if quiz is not None:
+            return quiz
+        with self._key_locks[key]:
+            if key in self._loaded:
+                return self._loaded[key]
+            start = time.perf_counter()
+            quiz = self._load_snapshot(key)
+            if quiz is None:
+                quiz = self._build(key)
+            self._question_counts[key] = quiz.get_total_question_count()
+            if self.on_load is not None:
+                self.on_load(key, quiz)
+            self._loaded[key] = quiz
+            print(f"PremadeQuizCatalog: loaded '{key}' in {time.perf_counter() - start:.2f}s")
+            return quiz
+
+    def question_count(self, key: str) -> int:
+        """Question count without loading the quiz when its snapshot is current."""
+        if key not in self._question_counts:
+            meta = self._read_meta(key)
+            if meta is not None and "question_count" in meta:
+                self._question_counts[key] = int(meta["question_count"])
+            else:
+                self.get(key)
+        return self._question_counts[key]
+
+    def _add_wrong_feedback(self, key: str, max_workers: int):
+        """Precomputes the snapshot's wrong-option feedback; the LLM requests run without holding the key's lock."""
+        with self._key_locks[key]:
+            meta = self._read_meta(key)
+            if meta is None or meta.get("wrong_feedback"):
+                return
+            quiz = self._loaded.get(key) or self._load_snapshot(key)
+        if quiz is None:
+            return
+        start = time.perf_counter()
+        stored = precompute_wrong_feedback(quiz, max_workers=max_workers)
+        with self._key_locks[key]:
+            loaded = self._loaded.get(key)
+            if loaded is not None and loaded is not quiz:
+                # Loaded from the snapshot meanwhile: hand it the new feedback
+                for section, loaded_section in zip(quiz.section_bank, loaded.section_bank):
+                    for question, loaded_question in zip(section.questions, loaded_section.questions):
+                        if hasattr(loaded_question, "wrong_feedback"):
+                            loaded_question.wrong_feedback.update(question.wrong_feedback)
+            # Options whose request failed are retried by the next precompute_wrong_feedback()
+            complete = not any(q.missing_wrong_feedback() for s in quiz.section_bank for q in s.questions
+                               if hasattr(q, "missing_wrong_feedback"))
+            self._write_snapshot(key, quiz, wrong_feedback=complete)
+        print(f"PremadeQuizCatalog: precomputed feedback for {stored} wrong options of '{key}' in {time.perf_counter() - start:.2f}s")
+
+    def precompile(self):
+        """Brings every snapshot up to date without keeping the quizzes loaded."""
+        for key in self.quizzes:
+            with self._key_locks[key]:
+                if key not in self._loaded and self._read_meta(key) is None:
+                    self._build(key)
+
+    def precompute_wrong_feedback(self, max_workers: int = 2):
+        """Brings every snapshot up to date, then fills in the wrong-option feedback it doesn't have yet."""
+        self.precompile()
+        for key in self.quizzes:
+            self._add_wrong_feedback(key, max_workers)
+
+
+if __name__ == '__main__':
+    catalog = PremadeQuizCatalog(default_snapshot_dir())
+    catalog.precompile()
+    if os.getenv("PRECOMPUTE_WRONG_FEEDBACK", "1") != "0":
+        catalog.precompute_wrong_feedback()
+    for quiz_key in catalog.quizzes:
+        print(f"{quiz_key}: {catalog.question_count(quiz_key)} questions")
@@ -2,6 +2,7 @@ from typing import List, Tuple
 from pathlib import Path # Added import
 from quizclass import Quiz, openpdf # quizclass.py should contain openpdf
 import questionclass as qc
+import pdf_cache
 
 # pypdf is used by the openpdf function in quizclass.py
 # If openpdf were defined locally here, we'd need: import pypdf
@@ -27,7 +28,8 @@ def _load_pdf_material(pdf_path: Path) -> str:
               f"Ensure the file is in the correct directory and committed to the repository.")
         return ""  # Return empty string if file not found
     try:
-        content = openpdf(pdf_path) # openpdf from quizclass.py is expected to return text content
+        # Extracted text is cached on disk by content hash, so only the first start parses the PDF
+        _, content = pdf_cache.default_cache().extract(pdf_path, openpdf)
         if not content or not content.strip():
             print(f"WARNING: Premade quiz PDF at {pdf_path} was opened but yielded no text content.")
             return ""
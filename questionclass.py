@@ -1,20 +1,50 @@
-from typing import List, TypedDict, Callable, Tuple
+from typing import List, TypedDict, Callable, Tuple, Optional, Dict, Any, Union
+from collections import OrderedDict
+import os
 import random
 import re
 import json
+import copy
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
 
 import chatapi
+import llm_backend
+import local_grader
 
 print("questionclass.py")
 
 
 class Question:
     def __init__(self, question: str, explanation: str, weight=1.0, quiz_size: int = 10):
+        # Set by weighted_sampler.QuizSampler so weight changes update its trees in place
+        self._weight_listener = None
+        self._sampler_pos = None
         self.question: str = question
         self.explanation: str = explanation
         self.weight: float = weight
         self.quiz_size: int = quiz_size
 
+    @property
+    def weight(self) -> float:
+        return self._weight
+
+    @weight.setter
+    def weight(self, value: float):
+        self._weight = value
+        if self._weight_listener is not None:
+            self._weight_listener.weight_changed(self)
+
+    def session_copy(self) -> "Question":
+        """Shallow copy for a per-session quiz view: shares the text, owns the mutable state."""
+        clone = copy.copy(self)
+        clone._weight_listener = None
+        clone._sampler_pos = None
+        return clone
+
     def build_parts(self):
         pass
 
@@ -27,6 +57,11 @@ class Question:
     def grade_answer(self, answer: str) -> Tuple[float, str]:
         pass
 
+    def apply_grade(self, grade: float, reason: str) -> Tuple[float, str]:
+        """Records a graded answer in the weight (well answered questions come up less) and passes the grade on."""
+        self.reduce_weight() if grade > 0.8 else self.increase_weight()
+        return grade, reason
+
     def increase_weight(self, quiz_size: int = 10):
         self.weight += quiz_size *  0.1
         self.weight = min(self.weight, quiz_size * 0.50)
@@ -35,6 +70,180 @@ class Question:
         self.weight *= 2/5
 
 
+# Identical for every question: the part of each grading request the provider can cache
+GRADER_INSTRUCTIONS = """
+You're AI Grader. Your job is to critically assess a user’s answer based strictly on the fixed question, explanation, and sample answer provided. 
+Focus only on accuracy and completeness compared to the given standard.
+Use the embedded question, explanation, and correct sample answer to find all factual errors, missing points, or signs of misunderstanding in the user’s response.
+You should remove points for,
+Factual Inaccuracy: The answer contains incorrect information or statements that contradict the provided explanation or sample answer.
+Key Omissions: Essential points, components, steps, or details clearly present in the sample answer or required by the explanation are missing.
+Misunderstanding of Concepts: The answer demonstrates incorrect use of terminology, misapplication of principles, or a superficial understanding contrary to the provided explanation.
+Lack of Specificity/Vagueness: The answer is too general, ambiguous, or lacks the precision required by the question or demonstrated in the sample answer.
+Irrelevant Information: The answer includes details or statements that are off-topic or do not directly address the specific question asked.
+
+Do not be scared to fail the user.
+Users who show a lack of understanding should be given a low grade so they can learn from their mistakes.
+Grading Criteria:
+* Accuracy: Is the answer factually correct?
+* Completeness: Are all key points covered?
+* Understanding: Does it show a clear grasp of the concepts?
+* Clarity: Is it specific and unambiguous?
+
+Return your evaluation as a single JSON object with two keys:
+
+* `grade`: a float between 0.0 and 1.0 based on how closely the user’s answer matches the meaning of the sample.
+* `reason`: a detailed explanation of what was wrong, missing, or unclear in the user’s answer. Be direct and specific. Focus on critical feedback that helps the user improve. Avoid encouragement or vague praise.
+
+Output Format:
+Only return a valid JSON object like this:
+{ 'grade': 0.85, 'reason': 'The answer missed X, incorrectly stated Y, and failed to explain Z. It did mention A correctly, but lacked clarity in B.' }
+""".strip()
+# "stateless" (default) sends each answer as its own request; "chat" keeps one grader chat per question
+GRADER_MODE = os.getenv("GRADER_MODE", "stateless")
+
+
+class GradeCache:
+    """
+    LLM grades kept in a SQLite file, keyed by a hash of the question's grader prompt and the
+    normalized answer, so an answer that was graded before (by any user, in any process,
+    before a restart) isn't sent to the grader again.
+
+    Entries expire ttl seconds after they were graded; beyond max_entries the least recently
+    used are deleted. The most recent memory_entries are also held in memory; hits served from
+    memory are written back to last_used_at in batches of touch_batch (and before every prune).
+    """
+    def __init__(self, path: str, max_entries: int = 100000, ttl: float = 30 * 24 * 3600,
+                 memory_entries: int = 4096, busy_timeout: float = 5.0, touch_batch: int = 64):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.busy_timeout = busy_timeout
+        self.touch_batch = touch_batch
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, str, float]]" = OrderedDict()  # key -> (grade, reason, created_at)
+        self._touched: Dict[str, float] = {}  # key -> last memory hit not yet written to SQLite
+        self._puts = 0
+        self._hits = 0
+        self._misses = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS grades (
+                key          TEXT PRIMARY KEY,
+                grade        REAL NOT NULL,
+                reason       TEXT NOT NULL,
+                created_at   REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS grades_last_used ON grades (last_used_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")  # a grade lost in a power cut is just regraded
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(grader_prompt: str, answer: str) -> str:
+        normalized = local_grader.normalize_answer(answer)
+        return hashlib.sha256(f"{grader_prompt}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, entry: Tuple[float, str, float]):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Tuple[float, str]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            in_memory = entry is not None and now - entry[2] <= self.ttl
+            if in_memory:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                self._touched[key] = now
+                flush = len(self._touched) >= self.touch_batch
+        if in_memory:
+            if flush:
+                self.flush_touches()
+            return entry[0], entry[1]
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT grade, reason, created_at FROM grades WHERE key = ? AND created_at >= ?",
+                               (key, now - self.ttl)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE grades SET last_used_at = ? WHERE key = ?", (now, key))
+        if row is None:
+            with self._lock:
+                self._misses += 1
+            return None
+        self._remember(key, (row[0], row[1], row[2]))
+        with self._lock:
+            self._hits += 1
+        return row[0], row[1]
+
+    def put(self, key: str, grade: float, reason: str):
+        now = time.time()
+        self._remember(key, (grade, reason, now))
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO grades (key, grade, reason, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                         (key, grade, reason, now, now))
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % 100 == 0
+        if prune:
+            self.prune()
+
+    def flush_touches(self):
+        """Writes the last_used_at of entries read from memory since the last flush."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("UPDATE grades SET last_used_at = MAX(last_used_at, ?) WHERE key = ?",
+                             [(used_at, key) for key, used_at in touched.items()])
+
+    def prune(self) -> int:
+        """Deletes expired entries and the least recently used beyond max_entries."""
+        self.flush_touches()
+        conn = self._conn()
+        with conn:
+            removed = conn.execute("DELETE FROM grades WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+            removed += conn.execute("""
+                DELETE FROM grades WHERE key IN (
+                    SELECT key FROM grades ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)
+                """, (self.max_entries,)).rowcount
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._conn().execute("SELECT COUNT(*) FROM grades").fetchone()[0]
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"hits": self._hits, "misses": self._misses, "hit_rate": self._hits / lookups if lookups else 0.0,
+                    "entries": entries, "memory_entries": len(self._memory),
+                    "max_entries": self.max_entries, "ttl_seconds": self.ttl}
+
+
+# Set by the app (set_grade_cache); None grades every answer afresh
+grade_cache: Optional[GradeCache] = None
+
+
+def set_grade_cache(cache: Optional[GradeCache]):
+    global grade_cache
+    grade_cache = cache
+
+
 class ShortAnswer(Question):
     # explanation should contain information relevant to the question/answer.
     #   This will be used to give the AI context and help educate the user
@@ -46,49 +255,41 @@ class ShortAnswer(Question):
         self.correct_answer: List[str] = correct_answer
         self.grading_instructions: str = grading_instructions
 
-        formatstr = "{ 'grade': 0.85, 'reason': 'The answer missed X, incorrectly stated Y, and failed to explain Z. It did mention A correctly, but lacked clarity in B.' }"
-        self.graderprompt: str = f"""
-            You're AI Grader. Your job is to critically assess a user’s answer based strictly on the fixed question, explanation, and sample answer provided. 
-            Focus only on accuracy and completeness compared to the given standard.
-            Use the embedded question, explanation, and correct sample answer to find all factual errors, missing points, or signs of misunderstanding in the user’s response.
-            You should remove points for,
-            Factual Inaccuracy: The answer contains incorrect information or statements that contradict the provided explanation or sample answer.
-            Key Omissions: Essential points, components, steps, or details clearly present in the sample answer or required by the explanation are missing.
-            Misunderstanding of Concepts: The answer demonstrates incorrect use of terminology, misapplication of principles, or a superficial understanding contrary to the provided explanation.
-            Lack of Specificity/Vagueness: The answer is too general, ambiguous, or lacks the precision required by the question or demonstrated in the sample answer.
-            Irrelevant Information: The answer includes details or statements that are off-topic or do not directly address the specific question asked.
+        self._graderprompt: str = None
+        self.grader: chatapi.FlashChat = None  # only used with GRADER_MODE=chat
 
-            Return your evaluation as a single JSON object with two keys:
+    @property
+    def graderprompt(self) -> str:
+        # Built on first use (only questions that reach the LLM grader need it), then reused.
+        # The shared GRADER_INSTRUCTIONS come first so every grading request starts with the same prefix.
+        if self._graderprompt is None:
+            self._graderprompt = f"{GRADER_INSTRUCTIONS}\n\n{self.grading_context()}"
+        return self._graderprompt
 
-            * `grade`: a float between 0.0 and 1.0 based on how closely the user’s answer matches the meaning of the sample.
-            * `reason`: a detailed explanation of what was wrong, missing, or unclear in the user’s answer. Be direct and specific. Focus on critical feedback that helps the user improve. Avoid encouragement or vague praise.
+    def grading_context(self) -> str:
+        """The question-specific part of the grader prompt."""
+        return f"""Question: "{self.question}"
 
-            Question: "{question}"
+Question Explanation: {self.explanation}
 
-            Question Explanation: {explanation}
+Sample Answer(s): {', '.join(f'"{item}"' for item in self.correct_answer)}
 
-            Sample Answer(s): {', '.join(f'"{item}"' for item in correct_answer)}
+Grading Instructions: {self.grading_instructions}"""
 
-            Grading Instructions: {grading_instructions}
-
-            Do not be scared to fail the user.
-            Users who show a lack of understanding should be given a low grade so they can learn from their mistakes.
-            Grading Criteria:
-            * Accuracy: Is the answer factually correct?
-            * Completeness: Are all key points covered?
-            * Understanding: Does it show a clear grasp of the concepts?
-            * Clarity: Is it specific and unambiguous?
-
-            Output Format:
-            Only return a valid JSON object like this:
-            {formatstr}
-            """.strip()
-        self.grader: chatapi.FlashChat = None
+    def session_copy(self) -> "ShortAnswer":
+        clone = super().session_copy()
+        clone.grader = None
+        return clone
 
     def setup_grader(self):
         if self.grader is None:
             self.grader = chatapi.FlashChat(self.graderprompt, model="gemini-2.0-flash")
 
+    def release_grader(self):
+        if self.grader is not None:
+            self.grader.close()
+            self.grader = None
+
     def build_parts(self):
         return self.question
 
@@ -99,28 +300,241 @@ class ShortAnswer(Question):
         return self.build_question()
 
     def grade_answer(self, answer: str) -> Tuple[float, str]:
-        self.setup_grader()
-
-        response = self.grader.prompt(answer)
+        # Answers that plainly match a sample answer (or are blank) don't need the LLM grader
+        local = local_grader.default_grader.grade(answer, self.correct_answer)
+        if local is not None:
+            return self.apply_grade(*local)
+        cached = self._cached_grade(answer)
+        if cached is not None:
+            return self.apply_grade(*cached)
+        return self._grade_with_llm(answer)
+
+    def _grade_with_llm(self, answer: str) -> Tuple[float, str]:
+        result = self._llm_grade(answer)
+        return self.apply_grade(*result) if result is not None else (0, "")
+
+    def _llm_grade(self, answer: str) -> Optional[Tuple[float, str]]:
+        """(grade, reason) from the LLM grader, leaving the weight alone; None if the response was unusable."""
+        if GRADER_MODE == "chat":
+            self.setup_grader()
+            return self._parse_grader_response(self.grader.prompt(answer), answer)
+
+        response = chatapi.single_prompt(self.grading_request(answer), model="gemini-2.0-flash", request_kind="grading")
+        return self._parse_grader_response(response, answer)
+
+    async def agrade_answer(self, answer: str) -> Tuple[float, str]:
+        local = local_grader.default_grader.grade(answer, self.correct_answer)
+        if local is not None:
+            return self.apply_grade(*local)
+        cached = self._cached_grade(answer)
+        if cached is not None:
+            return self.apply_grade(*cached)
+        return await self._agrade_with_llm(answer)
+
+    async def _agrade_with_llm(self, answer: str) -> Tuple[float, str]:
+        result = await self._allm_grade(answer)
+        return self.apply_grade(*result) if result is not None else (0, "")
+
+    async def _allm_grade(self, answer: str) -> Optional[Tuple[float, str]]:
+        if GRADER_MODE == "chat":
+            self.setup_grader()
+            return self._parse_grader_response(await self.grader.aprompt(answer), answer)
+
+        response = await chatapi.asingle_prompt(self.grading_request(answer), model="gemini-2.0-flash", request_kind="grading")
+        return self._parse_grader_response(response, answer)
+
+    def grading_request(self, answer: str) -> str:
+        """A self-contained grading request: nothing from other answers (or other users) is sent along."""
+        return f"{self.graderprompt}\n\nUser's answer: ```{answer}```"
+
+    def _cached_grade(self, answer: str) -> Optional[Tuple[float, str]]:
+        cache = grade_cache
+        if cache is None:
+            return None
+        try:
+            return cache.get(GradeCache.make_key(self.graderprompt, answer))
+        except sqlite3.Error as e:
+            print(f"GradeCache lookup failed, grading with the LLM: {e}")
+            return None
+
+    def _store_grade(self, answer: str, data: Dict[str, Any]):
+        cache = grade_cache
+        if cache is None:
+            return
+        try:
+            cache.put(GradeCache.make_key(self.graderprompt, answer), float(data["grade"]), str(data["reason"]))
+        except (sqlite3.Error, KeyError, TypeError, ValueError) as e:
+            print(f"GradeCache: could not store a grade: {e}")
+
+    def _parse_grader_response(self, response: str, answer: str = None) -> Optional[Tuple[float, str]]:
         match = re.search(r'\{.*\}', response, re.DOTALL)
         data = json.loads(match.group(0)) if match else None
 
         if isinstance(data, dict):
-            grade = data["grade"]
-            super().reduce_weight() if grade > 0.8 else super().increase_weight()
+            if answer is not None:
+                self._store_grade(answer, data)
             return data["grade"], data["reason"]
 
         print(f"ERROR grader response was not a valid json dict, '{response}'")
 
-        return 0, ""
+        return None
+
+
+# Answers packed into one batch grading request at most
+BATCH_GRADING_MAX_ITEMS = int(os.getenv("BATCH_GRADING_MAX_ITEMS", "20"))
+
+
+def _batch_grading_request(items: List[Tuple[ShortAnswer, str]]) -> str:
+    blocks = "\n\n".join(f"--- Answer {number} ---\n{question.grading_context()}\n\nUser's answer: ```{answer}```"
+                           for number, (question, answer) in enumerate(items, 1))
+    return f"""{GRADER_INSTRUCTIONS}
+
+You are grading {len(items)} answers to different questions at once. Grade each one on its own, as described above.
+This replaces the output format above: only return a valid JSON list with one object per answer, like this:
+[{{ "id": 1, "grade": 0.85, "reason": "..." }}, {{ "id": 2, "grade": 0.3, "reason": "..." }}]
+
+### ANSWERS ###
+{blocks}"""
+
+
+# Offline (LLM_BACKEND=fake) answers to the requests built above
+def _fake_grading_response(message: str) -> str:
+    prompt, answer = message.rsplit("User's answer: ```", 1)
+    return llm_backend.scripted_grade(prompt, answer.rsplit("```", 1)[0])
+
+
+def _fake_batch_grading_response(message: str) -> str:
+    results = []
+    for number, block in re.findall(r'--- Answer (\d+) ---\n(.*?)(?=\n--- Answer \d+ ---|\Z)', message, re.DOTALL):
+        results.append({"id": int(number), **json.loads(_fake_grading_response(block))})
+    return "Grades: " + json.dumps(results)
+
+
+llm_backend.register_fake_response("grading", _fake_grading_response)
+llm_backend.register_fake_response("batch_grading", _fake_batch_grading_response)
+
+
+def _parse_batch_grades(response: str, count: int) -> Dict[int, Dict[str, Any]]:
+    """Valid per-answer results by 0-based position; answers missing or malformed in the response are left out."""
+    match = re.search(r'\[.*\]', response, re.DOTALL)
+    try:
+        data = json.loads(match.group(0)) if match else []
+    except ValueError:
+        return {}
+    results = {}
+    for item in data if isinstance(data, list) else []:
+        try:
+            index = int(item["id"]) - 1
+            grade = float(item["grade"])
+            reason = str(item["reason"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < count and 0.0 <= grade <= 1.0:
+            results[index] = {"grade": grade, "reason": reason}
+    return results
+
+
+def _settle_locally(items: List[Tuple[ShortAnswer, str]]):
+    """Results from the local grader and grade cache, and the positions still needing the LLM."""
+    results: List[Optional[Tuple[float, str]]] = [None] * len(items)
+    pending: List[int] = []
+    for position, (question, answer) in enumerate(items):
+        known = local_grader.default_grader.grade(answer, question.correct_answer) or question._cached_grade(answer)
+        if known is not None:
+            results[position] = known
+        else:
+            pending.append(position)
+    return results, pending
+
+
+def _apply_batch(items, results, chunk: List[int], response: str) -> List[int]:
+    """Fills in the chunk's parsed results; returns the positions that need grading one by one."""
+    parsed = _parse_batch_grades(response, len(chunk))
+    fallback = []
+    for offset, position in enumerate(chunk):
+        data = parsed.get(offset)
+        if data is None:
+            fallback.append(position)
+            continue
+        question, answer = items[position]
+        question._store_grade(answer, data)
+        results[position] = (data["grade"], data["reason"])
+    return fallback
+
+
+def _graded_or_error(result: Optional[Tuple[float, str]]) -> Union[Tuple[float, str], Exception]:
+    return result if result is not None else ValueError("The grader's response could not be read")
+
+
+def grade_short_answers_batch(items: List[Tuple[ShortAnswer, str]]) -> List[Union[Tuple[float, str], Exception]]:
+    """
+    (grade, reason) for each (question, answer), in order, or the exception for an answer
+    that couldn't be graded. Answers the local grader or grade cache can't settle are packed
+    BATCH_GRADING_MAX_ITEMS to a request; any the response doesn't grade properly are then
+    graded one by one. Weights are left alone: apply each result with question.apply_grade().
+    """
+    results, pending = _settle_locally(items)
+    for start in range(0, len(pending), BATCH_GRADING_MAX_ITEMS):
+        chunk = pending[start:start + BATCH_GRADING_MAX_ITEMS]
+        try:
+            response = chatapi.single_prompt(_batch_grading_request([items[p] for p in chunk]), model="gemini-2.0-flash",
+                                             request_kind="batch_grading")
+        except Exception as e:
+            print(f"Batch grading request failed, grading {len(chunk)} answers one by one: {e}")
+            response = ""
+        for position in _apply_batch(items, results, chunk, response):
+            question, answer = items[position]
+            try:
+                results[position] = _graded_or_error(question._llm_grade(answer))
+            except Exception as e:
+                print(f"Grading failed for '{question.question[:60]}': {type(e).__name__} - {e}")
+                results[position] = e
+    return results
+
+
+async def agrade_short_answers_batch(items: List[Tuple[ShortAnswer, str]]) -> List[Union[Tuple[float, str], Exception]]:
+    """Async grade_short_answers_batch; the batch requests (and any fallbacks) run concurrently."""
+    results, pending = _settle_locally(items)
+
+    async def grade_chunk(chunk: List[int]):
+        try:
+            response = await chatapi.asingle_prompt(_batch_grading_request([items[p] for p in chunk]), model="gemini-2.0-flash",
+                                                    request_kind="batch_grading")
+        except Exception as e:
+            print(f"Batch grading request failed, grading {len(chunk)} answers one by one: {e}")
+            response = ""
+        fallback = _apply_batch(items, results, chunk, response)
+        graded = await asyncio.gather(*(items[p][0]._allm_grade(items[p][1]) for p in fallback), return_exceptions=True)
+        for position, result in zip(fallback, graded):
+            if isinstance(result, Exception):
+                print(f"Grading failed for '{items[position][0].question[:60]}': {type(result).__name__} - {result}")
+            results[position] = result if isinstance(result, Exception) else _graded_or_error(result)
+
+    await asyncio.gather(*(grade_chunk(pending[start:start + BATCH_GRADING_MAX_ITEMS])
+                           for start in range(0, len(pending), BATCH_GRADING_MAX_ITEMS)))
+    return results
+
+
+WRONG_FEEDBACK_KEYS = ("wrong", "right", "elaboration")
+# Added to a question's wrong_feedback_request when its options need particular wording
+TRUE_FALSE_FEEDBACK_NOTE = "This is a true/false question: refer to the answers as true and false, never by letter.\n"
 
 
 class MultipleChoice(Question):
-    def __init__(self, question: str, correct_answers: List[str], wrong_answers: List[str], explanation: str, weight=1.0):
+    def __init__(self, question: str, correct_answers: List[str], wrong_answers: List[str], explanation: str, weight=1.0,
+                 wrong_feedback: Optional[Dict[str, Dict[str, str]]] = None):
         super().__init__(question, explanation, weight)
         self.correct_answer = sorted(correct_answers)
         self.wrong_answers = sorted(wrong_answers)
         self.last_option_set: List[str] = []
+        # wrong option -> {"wrong", "right", "elaboration"}, generated ahead of time (see precompute_wrong_feedback).
+        # Only ever updated in place, so session copies see feedback added to the shared quiz.
+        self.wrong_feedback: Dict[str, Dict[str, str]] = dict(wrong_feedback or {})
+
+    def session_copy(self) -> "MultipleChoice":
+        clone = super().session_copy()
+        clone.last_option_set = []
+        return clone
 
     def build_parts(self, shuffle: bool = True, max_question_options=4):
         wrong_options_size = min(max_question_options-1, len(self.wrong_answers))
@@ -151,32 +565,110 @@ class MultipleChoice(Question):
             letter += 1
         return full_question
 
-    def grade_answer(self, choice: str) -> Tuple[float, str]:
+    def check_choice(self, choice: str) -> float:
+        """1.0 if choice (a letter of the last option set) is a correct option, else 0.0; the weight is left alone."""
         if len(choice) != 1:
             print(f"invalid input to grade_answer '{choice}'")
-            super().increase_weight()
-            return 0.0, ""
+            return 0.0
 
         index = ord(choice.upper()) - ord('A')
 
         if index < 0 or index >= len(self.last_option_set):
-            super().increase_weight()
-            return 0.0, ""
-
-        answer = self.last_option_set[index]
-        is_correct = answer in self.correct_answer
-        
-        if is_correct:
-            super().reduce_weight()
-            return 1.0, ""
-        else:
-            super().increase_weight()
-            return 0.0, ""
+            return 0.0
+
+        return 1.0 if self.last_option_set[index] in self.correct_answer else 0.0
+
+    def grade_answer(self, choice: str) -> Tuple[float, str]:
+        return self.apply_grade(self.check_choice(choice), "")
+
+    def option_set_token(self) -> str:
+        """Identifies the options as last shown, so an answer can be checked against the options it was given for."""
+        return hashlib.sha256("\n".join(self.last_option_set).encode("utf-8")).hexdigest()[:16]
+
+    _feedback_note = ""
+
+    def _option_label(self, option: str) -> str:
+        if option in self.last_option_set:
+            return f"{chr(ord('A') + self.last_option_set.index(option))}. {option}"
+        return option
+
+    def feedback_for(self, choice: str) -> Optional[List[str]]:
+        """The precomputed tutor messages for a wrong choice (a letter of the last option set), else None."""
+        if len(choice) != 1:
+            return None
+        index = ord(choice.upper()) - ord('A')
+        if index < 0 or index >= len(self.last_option_set):
+            return None
+        feedback = self.wrong_feedback.get(self.last_option_set[index])
+        if not feedback:
+            return None
+        shown_correct = next((opt for opt in self.last_option_set if opt in self.correct_answer), self.correct_answer[0])
+        return [
+            f"Correct answer: {self._option_label(shown_correct)}\n"
+            f"{self._option_label(self.last_option_set[index])} is wrong – {feedback['wrong']}\n"
+            f"{self._option_label(shown_correct)} is right – {feedback['right']}",
+            feedback["elaboration"],
+        ]
+
+    def missing_wrong_feedback(self) -> List[str]:
+        return [option for option in self.wrong_answers if option not in self.wrong_feedback]
+
+    def wrong_feedback_request(self, options: List[str] = None) -> str:
+        """One prompt asking for the feedback on each of options (default: those without feedback yet)."""
+        options = self.missing_wrong_feedback() if options is None else options
+        listed = "\n".join(f"{number}. {option}" for number, option in enumerate(options, 1))
+        return f"""You're a tutor writing feedback ahead of time for students who pick a wrong option on a quiz question.
+For each wrong option below write:
+- "wrong": one or two sentences on why that option is wrong, addressed to the student
+- "right": one or two sentences on why the correct answer is right
+- "elaboration": a short paragraph that helps the student remember the underlying idea
+{self._feedback_note}Only return a valid JSON object keyed by the wrong option's number, like this:
+{{"1": {{"wrong": "...", "right": "...", "elaboration": "..."}}, "2": {{"wrong": "...", "right": "...", "elaboration": "..."}}}}
+
+Question: {self.question}
+Correct answer: {" / ".join(self.correct_answer)}
+Explanation: {self.explanation}
+
+### WRONG OPTIONS ###
+{listed}"""
+
+    def apply_wrong_feedback_response(self, response: str, options: List[str] = None) -> int:
+        """Stores the valid entries of a wrong_feedback_request response; returns how many were stored."""
+        options = self.missing_wrong_feedback() if options is None else options
+        match = re.search(r'\{.*\}', response, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else {}
+        except ValueError:
+            data = {}
+        stored = 0
+        for key, entry in (data.items() if isinstance(data, dict) else []):
+            try:
+                number = int(key)
+            except ValueError:
+                continue
+            if not 1 <= number <= len(options) or not isinstance(entry, dict):
+                continue
+            if all(isinstance(entry.get(k), str) and entry[k].strip() for k in WRONG_FEEDBACK_KEYS):
+                self.wrong_feedback[options[number - 1]] = {k: entry[k].strip() for k in WRONG_FEEDBACK_KEYS}
+                stored += 1
+        return stored
+
+
+def _fake_wrong_feedback_response(message: str) -> str:
+    numbers = re.findall(r'^(\d+)\. ', message.split("### WRONG OPTIONS ###", 1)[1], re.MULTILINE)
+    return json.dumps({number: {"wrong": "That option doesn't fit the question.",
+                                "right": "The correct answer is what the source material describes.",
+                                "elaboration": "Review the explanation for the key idea behind this question."}
+                       for number in numbers})
+
+
+llm_backend.register_fake_response("wrong_feedback", _fake_wrong_feedback_response)
 
 
 class TrueFalseQuestion(MultipleChoice):
-    def __init__(self, question: str, correct_answers: List[str], wrong_answers: List[str], explanation: str, weight=1.0):
-        super().__init__(question, correct_answers, wrong_answers, explanation, weight)
+    def __init__(self, question: str, correct_answers: List[str], wrong_answers: List[str], explanation: str, weight=1.0,
+                 wrong_feedback: Optional[Dict[str, Dict[str, str]]] = None):
+        super().__init__(question, correct_answers, wrong_answers, explanation, weight, wrong_feedback)
 
     def build_parts(self, shuffle: bool = False, max_question_options=2):
         return super().build_parts(shuffle=shuffle, max_question_options=max_question_options)
@@ -187,6 +679,12 @@ class TrueFalseQuestion(MultipleChoice):
     def rebuild_question(self) -> str:
         return super().rebuild_question()
 
+    _feedback_note = TRUE_FALSE_FEEDBACK_NOTE
+
+    def _option_label(self, option: str) -> str:
+        # True/false feedback says "True" / "False", not the option letter
+        return option
+
 
 # Use average category question weights to weight each category. AKA category's with
 class QuestionBank:
@@ -198,7 +696,26 @@ class QuestionBank:
         return picked
 
 
+def check_grade_cache_lru(path: str) -> bool:
+    """The key read between every put must survive prune(), whether served from memory or SQLite."""
+    cache = GradeCache(path, max_entries=5)
+    cache.put("popular", 1.0, "right")
+    for i in range(99):
+        cache.put(f"other-{i}", 0.0, "wrong")
+        cache.get("popular")
+    cache.prune()
+    return GradeCache(path, max_entries=5, memory_entries=0).get("popular") is not None
+
+
 if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    if sys.argv[1:] == ["--check-cache"]:
+        with tempfile.TemporaryDirectory() as tmp:
+            ok = check_grade_cache_lru(os.path.join(tmp, "grades.sqlite3"))
+        print("grade cache LRU: " + ("ok" if ok else "FAILED, the most used key was pruned"))
+        sys.exit(0 if ok else 1)
 
     q_text = "What is the primary function of the mitochondria in a eukaryotic cell?"
     correct_ans_list = ["Cellular respiration", "ATP production", "Energy production"]
@@ -1,23 +1,45 @@
-from typing import List, TypedDict, Callable, Tuple
+from typing import List, TypedDict, Callable, Tuple, Dict, Any, Optional
 import random
 import re
 import json
-import pypdf
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import chatapi
+import dedup
+import pdf_extract
 import questionclass as qc
+import retrieval
 import tooled_llm as llm
+from weighted_sampler import QuizSampler
 
 print("quizclass.py")
 
+# Chunked generation never gives a chunk fewer questions than this
+MIN_QUESTIONS_PER_CHUNK = 3
+# The tutor's directions carry only this much of the source; the rest is looked up with get_source_material
+TUTOR_SOURCE_OVERVIEW_WORDS = 300
+# Tutor conversations beyond this many (estimated) tokens have their oldest turns summarized
+TUTOR_HISTORY_TOKEN_BUDGET = 6000
+
+
 class TutorLLM:
     def __init__(self, source_material: str,
                  additional_direction: str = "None",
                  model: str = "gemini-2.0-flash",
-                 session_message_queue_ref: [List[str]] = None):
+                 session_message_queue_ref: [List[str]] = None,
+                 saved_state: Dict[str, Any] = None,
+                 retrieval_top_k: int = 4,
+                 history_token_budget: Optional[int] = TUTOR_HISTORY_TOKEN_BUDGET):
         self.source_material = source_material
         self._session_message_queue_ref = session_message_queue_ref
+        self.retrieval_top_k = retrieval_top_k
+        retrieval.get_index(source_material)  # build (or reuse) the passage index before the first lookup
+        overview_words = source_material.split()
+        source_overview = " ".join(overview_words[:TUTOR_SOURCE_OVERVIEW_WORDS])
+        if len(overview_words) > TUTOR_SOURCE_OVERVIEW_WORDS:
+            source_overview += " ... (excerpt; use get_source_material to look up anything else)"
 
         tutor_tools: List[llm.Toolwrapper] = [
             llm.Toolwrapper("send_message", TutorLLM.send_message if session_message_queue_ref is None else self._send_message_to_user_session, """ # TutorLLM.send_message if session_message_queue_ref is None else self._send_message_to_user_session
@@ -28,18 +50,21 @@ class TutorLLM:
             """),
             llm.Toolwrapper("get_source_material", self.get_source_material, """
             Action name: "get_source_material"
-            Arguments: empty list
-            Purpose: Use to scan the source material for any information you need to look for.
-            Returns: a copy of the source material you were told to review at the beginning
+            Arguments: list of search terms or questions, e.g. ["first amendment freedoms"]
+            Purpose: Use to look up information in the source material. Search for the specific facts you need.
+            Returns: the passages of the source material most relevant to the search, with their page numbers
             """)
         ]
 
         self.Tutor: llm.ToolLLM = llm.ToolLLM(tool_objects=tutor_tools,
                                               model=model,
+                                              saved_state=saved_state,
+                                              history_token_budget=history_token_budget,
                                               directions=f"""
-            You are the Tutor. Review the source material below and get ready to assist students.
+            You are the Tutor. Review the start of the source material below and get ready to assist students.
+            Use the get_source_material action to look up details from the source material when you need them.
             ####################  KNOWLEDGE  ####################
-            {self.source_material}
+            {source_overview}
 
             ####################  HANDLING INCORRECT ANSWERS (Primary Task)  #########################
             # When the user provides an incorrect answer, the input will contain:
@@ -66,9 +91,9 @@ class TutorLLM:
             # << Engaging follow-up question (e.g., "Does that make sense?", "Want a tip to remember this?") >>
 
             ####################  HANDLING CORRECT ANSWERS (Context Update) #########################
-            # Sometimes, you'll receive a prompt starting with "Context: The student just answered...correctly."
-            # This is for your information. 
-            # *DO NOT* send a message to the user in response to this context update unless explicitly asked to in the context message.
+            # Prompts may start with lines like "Context: The student answered correctly. ..." listing questions answered since your last turn.
+            # These are for your information. 
+            # *DO NOT* send a message to the user in response to these context updates; respond only to the rest of the prompt.
             # Simply update your understanding of the student's progress and be ready for their next question.
 
             ####################  GENERAL FOLLOW-UP QUERIES & CONVERSATION #########################
@@ -134,12 +159,31 @@ class TutorLLM:
         return False, "Message(s) successfully queued for user."
 
     def get_source_material(self, arg: List[str]) -> Tuple[bool, str]:
-        return True, self.source_material
+        query = " ".join(str(item) for item in arg).strip()
+        if not query:
+            return True, "error: pass what to look for, e.g. [\"first amendment freedoms\"]"
+        results = retrieval.get_index(self.source_material).search(query, self.retrieval_top_k)
+        if not results:
+            return True, f"No passages in the source material match '{query}'. Try other search terms."
+        return True, retrieval.format_passages(results)
+
+    def add_context_note(self, note: str):
+        """Context the tutor should know but needn't answer; sent along with the next prompt."""
+        self.Tutor.add_unimportant_message(note)
 
     def prompt(self, message: str):
         # Call the ToolLLM's prompt method
         self.Tutor.prompt(message)
 
+    async def aprompt(self, message: str):
+        await self.Tutor.aprompt(message)
+
+    def export_state(self) -> Dict[str, Any]:
+        return self.Tutor.export_state()
+
+    def close(self):
+        self.Tutor.close()
+
 
 class Quiz:
     """
@@ -194,17 +238,21 @@ class Quiz:
                 elif q_type == 'MultipleChoice':
                     correct_answers = q_data.get('correct_answers', [])
                     wrong_answers = q_data.get('wrong_answers', [])
-                    q = qc.MultipleChoice(question, correct_answers, wrong_answers, explanation, weight)
+                    q = qc.MultipleChoice(question, correct_answers, wrong_answers, explanation, weight,
+                                          q_data.get('wrong_feedback'))
                     section.questions.append(q)
 
                 elif q_type == 'TrueFalseQuestion':
                     correct_answers = q_data.get('correct_answers', [])
                     wrong_answers = q_data.get('wrong_answers', [])
-                    q = qc.TrueFalseQuestion(question, correct_answers, wrong_answers, explanation, weight)
+                    q = qc.TrueFalseQuestion(question, correct_answers, wrong_answers, explanation, weight,
+                                             q_data.get('wrong_feedback'))
                     section.questions.append(q)
 
             quiz.section_bank.append(section)
 
+        # __init__ counted the still-empty section bank
+        quiz.size = sum(len(section.questions) for section in quiz.section_bank)
         return quiz
 
     def to_dict(self):
@@ -217,13 +265,14 @@ class Quiz:
             'sections': []
         }
 
-        for section in self.section_bank:
+        for i, section in enumerate(self.section_bank):
             section_data = {
                 'name': section.name,
                 'questions': []
             }
 
-            for question in section.questions:
+            for j in range(len(section.questions)):
+                question = self._question_state(i, j)
                 q_data = {
                     'question': question.question,
                     'explanation': question.explanation,
@@ -239,11 +288,13 @@ class Quiz:
                     q_data['type'] = 'TrueFalseQuestion'
                     q_data['correct_answers'] = question.correct_answer
                     q_data['wrong_answers'] = question.wrong_answers
+                    q_data['wrong_feedback'] = dict(question.wrong_feedback)
 
                 elif isinstance(question, qc.MultipleChoice):
                     q_data['type'] = 'MultipleChoice'
                     q_data['correct_answers'] = question.correct_answer
                     q_data['wrong_answers'] = question.wrong_answers
+                    q_data['wrong_feedback'] = dict(question.wrong_feedback)
 
                 section_data['questions'].append(q_data)
 
@@ -258,6 +309,7 @@ class Quiz:
         self.print_debug = print_debug
         self.model = model
         self.Tutor: TutorLLM = None
+        self._sampler: QuizSampler = None
         self.size = None
         self.size = self.get_total_question_count()
 
@@ -270,6 +322,13 @@ class Quiz:
             count += len(section.questions)
         return count
 
+    def _get_sampler(self) -> QuizSampler:
+        """Builds the sampler on first use and again whenever sections/questions are added or removed."""
+        shape = tuple(len(section.questions) for section in self.section_bank)
+        if self._sampler is None or self._sampler.shape != shape:
+            self._sampler = QuizSampler([section.questions for section in self.section_bank], qc.ShortAnswer)
+        return self._sampler
+
     # usage
     def pick_question(self, is_first_question: bool = False) -> Tuple[int, int]:
         """
@@ -277,7 +336,12 @@ class Quiz:
         (category_index, question_index) so the caller can fetch it later
         with `get_question`.
 
-        If is_first_question is True, it will try to avoid picking a ShortAnswer question.
+        A section is picked weighted by the average weight of its questions, then a
+        question inside it weighted by its own weight. Both draws run on a QuizSampler
+        that is kept up to date as weights change, so a pick is O(log n).
+
+        If is_first_question is True, it picks uniformly among the non-ShortAnswer
+        questions (falling back to the weighted pick if there are none).
 
         Example
         -------
@@ -291,163 +355,153 @@ class Quiz:
         """
         if not self.section_bank:
             raise ValueError("Quiz has no sections")
-        if not any(len(section) > 0 for section in self.section_bank):
+        sampler = self._get_sampler()
+        if not any(sampler.shape):
             raise ValueError("Quiz has no questions in any section")
 
-        eligible_questions_with_indices = []
-        for i, section in enumerate(self.section_bank):
-            for j, question in enumerate(section.questions):
-                if is_first_question:
-                    if not isinstance(question, qc.ShortAnswer):
-                        eligible_questions_with_indices.append(((i, j), question))
-                else:
-                    eligible_questions_with_indices.append(((i, j), question))
-        
-        # Fallback if only ShortAnswer questions exist or no non-ShortAnswer questions were found for the first question
-        if is_first_question and not any(not isinstance(q_tuple[1], qc.ShortAnswer) for q_tuple in eligible_questions_with_indices):
-            print("Warning: First question preference for non-ShortAnswer could not be met. Picking any question.")
-            eligible_questions_with_indices = [] # Reset to consider all questions
-            for i, section in enumerate(self.section_bank):
-                for j, question in enumerate(section.questions):
-                    eligible_questions_with_indices.append(((i, j), question))
-
-        if not eligible_questions_with_indices:
-             # This should ideally not be reached if the initial checks pass and fallback works
-            raise ValueError("No eligible questions found to pick from.")
-
-        # Create a flat list of (category_idx, question_idx) tuples and corresponding weights
-        # for the eligible questions.
-        
-        # We need to re-think the weighting if we filter.
-        # For simplicity now, if filtering, we'll pick uniformly from the filtered list.
-        # A more sophisticated approach would re-distribute weights.
-
-        if is_first_question and any(not isinstance(q_tuple[1], qc.ShortAnswer) for q_tuple in eligible_questions_with_indices):
-             # Filter again to be sure we are only picking from non-short answer if available
-            non_short_answer_questions = [
-                item for item in eligible_questions_with_indices if not isinstance(item[1], qc.ShortAnswer)
-            ]
-            if non_short_answer_questions: # If there are non-short-answer questions, pick from them
-                # Uniform random choice among non-short-answer questions for the first question
-                chosen_item_indices, _ = random.choice(non_short_answer_questions)
-                return chosen_item_indices # (cat_idx, q_idx)
-            # If, after filtering, no non-short-answer questions remain (shouldn't happen if logic is right),
-            # fall through to original weighted logic below. This is a safeguard.
-
-
-        # Original weighted picking logic (applied if not first question or if fallback needed)
-        # This part needs to map flat indices back to sections or pick section first then question.
-        # Let's stick to the original two-step weighted picking if not is_first_question or if no non-SA found.
-        
-        # 1) pick a category, weighted by its average question weight
-        category_weights = [self._average_section_weight(cat, is_first_question) for cat in self.section_bank]
-        
-        valid_sections_indices = [i for i, weight in enumerate(category_weights) if weight > 0]
-        if not valid_sections_indices:
-             # This case implies that if is_first_question is true, all sections might only contain short answers
-             # or are empty.
-            if is_first_question: # Attempt to pick any question if the preferred type isn't available
-                print("Warning: Could not find non-ShortAnswer questions in any section for the first question. Picking any question.")
-                return self.pick_question(is_first_question=False) # Fallback to pick any type
-            raise ValueError("No valid sections with eligible questions found.")
-
-
-        valid_weights = [category_weights[i] for i in valid_sections_indices]
-        
-        chosen_cat_idx = random.choices(
-            population=valid_sections_indices,
-            weights=valid_weights,
-            k=1
-        )[0]
-
-        # 2) pick a question inside that category, weighted by its own weight
-        questions_in_chosen_cat = self.section_bank[chosen_cat_idx]
-        
-        eligible_q_in_cat_with_original_idx = []
-        for original_q_idx, q_obj in enumerate(questions_in_chosen_cat.questions):
-            if is_first_question:
-                if not isinstance(q_obj, qc.ShortAnswer):
-                    eligible_q_in_cat_with_original_idx.append((q_obj, original_q_idx))
-            else:
-                eligible_q_in_cat_with_original_idx.append((q_obj, original_q_idx))
-
-        if not eligible_q_in_cat_with_original_idx:
-            # This means the chosen category only has short answer questions, and it's the first question.
-            # We should have been caught by the valid_sections_indices check or the initial attempt.
-            # As a robust fallback, pick any question from the quiz without the first_question constraint.
-            print(f"Warning: Section {chosen_cat_idx} has no non-ShortAnswer questions for the first question. Picking any type of question.")
-            return self.pick_question(is_first_question=False)
-
-
-        question_objects = [item[0] for item in eligible_q_in_cat_with_original_idx]
-        original_indices = [item[1] for item in eligible_q_in_cat_with_original_idx]
-        
-        question_weights = [q.weight for q in question_objects]
-        
-        # random.choices returns a list, so take the first element
-        chosen_q_local_idx_in_eligible = random.choices(
-            population=range(len(question_objects)),
-            weights=question_weights,
-            k=1
-        )[0]
-        
-        # Map back to original index in the section
-        final_q_idx_in_section = original_indices[chosen_q_local_idx_in_eligible]
-
-        return chosen_cat_idx, final_q_idx_in_section
-
-    def _average_section_weight(self, section: Section, is_first_question: bool) -> float:
-        questions_to_consider = []
-        if is_first_question:
-            for q in section.questions:
-                if not isinstance(q, qc.ShortAnswer):
-                    questions_to_consider.append(q)
-            if not questions_to_consider: # If section only has short answers (or is empty)
-                return 0.0 # This section won't be picked if we need non-short answer
-        else:
-            questions_to_consider = section.questions
-
-        if not questions_to_consider:
-            return 0.0
-        
-        current_sum = sum(q.weight for q in questions_to_consider)
-        return current_sum / len(questions_to_consider)
+        return sampler.pick(is_first_question)
 
     def get_question(self, cat_idx, q_idx) -> qc.Question:
         self.section_bank[cat_idx][q_idx].quiz_size = self.size
         return self.section_bank[cat_idx][q_idx]
 
-    def get_tutor(self, session_message_queue_ref=None):
+    def _question_state(self, cat_idx, q_idx) -> qc.Question:
+        """The question object holding this quiz's current weight (see SessionQuiz)."""
+        return self.section_bank[cat_idx][q_idx]
+
+    def create_session_view(self) -> "SessionQuiz":
+        """Cheap per-session copy of this quiz; use instead of copy.deepcopy for shared quizzes."""
+        return SessionQuiz(self)
+
+    def release(self):
+        """Close the tutor and grader chats this quiz holds (called when its session is evicted)."""
+        if self.Tutor is not None:
+            self.Tutor.close()
+            self.Tutor = None
+        for section in self.section_bank:
+            for question in section.questions:
+                if isinstance(question, qc.ShortAnswer):
+                    question.release_grader()
+
+    def get_tutor(self, session_message_queue_ref=None, saved_state: Dict[str, Any] = None):
         if self.Tutor is None:
             self.Tutor = TutorLLM(
                 source_material=self.source_material,
                 model=self.model,
-                session_message_queue_ref=session_message_queue_ref
+                session_message_queue_ref=session_message_queue_ref,
+                saved_state=saved_state
             )
         return self.Tutor
 
-def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz", quiz_size: int = None, print_debug: bool = False, model="gemini-2.0-flash"):
+    @staticmethod
+    def _question_progress(cat_idx, q_idx, question: qc.Question) -> list:
+        options = question.last_option_set if isinstance(question, qc.MultipleChoice) else None
+        return [cat_idx, q_idx, question.weight, list(options) if options else None]
+
+    def export_progress(self) -> Dict[str, Any]:
+        """JSON-safe per-question state (weight, options last shown) for the shared session backend."""
+        return {"questions": [self._question_progress(i, j, question)
+                              for i, section in enumerate(self.section_bank)
+                              for j, question in enumerate(section.questions)]}
+
+    def apply_progress(self, progress: Dict[str, Any]):
+        for cat_idx, q_idx, weight, options in progress.get("questions", []):
+            if cat_idx >= len(self.section_bank) or q_idx >= len(self.section_bank[cat_idx]):
+                continue  # quiz file changed since the progress was saved
+            question = self.get_question(cat_idx, q_idx)
+            question.weight = weight
+            if options and isinstance(question, qc.MultipleChoice):
+                question.last_option_set = list(options)
+
+class SessionQuiz(Quiz):
     """
-    Generates a quiz using AI based on the provided source material.
+    Copy-on-write view of a shared Quiz for one session.
 
-    Args:
-        source_material: The text content to generate questions from
-        quiz_title: The desired title for the generated quiz.
-        quiz_size: The target number of questions to generate
-        print_debug: Whether to print debug information
-        model: The AI model to use for generation
+    Sections, question text and source_material stay shared with the base quiz and must
+    not be modified through the view. A question is shallow-copied into the overlay the
+    first time the session fetches it, so the copy can carry its own weight, option order
+    and grader. The sampler is cloned from the base quiz's on first pick.
     """
-    section_bank: List[Quiz.Section] = []
+    def __init__(self, base: Quiz):
+        self.base = base
+        self.section_bank = base.section_bank
+        self.source_material = base.source_material
+        self.title = base.title
+        self.print_debug = base.print_debug
+        self.model = base.model
+        self.Tutor: TutorLLM = None
+        self._sampler: QuizSampler = None
+        self.size = base.get_total_question_count()
+        self.overlay: Dict[Tuple[int, int], qc.Question] = {}
 
-    def suggested_quiz_size(source: str, k: float = 0.35, q_min: int = 6, q_max: int = 30) -> int:
-        """
-        • Let n = number of *words* in the source.
-        • Use √n so growth is sub-linear.
-        • Scale by k, clamp to [q_min, q_max].
-        """
-        n_words = len(source.split())
-        size = int(k * math.sqrt(n_words))
-        return max(q_min, min(size, q_max))
+    def _get_sampler(self) -> QuizSampler:
+        if self._sampler is None:
+            self._sampler = self.base._get_sampler().clone()
+        return self._sampler
+
+    def get_question(self, cat_idx, q_idx) -> qc.Question:
+        key = (cat_idx, q_idx)
+        question = self.overlay.get(key)
+        if question is None:
+            question = self.section_bank[cat_idx][q_idx].session_copy()
+            question._weight_listener = self._get_sampler()
+            question._sampler_pos = key
+            self.overlay[key] = question
+        question.quiz_size = self.size
+        return question
+
+    def _question_state(self, cat_idx, q_idx) -> qc.Question:
+        return self.overlay.get((cat_idx, q_idx)) or self.section_bank[cat_idx][q_idx]
+
+    def export_progress(self) -> Dict[str, Any]:
+        # Questions outside the overlay still have the base quiz's state
+        return {"questions": [self._question_progress(i, j, question) for (i, j), question in self.overlay.items()]}
+
+    def create_session_view(self) -> "SessionQuiz":
+        return SessionQuiz(self.base)
+
+    def release(self):
+        # Only the overlay belongs to this session; the base quiz's questions are shared
+        if self.Tutor is not None:
+            self.Tutor.close()
+            self.Tutor = None
+        for question in self.overlay.values():
+            if isinstance(question, qc.ShortAnswer):
+                question.release_grader()
+
+
+def suggested_quiz_size(source: str, k: float = 0.35, q_min: int = 6, q_max: int = 30) -> int:
+    """
+    • Let n = number of *words* in the source.
+    • Use √n so growth is sub-linear.
+    • Scale by k, clamp to [q_min, q_max].
+    """
+    n_words = len(source.split())
+    size = int(k * math.sqrt(n_words))
+    return max(q_min, min(size, q_max))
+
+
+def _make_quiz_build_tools(section_bank: List[Quiz.Section], on_change: Callable[[str], None] = None,
+                           print_debug: bool = False, dedup_index: dedup.DuplicateIndex = None) -> List[llm.Toolwrapper]:
+    """
+    The build_* tools a quiz-writer ToolLLM uses to fill section_bank. on_change(stage) runs after
+    each addition or rejection. Questions that near-duplicate one already in dedup_index are
+    refused, and the tool result tells the model why.
+    """
+    def _changed(stage: str):
+        if on_change is not None:
+            on_change(stage)
+
+    def _reject_duplicate(question_text: str) -> Optional[str]:
+        if dedup_index is None:
+            return None
+        duplicate = dedup_index.check_and_add(question_text)
+        if duplicate is None:
+            return None
+        if print_debug: print(f"rejected near-duplicate question '{question_text}'")
+        _changed("question_rejected")
+        return (f"Rejected: '{question_text}' is a near-duplicate of the existing question '{duplicate[0]}' "
+                f"(similarity {duplicate[1]:.2f}). It was NOT added; write a question about a different fact instead.")
 
     def _get_section(idx: int) -> Quiz.Section:
         if idx < 0 or idx >= len(section_bank):
@@ -462,6 +516,7 @@ def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz"
             section_bank.append(Quiz.Section(title))
             idx = len(section_bank) - 1
             if print_debug: print(f", '{title}'")
+            _changed("section_created")
             return True, f"Section #{idx} '{title}' created"
         except Exception as e:
             if print_debug: print()
@@ -498,7 +553,12 @@ def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz"
             explanation = arg[4]
 
             q = qc.MultipleChoice(question_text, correct, wrong, explanation)
-            _get_section(sec_idx).questions.append(q)
+            section = _get_section(sec_idx)
+            rejection = _reject_duplicate(question_text)
+            if rejection:
+                return True, rejection
+            section.questions.append(q)
+            _changed("question_created")
             return True, f"question #{len(_get_section(sec_idx).questions)}, '{question_text}', was added to section {sec_idx}"
         except Exception as e:
             return True, f"Error in build_mcq({arg}) -> '{e}'"
@@ -528,7 +588,12 @@ def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz"
             explanation = arg[4]
 
             q = qc.TrueFalseQuestion(question_text, correct_answer, wrong_answer, explanation)
-            _get_section(sec_idx).questions.append(q)
+            section = _get_section(sec_idx)
+            rejection = _reject_duplicate(question_text)
+            if rejection:
+                return True, rejection
+            section.questions.append(q)
+            _changed("question_created")
             return True, f"question #{len(_get_section(sec_idx).questions)}, '{question_text}', was added to section {sec_idx}"
         except Exception as e:
             return True, f"Error in build_tfq({arg}) -> '{e}'"
@@ -554,14 +619,16 @@ def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz"
             grading = arg[4] if len(arg) > 4 else "Be detailed and accurate."
 
             q = qc.ShortAnswer(question_text, correct, explanation, grading)
-            _get_section(sec_idx).questions.append(q)
+            section = _get_section(sec_idx)
+            rejection = _reject_duplicate(question_text)
+            if rejection:
+                return True, rejection
+            section.questions.append(q)
+            _changed("question_created")
             return True, f"question #{len(_get_section(sec_idx).questions)}, '{question_text}', was added to section {sec_idx}"
         except Exception as e:
             return True, f"Error in build_frq({arg}) -> '{e}'"
 
-    if quiz_size is None:
-        quiz_size = suggested_quiz_size(source_material)
-
     # ---------- TOOL WRAPPERS ----------
     quiz_build_tools: List[llm.Toolwrapper] = [
         # ---- build_section ----
@@ -633,12 +700,12 @@ def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz"
         ),
     ]
 
-    # ---------- LLM WITH TOOLS ----------
-    smart_quiz_builder = llm.ToolLLM(
-        tool_objects=quiz_build_tools,
-        model=model,
-        directions=f"""
-        You are an expert quiz-writer.
+    return quiz_build_tools
+
+
+def _quiz_builder_directions(quiz_size: int, excerpt_note: str = "") -> str:
+    return f"""
+        You are an expert quiz-writer.{excerpt_note}
 
         **Workflow**  
         1. Create a section using *build_section* (e.g. "Basics", "Advanced", "Multiplication", "Road Signs").
@@ -681,7 +748,17 @@ def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz"
                    "(Movement of water across a semipermeable membrane from low solute concentration to high solute concentration)",
                    "Osmosis is passive diffusion of water.",
                    "Must mention water movement, semipermeable membrane, and concentration gradient."]
-                    """.strip(),
+                    """.strip()
+
+
+def _build_quiz_sections(section_bank: List[Quiz.Section], source_material: str, quiz_size: int, model: str,
+                         on_change: Callable[[str], None] = None, print_debug: bool = False, excerpt_note: str = "",
+                         dedup_index: dedup.DuplicateIndex = None):
+    """Runs one quiz-writer conversation over source_material, appending what it builds to section_bank."""
+    llm.ToolLLM(
+        tool_objects=_make_quiz_build_tools(section_bank, on_change, print_debug, dedup_index),
+        model=model,
+        directions=_quiz_builder_directions(quiz_size, excerpt_note),
         action_prompt=f"""
         Build the quiz based on the source material below.
         ### SOURCE MATERIAL ###
@@ -689,17 +766,161 @@ def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz"
         """.strip()
     )
 
-    return Quiz(section_bank, source_material, title=quiz_title, print_debug=print_debug, model=model)
+
+def split_source_chunks(source_material: str, chunk_words: int) -> List[str]:
+    """Groups consecutive '-- Page N --' pages (see openpdf) into chunks of roughly chunk_words words."""
+    pages = [page for page in re.split(r"(?=--\s*Page\s*\d+\s*--)", source_material) if page.strip()]
+    chunks: List[str] = []
+    current: List[str] = []
+    current_words = 0
+    for page in pages:
+        current.append(page)
+        current_words += len(page.split())
+        if current_words >= chunk_words:
+            chunks.append("".join(current))
+            current, current_words = [], 0
+    if current:
+        if chunks and current_words < chunk_words // 3:
+            chunks[-1] += "".join(current)  # don't leave a scrap of a chunk on its own
+        else:
+            chunks.append("".join(current))
+    return chunks
+
+
+def _allocate_questions(chunks: List[str], quiz_size: int) -> List[int]:
+    """Splits quiz_size across chunks in proportion to their word counts (largest remainder, at least 1 each)."""
+    words = [max(1, len(chunk.split())) for chunk in chunks]
+    total_words = sum(words)
+    shares = [quiz_size * w / total_words for w in words]
+    targets = [max(1, int(share)) for share in shares]
+    by_remainder = sorted(range(len(chunks)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:max(0, quiz_size - sum(targets))]:
+        targets[i] += 1
+    return targets
+
+
+def _merge_sections(banks: List[List[Quiz.Section]]) -> List[Quiz.Section]:
+    """Joins per-chunk section banks, combining sections that share a name (case-insensitive)."""
+    merged: Dict[str, Quiz.Section] = {}
+    for bank in banks:
+        for section in bank:
+            if not section.questions:
+                continue
+            key = " ".join(section.name.split()).casefold()
+            if key in merged:
+                merged[key].questions.extend(section.questions)
+            else:
+                merged[key] = section
+    return list(merged.values())
 
 
-def openpdf(pdf_file_path) -> str:
-    doc = pypdf.PdfReader(pdf_file_path)
-    extracted_text = ""
-    for page_num in range(len(doc.pages)):
-        page = doc.pages[page_num].extract_text().replace('\n', ' ')
-        extracted_text += f"-- Page {page_num + 1} --\n{page}\n"
-    doc.close()
-    return extracted_text
+def generate_ai_quiz(source_material: str, quiz_title: str = "AI Generated Quiz", quiz_size: int = None, print_debug: bool = False, model="gemini-2.0-flash",
+                     progress_callback: Callable[..., None] = None, chunk_words: int = None, max_workers: int = 4,
+                     dedup_threshold: Optional[float] = 0.7):
+    """
+    Generates a quiz using AI based on the provided source material.
+
+    Args:
+        source_material: The text content to generate questions from
+        quiz_title: The desired title for the generated quiz.
+        quiz_size: The target number of questions to generate
+        print_debug: Whether to print debug information
+        model: The AI model to use for generation
+        progress_callback: called as progress_callback(stage, sections=, questions=, target_questions=)
+            when generation starts and after every section/question the model builds
+        chunk_words: if set, the source is split into page-aligned chunks of about this many words,
+            each chunk gets its own quiz-writer conversation (at most max_workers at a time), and
+            the resulting sections are merged by name. None uses a single conversation.
+        dedup_threshold: questions at least this similar (shingle Jaccard) to an accepted question
+            are rejected at build time, across all chunks. None disables the check.
+    """
+    if quiz_size is None:
+        quiz_size = suggested_quiz_size(source_material)
+
+    chunks = [source_material]
+    if chunk_words:
+        # Keep at least MIN_QUESTIONS_PER_CHUNK questions per chunk so every conversation is worth its overhead
+        max_chunks = max(1, quiz_size // MIN_QUESTIONS_PER_CHUNK)
+        chunk_words = max(chunk_words, math.ceil(len(source_material.split()) / max_chunks))
+        chunks = split_source_chunks(source_material, chunk_words) or [source_material]
+
+    banks: List[List[Quiz.Section]] = [[] for _ in chunks]
+    dedup_index = dedup.DuplicateIndex(dedup_threshold) if dedup_threshold is not None else None
+    progress_lock = threading.Lock()
+
+    def _report_progress(stage: str):
+        if progress_callback is None:
+            return
+        try:
+            with progress_lock:
+                progress_callback(stage, sections=sum(len(bank) for bank in banks),
+                                  questions=sum(len(s.questions) for bank in banks for s in bank),
+                                  target_questions=quiz_size,
+                                  rejected_duplicates=dedup_index.rejected if dedup_index is not None else 0)
+        except Exception as e:
+            print(f"generate_ai_quiz: progress callback failed: {e}")
+
+    _report_progress("generating_questions")
+
+    if len(chunks) == 1:
+        _build_quiz_sections(banks[0], source_material, quiz_size, model, _report_progress, print_debug,
+                             dedup_index=dedup_index)
+        return Quiz(banks[0], source_material, title=quiz_title, print_debug=print_debug, model=model)
+
+    targets = _allocate_questions(chunks, quiz_size)
+    if print_debug: print(f"generate_ai_quiz: {len(chunks)} chunks, question targets {targets}")
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))), thread_name_prefix="quiz-chunk") as pool:
+        futures = []
+        for i, (chunk, target) in enumerate(zip(chunks, targets)):
+            excerpt_note = (f"\n        You are writing the questions for excerpt {i + 1} of {len(chunks)} of a longer document; "
+                            f"other writers cover the other excerpts. Use short topic names for sections.")
+            futures.append(pool.submit(_build_quiz_sections, banks[i], chunk, target, model,
+                                       _report_progress, print_debug, excerpt_note, dedup_index))
+        for i, future in enumerate(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"generate_ai_quiz: chunk {i + 1}/{len(chunks)} failed: {type(e).__name__} - {e}")
+                errors.append(e)
+
+    if len(errors) == len(chunks):
+        raise errors[0]
+    return Quiz(_merge_sections(banks), source_material, title=quiz_title, print_debug=print_debug, model=model)
+
+
+def precompute_wrong_feedback(quiz: Quiz, max_workers: int = 4, model: str = "gemini-2.0-flash") -> int:
+    """
+    Fills in the 'wrong - right - elaboration' feedback for every wrong option of the quiz's
+    multiple choice and true/false questions, one single-shot request per question (at most
+    max_workers at a time), so /api/submit can show it without a tutor round-trip. Questions
+    that already have it are skipped and failed requests are left for the live tutor.
+    Returns how many options got feedback.
+    """
+    pending = [q for section in quiz.section_bank for q in section.questions
+               if isinstance(q, qc.MultipleChoice) and q.missing_wrong_feedback()]
+    if not pending:
+        return 0
+
+    def _fill(question: qc.MultipleChoice) -> int:
+        options = question.missing_wrong_feedback()
+        response = chatapi.single_prompt(question.wrong_feedback_request(options), model=model, request_kind="wrong_feedback")
+        return question.apply_wrong_feedback_response(response, options)
+
+    stored = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending))), thread_name_prefix="wrong-feedback") as pool:
+        for question, future in [(q, pool.submit(_fill, q)) for q in pending]:
+            try:
+                stored += future.result()
+            except Exception as e:
+                print(f"precompute_wrong_feedback: skipped '{question.question[:60]}': {type(e).__name__} - {e}")
+    return stored
+
+
+def openpdf(pdf_file_path, max_pages: int = None, time_budget: float = None) -> str:
+    """Text of the PDF as '-- Page N --' blocks; long documents are extracted in parallel (see pdf_extract)."""
+    text, _ = pdf_extract.extract_pdf_text(pdf_file_path, max_pages=max_pages, time_budget=time_budget)
+    return text
 
 def print_quiz(quiz: Quiz):
     for section in quiz.section_bank:
@@ -0,0 +1,117 @@
+from typing import Dict, List, Optional, Tuple
+from collections import Counter, OrderedDict
+import hashlib
+import math
+import os
+import re
+import threading
+
+print("retrieval.py")
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_PAGE_RE = re.compile(r"--\s*Page\s*(\d+)\s*--")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have he her his i if in into is it its of on or she
+so than that the their them then there these they this to was were what when where which who will
+with would you your do does did not no can could should may might
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords; plural 's' is stripped so 'amendments' finds 'amendment'."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def split_passages(source: str, chunk_words: int = 150, overlap_words: int = 30) -> List[Tuple[Optional[int], str]]:
+    """(page number or None, passage) windows of about chunk_words words, overlapping by overlap_words."""
+    pages: List[Tuple[Optional[int], str]] = []
+    parts = _PAGE_RE.split(source)
+    if parts[0].strip():
+        pages.append((None, parts[0]))
+    for i in range(1, len(parts) - 1, 2):
+        pages.append((int(parts[i]), parts[i + 1]))
+
+    step = max(1, chunk_words - overlap_words)
+    passages = []
+    for page, text in pages:
+        words = text.split()
+        for start in range(0, len(words), step):
+            passages.append((page, " ".join(words[start:start + chunk_words])))
+            if start + chunk_words >= len(words):
+                break
+    return passages
+
+
+class BM25Index:
+    """
+    Okapi BM25 over fixed-size passages of a document. Built once per document, entirely
+    in memory and offline; search() only touches the postings of the query's terms.
+    """
+    def __init__(self, source: str, chunk_words: int = 150, overlap_words: int = 30, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.passages = split_passages(source, chunk_words, overlap_words)
+        self._lengths: List[int] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        for idx, (_, text) in enumerate(self.passages):
+            counts = Counter(tokenize(text))
+            self._lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((idx, tf))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        n = len(self.passages)
+        self._idf = {term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                     for term, postings in self._postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[float, Optional[int], str]]:
+        """Top k (score, page, passage) for query, best first; passages sharing no term are left out."""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for idx, tf in self._postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[idx] / self._avg_length)
+                scores[idx] = scores.get(idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(score, self.passages[idx][0], self.passages[idx][1]) for idx, score in best]
+
+
+def format_passages(results: List[Tuple[float, Optional[int], str]]) -> str:
+    return "\n\n".join(f"[Page {page}] {text}" if page is not None else text for _, page, text in results)
+
+
+_index_cache: "OrderedDict[str, BM25Index]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "32"))
+
+
+def get_index(source: str) -> BM25Index:
+    """
+    The BM25Index for source, shared by every caller with the same text (e.g. all sessions
+    of a premade quiz). The RETRIEVAL_INDEX_CACHE_SIZE most recently used indexes are kept.
+    """
+    key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = BM25Index(source)  # built outside the lock; a concurrent duplicate build is harmless
+    with _index_cache_lock:
+        _index_cache[key] = index
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
@@ -0,0 +1,147 @@
+from typing import Dict, Optional, Tuple
+from pathlib import Path
+import os
+import sqlite3
+import threading
+import time
+
+print("session_backend.py")
+
+
+class SessionStateBackend:
+    """
+    Shared home for serialized session state (a JSON string per session) so any worker
+    process can pick up a session. Every save bumps the session's version; a worker whose
+    in-memory copy has an older version rehydrates from the stored state.
+    """
+    name = "base"
+
+    def get_version(self, session_id: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def load(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """(version, state_json), or None if the session was never saved."""
+        raise NotImplementedError
+
+    def save(self, session_id: str, state_json: str) -> int:
+        """Store state_json and return the new version."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def purge_idle(self, max_idle_seconds: float) -> int:
+        """Drop sessions not saved for max_idle_seconds; returns how many were removed."""
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionStateBackend):
+    """In-process backend. Only shares state within one worker; for tests and local runs."""
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: Dict[str, Tuple[int, str, float]] = {}
+
+    def get_version(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._rows.get(session_id)
+            return row[0] if row else None
+
+    def load(self, session_id: str) -> Optional[Tuple[int, str]]:
+        with self._lock:
+            row = self._rows.get(session_id)
+            return (row[0], row[1]) if row else None
+
+    def save(self, session_id: str, state_json: str) -> int:
+        with self._lock:
+            version = self._rows[session_id][0] + 1 if session_id in self._rows else 1
+            self._rows[session_id] = (version, state_json, time.time())
+            return version
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._rows.pop(session_id, None)
+
+    def purge_idle(self, max_idle_seconds: float) -> int:
+        cutoff = time.time() - max_idle_seconds
+        with self._lock:
+            stale = [sid for sid, row in self._rows.items() if row[2] < cutoff]
+            for sid in stale:
+                del self._rows[sid]
+            return len(stale)
+
+
+class SQLiteSessionBackend(SessionStateBackend):
+    """
+    SQLite file shared by every worker process on the host (WAL mode, so readers
+    don't block the writer). One connection per thread.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = str(path)
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_state (
+                session_id TEXT PRIMARY KEY,
+                version    INTEGER NOT NULL,
+                state      TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_version(self, session_id: str) -> Optional[int]:
+        row = self._conn().execute("SELECT version FROM session_state WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, session_id: str) -> Optional[Tuple[int, str]]:
+        row = self._conn().execute("SELECT version, state FROM session_state WHERE session_id = ?", (session_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save(self, session_id: str, state_json: str) -> int:
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT INTO session_state (session_id, version, state, updated_at) VALUES (?, 1, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    version = version + 1, state = excluded.state, updated_at = excluded.updated_at
+                """, (session_id, state_json, time.time()))
+            return conn.execute("SELECT version FROM session_state WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def delete(self, session_id: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+
+    def purge_idle(self, max_idle_seconds: float) -> int:
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("DELETE FROM session_state WHERE updated_at < ?", (time.time() - max_idle_seconds,))
+            return cursor.rowcount
+
+
+def backend_from_env(data_dir: Path) -> Optional[SessionStateBackend]:
+    """
+    SESSION_BACKEND= (unset: sessions live only in this process) | memory | sqlite
+    SESSION_BACKEND_PATH – SQLite file, default {data_dir}/session_state.sqlite3
+    """
+    kind = os.getenv("SESSION_BACKEND", "").lower()
+    if kind == "memory":
+        return MemorySessionBackend()
+    if kind == "sqlite":
+        return SQLiteSessionBackend(os.getenv("SESSION_BACKEND_PATH", str(Path(data_dir) / "session_state.sqlite3")))
+    if kind:
+        print(f"WARNING: Unknown SESSION_BACKEND '{kind}', keeping sessions in process memory only.")
+    return None
@@ -0,0 +1,272 @@
+from typing import Dict, Any, Callable, Optional, Iterator, List, Set
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from array import array
+import sys
+import threading
+import time
+import types
+
+print("session_store.py")
+
+
+# Objects the size walk never descends into (code, classes, modules, sync primitives)
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+                 types.MethodType, types.CodeType, type(threading.Lock()), type(threading.RLock()),
+                 threading.Thread, threading.Event, threading.Condition)
+
+
+def _children(obj) -> List[Any]:
+    if isinstance(obj, dict):
+        return [*obj.keys(), *obj.values()]
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, array)) or obj is None:
+        return []
+    children = []
+    attrs = getattr(obj, "__dict__", None)
+    if isinstance(attrs, dict):
+        children.append(attrs)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if isinstance(slot, str) and hasattr(obj, slot):
+            children.append(getattr(obj, slot))
+    return children
+
+
+def estimate_size(root: Any, exclude_ids: Set[int] = frozenset(), max_objects: int = 50000) -> int:
+    """
+    Approximate bytes reachable from root (sys.getsizeof over containers and instance
+    __dict__s). Objects in exclude_ids, e.g. premade quizzes shared by every session,
+    are not counted or walked into. Stops after max_objects so the cost stays bounded.
+    """
+    seen: Set[int] = set()
+    stack = [root]
+    total = 0
+    while stack and len(seen) < max_objects:
+        obj = stack.pop()
+        obj_id = id(obj)
+        if obj_id in seen or obj_id in exclude_ids or isinstance(obj, _OPAQUE_TYPES):
+            continue
+        seen.add(obj_id)
+        try:
+            total += sys.getsizeof(obj)
+            stack.extend(_children(obj))
+        except (TypeError, RuntimeError):  # RuntimeError: container changed size mid-walk
+            continue
+    return total
+
+
+class SessionStore(MutableMapping):
+    """
+    Thread-safe, dict-like home for per-session state with a memory ceiling.
+
+    max_sessions     – least recently used sessions are evicted beyond this count (None = no limit)
+    idle_ttl         – seconds without access before a session is evicted (None = never)
+    max_total_bytes  – sweep() evicts LRU sessions until the estimated total fits (None = no limit)
+    on_evict         – called as on_evict(session_id, session_data, reason) after removal,
+                       outside the lock; use it to close LLM chat handles
+    sweep_interval   – seconds between background sweeps once start_sweeper() is called
+
+    Reading a session (store[sid] / store.get(sid)) counts as access and refreshes its TTL.
+    """
+    def __init__(self,
+                 max_sessions: Optional[int] = None,
+                 idle_ttl: Optional[float] = None,
+                 max_total_bytes: Optional[int] = None,
+                 on_evict: Callable[[str, Dict[str, Any], str], None] = None,
+                 sweep_interval: float = 60.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_total_bytes = max_total_bytes
+        self.on_evict = on_evict
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.RLock()
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # LRU order, oldest first
+        self._last_access: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}  # estimates from the last sweep
+        self._shared_ids: Set[int] = set()
+
+        self._evictions: Dict[str, int] = {"ttl": 0, "lru": 0, "memory": 0, "manual": 0}
+        self._last_sweep_seconds: float = 0.0
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---------- dict interface ----------
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            session = self._sessions[session_id]
+            self._sessions.move_to_end(session_id)
+            self._last_access[session_id] = time.monotonic()
+            return session
+
+    def __setitem__(self, session_id: str, session: Dict[str, Any]):
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self._last_access[session_id] = time.monotonic()
+            evicted = self._pop_over_capacity()
+        self._notify(evicted, "lru")
+
+    def __delitem__(self, session_id: str):
+        with self._lock:
+            del self._sessions[session_id]
+            self._last_access.pop(session_id, None)
+            self._sizes.pop(session_id, None)
+
+    def __contains__(self, session_id) -> bool:
+        # Membership checks don't count as access
+        with self._lock:
+            return session_id in self._sessions
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._sessions.keys()))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def get_or_create(self, session_id: str, factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Atomic get-or-insert, so two requests of a new session can't race each other."""
+        with self._lock:
+            if session_id in self._sessions:
+                return self[session_id]
+            session = factory()
+            self._sessions[session_id] = session
+            self._last_access[session_id] = time.monotonic()
+            evicted = self._pop_over_capacity()
+        self._notify(evicted, "lru")
+        return session
+
+    # ---------- eviction ----------
+
+    def mark_shared(self, obj: Any, deep: bool = True):
+        """
+        Exclude obj (and with deep=True everything reachable from it) from per-session
+        size estimates. Register objects every session points at, such as premade quizzes.
+        """
+        with self._lock:
+            if not deep:
+                self._shared_ids.add(id(obj))
+                return
+            stack = [obj]
+            while stack:
+                item = stack.pop()
+                if id(item) in self._shared_ids or isinstance(item, _OPAQUE_TYPES):
+                    continue
+                self._shared_ids.add(id(item))
+                stack.extend(_children(item))
+
+    def evict(self, session_id: str, reason: str = "manual") -> bool:
+        with self._lock:
+            session = self._pop(session_id)
+            if session is None:
+                return False
+            self._evictions[reason] = self._evictions.get(reason, 0) + 1
+        self._notify([(session_id, session)], reason)
+        return True
+
+    def _pop(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+        self._sizes.pop(session_id, None)
+        return session
+
+    def _pop_over_capacity(self) -> List[tuple]:
+        evicted = []
+        if self.max_sessions is not None:
+            while len(self._sessions) > self.max_sessions:
+                session_id = next(iter(self._sessions))
+                evicted.append((session_id, self._pop(session_id)))
+                self._evictions["lru"] += 1
+        return evicted
+
+    def _notify(self, evicted: List[tuple], reason: str):
+        for session_id, session in evicted:
+            print(f"SessionStore: evicted session {session_id} ({reason})")
+            if self.on_evict is None:
+                continue
+            try:
+                self.on_evict(session_id, session, reason)
+            except Exception as e:
+                print(f"SessionStore: on_evict failed for {session_id}: {type(e).__name__} - {e}")
+
+    def sweep(self) -> int:
+        """
+        Evict idle sessions, then re-estimate session sizes and evict least recently used
+        sessions while over max_total_bytes. Returns the number of sessions evicted.
+        """
+        start = time.perf_counter()
+        expired, over_budget = [], []
+        with self._lock:
+            now = time.monotonic()
+            if self.idle_ttl is not None:
+                for session_id in list(self._sessions.keys()):
+                    if now - self._last_access.get(session_id, now) > self.idle_ttl:
+                        expired.append((session_id, self._pop(session_id)))
+                        self._evictions["ttl"] += 1
+
+            snapshot = list(self._sessions.items())
+            shared_ids = set(self._shared_ids)
+
+        # Walk sessions without holding the lock so requests aren't blocked meanwhile
+        sizes = {session_id: estimate_size(session, shared_ids) for session_id, session in snapshot}
+
+        with self._lock:
+            for session_id, size in sizes.items():
+                if session_id in self._sessions:
+                    self._sizes[session_id] = size
+
+            if self.max_total_bytes is not None:
+                total = sum(self._sizes.values())
+                while total > self.max_total_bytes and len(self._sessions) > 1:
+                    session_id = next(iter(self._sessions))
+                    total -= self._sizes.get(session_id, 0)
+                    over_budget.append((session_id, self._pop(session_id)))
+                    self._evictions["memory"] += 1
+            self._last_sweep_seconds = time.perf_counter() - start
+
+        self._notify(expired, "ttl")
+        self._notify(over_budget, "memory")
+        return len(expired) + len(over_budget)
+
+    def start_sweeper(self):
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=5)
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"SessionStore: sweep failed: {type(e).__name__} - {e}")
+
+    # ---------- metrics ----------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            idle = [now - t for t in self._last_access.values()]
+            sizes = list(self._sizes.values())
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl,
+                "max_total_bytes": self.max_total_bytes,
+                "estimated_total_bytes": sum(sizes),
+                "estimated_max_session_bytes": max(sizes) if sizes else 0,
+                "estimated_avg_session_bytes": sum(sizes) / len(sizes) if sizes else 0,
+                "oldest_idle_seconds": max(idle) if idle else 0.0,
+                "evictions": dict(self._evictions),
+                "last_sweep_seconds": self._last_sweep_seconds,
+            }
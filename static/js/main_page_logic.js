@@ -81,10 +81,10 @@ document.addEventListener('DOMContentLoaded', () => {
             <div>
                 <h2 class="text-xl font-semibold mb-2">${quizTitle}</h2>
                 <p class="text-sm text-text-secondary mb-4">${descriptionText}</p>
-                <p class="text-xs text-accent-blue mb-3">Custom Quiz - Processing</p>
+                <p class="text-xs text-accent-blue mb-3 generation-label">Custom Quiz - Processing</p>
                 <div class="flex items-center text-sm text-text-secondary">
                     <div class="spinner-small-dark mr-2" style="width: 16px; height: 16px; border: 2px solid var(--border-color); border-radius: 50%; border-top-color: var(--accent-blue);"></div>
-                    <span>Generating... Please wait. You can navigate away or create another quiz.</span>
+                    <span class="generation-status">Generating... Please wait. You can navigate away or create another quiz.</span>
                 </div>
             </div>
             <button class="btn btn-primary w-full select-quiz-btn mt-4" data-quiz-name="${quizId}" data-quiz-title="${quizTitle}" disabled style="opacity: 0.5; cursor: not-allowed;">
@@ -107,6 +107,80 @@ document.addEventListener('DOMContentLoaded', () => {
         } else {
             quizSelectionGrid.prepend(card);
         }
+
+        watchGenerationProgress(quizId, card);
+    }
+
+    function describeGenerationProgress(job) {
+        const progress = job.progress || {};
+        if (job.retrying) {
+            return `Hit a problem, retrying (attempt ${job.attempts + 1} of ${job.max_attempts})...`;
+        }
+        switch (progress.stage) {
+            case 'uploaded':
+                return 'Upload received. Waiting for a free generator...';
+            case 'pdf_extracted':
+                return progress.pages ? `Read ${progress.pages} pages of your PDF. Choosing a title...` : 'Read your PDF. Choosing a title...';
+            case 'title_generated':
+                return `Title: "${progress.title}". Planning questions...`;
+            case 'generating_questions':
+            case 'section_created':
+            case 'question_created':
+                return `Writing questions: ${progress.questions || 0} of ~${progress.target_questions} created (${progress.sections || 0} sections).`;
+            case 'precomputing_feedback':
+                return `Preparing answer feedback for ${progress.questions || 0} questions...`;
+            case 'saving':
+            case 'saved':
+            case 'ready':
+                return 'Saving your quiz...';
+            default:
+                return 'Generating... Please wait. You can navigate away or create another quiz.';
+        }
+    }
+
+    function watchGenerationProgress(quizId, card) {
+        if (!window.EventSource) return;
+        const statusSpan = card.querySelector('.generation-status');
+        const source = new EventSource(`/api/jobs/${encodeURIComponent(quizId)}/events`);
+
+        source.addEventListener('progress', (event) => {
+            const job = JSON.parse(event.data);
+            if (statusSpan) statusSpan.textContent = describeGenerationProgress(job);
+        });
+
+        source.addEventListener('done', (event) => {
+            source.close();
+            const job = JSON.parse(event.data);
+            const spinner = card.querySelector('.spinner-small-dark');
+            if (spinner) spinner.remove();
+            card.classList.remove('generating-quiz-card');
+
+            if (job.state === 'succeeded') {
+                const title = (job.progress && job.progress.title) || null;
+                const heading = card.querySelector('h2');
+                const label = card.querySelector('.generation-label');
+                const startButton = card.querySelector('.select-quiz-btn');
+                if (title && heading) heading.textContent = title;
+                if (label) label.textContent = 'Custom Quiz';
+                if (statusSpan) statusSpan.textContent = job.progress.questions ? `Ready! ${job.progress.questions} questions created.` : 'Ready!';
+                if (startButton) {
+                    if (title) startButton.dataset.quizTitle = title;
+                    startButton.disabled = false;
+                    startButton.style.opacity = '';
+                    startButton.style.cursor = '';
+                    startButton.textContent = 'Start Quiz';
+                }
+            } else if (statusSpan) {
+                statusSpan.textContent = 'Quiz generation failed. Please try again with this or another PDF.';
+            }
+        });
+
+        source.onerror = () => {
+            // The browser reconnects by itself while the server is reachable; give up once it stops trying
+            if (source.readyState === EventSource.CLOSED && statusSpan) {
+                statusSpan.textContent = 'Lost track of progress. Reload the page to check on your quiz.';
+            }
+        };
     }
 
 
@@ -405,6 +479,9 @@ document.addEventListener('DOMContentLoaded', () => {
                     // For example, using a toast notification library or a simple alert
                     // alert(data.message); // Simple alert for now
 
+                } else if (response.ok && data.status === 'ready') {
+                    // An identical document was already generated; the quiz is in the list right away
+                    window.location.reload();
                 } else {
                     uploadStatus.textContent = `Error: ${data.detail || 'Could not start quiz generation.'}`;
                     uploadStatus.className = 'status-error';
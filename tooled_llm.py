@@ -1,4 +1,4 @@
-from typing import List, TypedDict, Callable, Tuple
+from typing import List, TypedDict, Callable, Tuple, Optional
 import re
 import json
 
@@ -31,7 +31,11 @@ class ToolLLM:
                  directions: str = "",
                  tool_objects: List[Toolwrapper] = None,
                  model: str = "gemini-2.0-flash",
-                 action_prompt: str = ""):
+                 action_prompt: str = "",
+                 saved_state: dict = None,
+                 history_token_budget: Optional[int] = None,
+                 max_unimportant_messages: int = 20,
+                 max_merged_chars: int = 4000):
 
         self.response_instructions = """
             OUTPUT FORMAT REQUIREMENTS:
@@ -67,6 +71,11 @@ class ToolLLM:
         self.tool_instructions: str = ""
 
         self.unimportant_messages: List[str] = []
+        self.max_unimportant_messages = max_unimportant_messages
+        # Notes pushed out of the queue are condensed into one summary note rather than dropped
+        self.merged_messages: List[str] = []
+        self.merged_count: int = 0
+        self.max_merged_chars = max_merged_chars
 
         self.tools: TypedDict[str, Toolwrapper] = {}
         if tool_objects is not None:
@@ -87,41 +96,60 @@ class ToolLLM:
             Instructions are complete. Acknowledge your instructions and wait patiently.
         """
 
-        self.llm = chatapi.FlashChat(initial_prompt, model=model)
+        self.llm = chatapi.FlashChat(initial_prompt, model=model,
+                                     saved_history=saved_state.get("history") if saved_state else None,
+                                     history_token_budget=history_token_budget)
+        if saved_state:
+            self.unimportant_messages = list(saved_state.get("unimportant_messages", []))
+            self.merged_messages = list(saved_state.get("merged_messages", []))
+            self.merged_count = saved_state.get("merged_count", len(self.merged_messages))
 
         if action_prompt:
             self.prompt(action_prompt)
 
-    def seperate_llm_response(self, text: str) -> (str, list):
-        try:
-            prematch = re.search(r'^(.*?)\[', text, re.DOTALL)
-            thought = prematch.group(1) if prematch else ''
+    def _parse_llm_response(self, text: str) -> (str, list):
+        prematch = re.search(r'^(.*?)\[', text, re.DOTALL)
+        thought = prematch.group(1) if prematch else ''
 
-            postmatch = re.search(r'\[[\s\S]*\]', text)
-            actions = postmatch.group(0) if postmatch else "[]"
-            data = json.loads(actions)
+        postmatch = re.search(r'\[[\s\S]*\]', text)
+        actions = postmatch.group(0) if postmatch else "[]"
+        data = json.loads(actions)
 
-            if not (isinstance(data, list) and all(isinstance(item, dict) for item in data)):
-                #print("data is not the correct type, printing data: ")
-                #print(data)
+        if not (isinstance(data, list) and all(isinstance(item, dict) for item in data)):
+            #print("data is not the correct type, printing data: ")
+            #print(data)
 
-                if isinstance(data, list):
-                    inner_types = [type(item).__name__ for item in data]
-                    raise TypeError(f"Expected a list[dict], but got: list containing {inner_types}")
-                else:
-                    raise TypeError(f"Expected a list[dict] but got {type(data).__name__}")
+            if isinstance(data, list):
+                inner_types = [type(item).__name__ for item in data]
+                raise TypeError(f"Expected a list[dict], but got: list containing {inner_types}")
+            else:
+                raise TypeError(f"Expected a list[dict] but got {type(data).__name__}")
 
-            return thought, data
-        except Exception as e:
-            print(f"LLM message failed to parse. Asking them to send it again.")
-            print(f"\n'{text}'")
-            self.prompt(f"""
+        return thought, data
+
+    def _parse_failure_prompt(self, text: str, error: Exception) -> str:
+        print(f"LLM message failed to parse. Asking them to send it again.")
+        print(f"\n'{text}'")
+        return f"""
                 Your last message failed to be parsed.  
-                Error -> '{e}'
+                Error -> '{error}'
                 Send it again according to the response instructions so that it can be parsed properly.
                 You should not have any brackets '[', ']' in your thoughts.
                 {self.response_instructions}
-            """)
+            """
+
+    def seperate_llm_response(self, text: str) -> (str, list):
+        try:
+            return self._parse_llm_response(text)
+        except Exception as e:
+            self.prompt(self._parse_failure_prompt(text, e))
+            return "", []
+
+    async def aseperate_llm_response(self, text: str) -> (str, list):
+        try:
+            return self._parse_llm_response(text)
+        except Exception as e:
+            await self.aprompt(self._parse_failure_prompt(text, e))
             return "", []
 
     def preform_action(self, action_name: str, arguments: List[str]) -> str:
@@ -137,18 +165,83 @@ class ToolLLM:
         if urgent:
             return response
 
-        self.unimportant_messages.append(response)
+        self.add_unimportant_message(response)
         return ""
 
+    def add_unimportant_message(self, message: str):
+        """Queues message for the start of the next prompt instead of spending an LLM call on it now."""
+        self.unimportant_messages.append(message)
+        while len(self.unimportant_messages) > self.max_unimportant_messages:
+            self._merge_message(self.unimportant_messages.pop(0))
+
+    def _merge_message(self, message: str, max_chars: int = 160):
+        """Folds an overflowing note into the summary note; past max_merged_chars the oldest are only counted."""
+        condensed = " ".join(message.split())
+        if len(condensed) > max_chars:
+            condensed = f"{condensed[:max_chars - 1]}…"
+        self.merged_messages.append(condensed)
+        self.merged_count += 1
+        while len(self.merged_messages) > 1 and sum(len(text) for text in self.merged_messages) > self.max_merged_chars:
+            self.merged_messages.pop(0)
+
+    def _merged_summary(self) -> str:
+        if not self.merged_count:
+            return ""
+        unlisted = self.merged_count - len(self.merged_messages)
+        header = f"{self.merged_count} earlier notes, condensed (oldest first"
+        header += f"; the {unlisted} oldest are not listed):" if unlisted else "):"
+        return "\n".join([header] + [f"- {text}" for text in self.merged_messages])
+
+    def export_state(self) -> dict:
+        """JSON-safe conversation state; pass it back as saved_state to resume elsewhere."""
+        return {"history": self.llm.export_history(), "unimportant_messages": list(self.unimportant_messages),
+                "merged_messages": list(self.merged_messages), "merged_count": self.merged_count}
+
+    def close(self):
+        self.unimportant_messages = []
+        self.merged_messages = []
+        self.merged_count = 0
+        self.llm.close()
+
     def load_unimportant_messages(self) -> str:
-        if len(self.unimportant_messages) == 0:
+        if len(self.unimportant_messages) == 0 and not self.merged_count:
             return ""
-        messages = ""
+        messages = f"{self._merged_summary()}\n" if self.merged_count else ""
         for text in self.unimportant_messages:
             messages = f"{messages}{text}\n"
         self.unimportant_messages = []
+        self.merged_messages = []
+        self.merged_count = 0
         return f"{messages}\n"
 
+    def _run_actions(self, data: list) -> str:
+        """Runs one parsed action list and returns the follow-up prompt ("" when nothing is urgent)."""
+        print(f"Processing {len(data)} actions")
+
+        if isinstance(data, dict):
+            print("Converting dict to list")
+            data = [data]
+
+        prompt: str = ""
+        for block_index, block in enumerate(data):
+            print(f"Processing action block {block_index}: {block}")
+            action = block.get("action")
+
+            if action is None:
+                print(f"No action in block {block_index}, skipping")
+                continue
+
+            arguments: List[str] = block.get("args", [])
+            print(f"Action: {action}, Arguments: {arguments}")
+
+            result = self.preform_action(action, arguments)
+            print(f"Action result: {result}")
+
+            if result != "":
+                prompt = f"{prompt}{result}\n"
+                print(f"Updated prompt: {prompt}")
+        return prompt
+
     def prompt(self, user_prompt: str):
         print(f"ToolLLM.prompt called with user_prompt: {user_prompt}")
 
@@ -172,30 +265,7 @@ class ToolLLM:
 
         # Process actions
         while len(data):
-            print(f"Processing {len(data)} actions")
-
-            if isinstance(data, dict):
-                print("Converting dict to list")
-                data = [data]
-
-            prompt: str = ""
-            for block_index, block in enumerate(data):
-                print(f"Processing action block {block_index}: {block}")
-                action = block.get("action")
-
-                if action is None:
-                    print(f"No action in block {block_index}, skipping")
-                    continue
-
-                arguments: List[str] = block.get("args", [])
-                print(f"Action: {action}, Arguments: {arguments}")
-
-                result = self.preform_action(action, arguments)
-                print(f"Action result: {result}")
-
-                if result != "":
-                    prompt = f"{prompt}{result}\n"
-                    print(f"Updated prompt: {prompt}")
+            prompt = self._run_actions(data)
 
             if prompt == "":
                 print("No prompt generated, breaking loop")
@@ -210,3 +280,22 @@ class ToolLLM:
             print(f"Follow-up parsed data: {data}")
 
         print("ToolLLM.prompt completed")
+
+    async def aprompt(self, user_prompt: str):
+        """Async version of prompt; the action loop awaits FlashChat.aprompt instead of blocking."""
+        print(f"ToolLLM.aprompt called with user_prompt: {user_prompt}")
+
+        full_prompt = f"{self.load_unimportant_messages()}{user_prompt}"
+        llm_response: str = await self.llm.aprompt(full_prompt)
+        thoughts, data = await self.aseperate_llm_response(llm_response)
+
+        while len(data):
+            prompt = self._run_actions(data)
+
+            if prompt == "":
+                break
+
+            llm_response = await self.llm.aprompt(f"{self.load_unimportant_messages()}{prompt}")
+            thoughts, data = await self.aseperate_llm_response(llm_response)
+
+        print("ToolLLM.aprompt completed")
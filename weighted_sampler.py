@@ -0,0 +1,143 @@
+from typing import List, Tuple, Optional
+from array import array
+import random
+
+print("weighted_sampler.py")
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over non-negative float weights.
+    set() and find() are O(log n); total() is O(1).
+    """
+    # Float updates accumulate rounding error; rebuild from the exact values every so often.
+    REBUILD_EVERY = 4096
+
+    def __init__(self, values: List[float]):
+        # array('d') keeps a copy down to 8 bytes per weight (see QuizSampler.clone)
+        self.values = array('d', values)
+        self._rebuild()
+
+    def copy(self) -> "FenwickTree":
+        clone = FenwickTree.__new__(FenwickTree)
+        clone.values = array('d', self.values)
+        clone._tree = array('d', self._tree)
+        clone._total = self._total
+        clone._updates = self._updates
+        clone._top_bit = self._top_bit
+        return clone
+
+    def _rebuild(self):
+        n = len(self.values)
+        tree = array('d', bytes(8 * (n + 1)))
+        for i, value in enumerate(self.values, start=1):
+            tree[i] += value
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._total = sum(self.values)
+        self._updates = 0
+        self._top_bit = 1 << (n.bit_length() - 1) if n else 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def total(self) -> float:
+        return self._total
+
+    def set(self, index: int, value: float):
+        value = float(value)
+        delta = value - self.values[index]
+        if delta == 0:
+            return
+        self.values[index] = value
+        self._updates += 1
+        if self._updates >= self.REBUILD_EVERY:
+            self._rebuild()
+            return
+        self._total += delta
+        i = index + 1
+        n = len(self.values)
+        while i <= n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, target: float) -> int:
+        """Index of the item whose cumulative weight range contains target (0 <= target < total)."""
+        pos = 0
+        step = self._top_bit
+        n = len(self.values)
+        while step:
+            nxt = pos + step
+            if nxt <= n and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        # Rounding can push target past the last item; walk back to one that can be picked
+        if pos >= n:
+            pos = n - 1
+        while pos > 0 and self.values[pos] <= 0:
+            pos -= 1
+        return pos
+
+
+class QuizSampler:
+    """
+    Incremental version of Quiz.pick_question's two-step draw:
+      1) pick a section weighted by the average weight of its questions
+      2) pick a question in that section weighted by its own weight
+    One FenwickTree per section plus one over the section averages, so picks and
+    weight updates are O(log n). Questions report weight changes through
+    weight_changed(), which Question.weight's setter calls.
+    """
+    def __init__(self, sections: List[List[object]], short_answer_type: type):
+        self.shape: Tuple[int, ...] = tuple(len(questions) for questions in sections)
+        self.section_trees: List[FenwickTree] = []
+        # First questions are picked uniformly among non-ShortAnswer questions, as before
+        self.first_question_pool: List[Tuple[int, int]] = []
+
+        for i, questions in enumerate(sections):
+            self.section_trees.append(FenwickTree([q.weight for q in questions]))
+            for j, question in enumerate(questions):
+                question._weight_listener = self
+                question._sampler_pos = (i, j)
+                if not isinstance(question, short_answer_type):
+                    self.first_question_pool.append((i, j))
+
+        self.section_tree = FenwickTree([self._section_average(i) for i in range(len(sections))])
+
+    def clone(self) -> "QuizSampler":
+        """
+        Independent copy of the weights (a memcpy of the trees) for a session overlay.
+        Questions are not re-registered; the caller attaches its own question copies.
+        """
+        clone = QuizSampler.__new__(QuizSampler)
+        clone.shape = self.shape
+        clone.section_trees = [tree.copy() for tree in self.section_trees]
+        clone.first_question_pool = self.first_question_pool  # never mutated, safe to share
+        clone.section_tree = self.section_tree.copy()
+        return clone
+
+    def _section_average(self, section_index: int) -> float:
+        tree = self.section_trees[section_index]
+        return tree.total() / len(tree) if len(tree) else 0.0
+
+    def weight_changed(self, question) -> None:
+        i, j = question._sampler_pos
+        self.section_trees[i].set(j, question.weight)
+        self.section_tree.set(i, self._section_average(i))
+
+    def pick(self, is_first_question: bool = False, rng: Optional[random.Random] = None) -> Tuple[int, int]:
+        rng = rng or random
+        if is_first_question and self.first_question_pool:
+            return rng.choice(self.first_question_pool)
+
+        total = self.section_tree.total()
+        if total <= 0:
+            raise ValueError("No valid sections with eligible questions found.")
+        section_index = self.section_tree.find(rng.random() * total)
+
+        tree = self.section_trees[section_index]
+        question_index = tree.find(rng.random() * tree.total())
+        return section_index, question_index
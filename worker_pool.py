@@ -0,0 +1,116 @@
+from typing import Dict, Callable, Any, Optional, Tuple
+import itertools
+import queue
+import threading
+import time
+
+from llm_executor import LaneStats, LaneFullError
+
+print("worker_pool.py")
+
+
+class WorkerLane:
+    """
+    One class of background work with its own queue and worker threads, so slow jobs in
+    one lane never sit in front of quick jobs in another. Within a lane, lower priority
+    numbers run first; equal priorities run in submission order.
+    """
+    _STOP = object()
+
+    def __init__(self, name: str, workers: int, max_pending: Optional[int] = None):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.stats = LaneStats()
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._threads = []
+
+    def start(self):
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._threads = [threading.Thread(target=self._work, name=f"worker-{self.name}-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        print(f"Worker lane '{self.name}' started with {self.workers} thread(s).")
+
+    def submit(self, fn: Callable[..., Any], *args, priority: int = 0, **kwargs):
+        if self.max_pending is not None and self.stats.waiting >= self.max_pending:
+            self.stats.reject()
+            raise LaneFullError(self.name, self.stats.waiting)
+        self.stats.enqueued()
+        self._queue.put((priority, next(self._counter), (fn, args, kwargs, time.perf_counter())))
+
+    def _work(self):
+        while True:
+            _, _, item = self._queue.get()
+            if item is WorkerLane._STOP:
+                self._queue.task_done()
+                break
+            fn, args, kwargs, enqueued_at = item
+            self.stats.started(time.perf_counter() - enqueued_at)
+            run_start = time.perf_counter()
+            ok = False
+            try:
+                fn(*args, **kwargs)
+                ok = True
+            except Exception as e:
+                print(f"Worker lane '{self.name}': task {getattr(fn, '__name__', fn)} failed: {type(e).__name__} - {e}")
+            finally:
+                self.stats.finished(time.perf_counter() - run_start, ok)
+                self._queue.task_done()
+
+    def stop(self, timeout: float = 5.0):
+        # Stop markers sort after every queued task, so accepted work drains first
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._counter), WorkerLane._STOP))
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        alive = sum(thread.is_alive() for thread in self._threads)
+        if alive:
+            print(f"Worker lane '{self.name}': {alive} thread(s) did not stop within {timeout}s.")
+
+
+class WorkerPool:
+    """
+    Background task threads split into named lanes.
+
+    Example
+    -------
+    pool = WorkerPool({"interactive": (4, None), "generation": (2, 50)})
+    pool.start()
+    pool.submit("interactive", init_tutor, session_id, quiz_key)
+    """
+    def __init__(self, lanes: Dict[str, Tuple[int, Optional[int]]]):
+        self.lanes: Dict[str, WorkerLane] = {}
+        for name, (workers, max_pending) in lanes.items():
+            self.lanes[name] = WorkerLane(name, workers, max_pending)
+
+    def lane(self, name: str) -> WorkerLane:
+        lane = self.lanes.get(name)
+        if lane is None:
+            raise KeyError(f"Unknown worker lane '{name}'")
+        return lane
+
+    def start(self):
+        for lane in self.lanes.values():
+            lane.start()
+
+    def submit(self, lane_name: str, fn: Callable[..., Any], *args, priority: int = 0, **kwargs):
+        """Queue fn(*args, **kwargs) on a lane. Raises LaneFullError if the lane's queue is full."""
+        self.lane(lane_name).submit(fn, *args, priority=priority, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for name, lane in self.lanes.items():
+            snapshot = lane.stats.snapshot()
+            snapshot["workers"] = lane.workers
+            snapshot["max_pending"] = lane.max_pending
+            result[name] = snapshot
+        return result
+
+    def stop(self, timeout: float = 5.0):
+        for lane in self.lanes.values():
+            lane.stop(timeout)